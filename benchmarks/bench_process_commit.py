@@ -0,0 +1,94 @@
+"""Microbenchmark of parser.process_commit on multi-op commits.
+
+Compares the current implementation, which decodes the CAR blocks once per
+commit and writes through a PartitionWriter, with the previous one, which
+decoded them and reopened the output file once per op.
+
+    python -m benchmarks.bench_process_commit --commits 2000 --ops 8
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Callable
+
+from atproto import CAR, AtUri, models
+
+import sinitaivas_live.parser as parser
+from sinitaivas_live.writer import PartitionWriter
+import utils.datetime_utils as dt_utils
+import utils.files_storage as fs
+from tests.support.synthetic import make_commits
+
+
+def _legacy_process_commit(commit: models.ComAtprotoSyncSubscribeRepos.Commit) -> None:
+    """process_commit as it was before, decoding the CAR once per op."""
+    for op in commit.ops:
+        current_utc_time = dt_utils.current_datetime_utc()
+        current_utc_time_str = dt_utils.datetime_as_date_and_hour_str(current_utc_time)
+        current_utc_date_str = dt_utils.datetime_as_date_str(current_utc_time)
+        prefix = f"{fs.current_dir()}/firehose_stream/{current_utc_date_str}"
+        fs.create_dir_if_not_exists(prefix)
+        output_filename = f"{prefix}/{current_utc_time_str}.ndjson"
+
+        commit_event = parser._init_commit_event(commit)
+        commit_event = parser._add_current_utc_time_to_commit_event(
+            commit_event, current_utc_time_str
+        )
+        commit_event = parser._update_commit_event_with_op(commit_event, op)
+        uri = AtUri.from_str(f"at://{commit.repo}/{op.path}")
+        commit_event = parser._update_commit_event_with_uri(commit_event, uri)
+        car = CAR.from_bytes(commit.blocks)
+        commit_event = parser._extract_record_from_blocks(commit_event, car, op)
+        with open(output_filename, "a", encoding="utf-8") as json_file:
+            json_file.write(json.dumps(commit_event) + "\n")
+
+
+def _ops_per_second(
+    process: Callable[[models.ComAtprotoSyncSubscribeRepos.Commit], None],
+    commits: list[models.ComAtprotoSyncSubscribeRepos.Commit],
+    repeat: int,
+) -> float:
+    n_ops = sum(len(commit.ops) for commit in commits)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for commit in commits:
+            process(commit)
+        best = min(best, time.perf_counter() - start)
+    return n_ops / best
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--commits", type=int, default=1000)
+    args.add_argument("--ops", type=int, default=8, help="ops per commit")
+    args.add_argument("--repeat", type=int, default=3)
+    options = args.parse_args()
+
+    commits = make_commits(options.commits, n_ops=options.ops)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as output_dir:
+        os.chdir(output_dir)
+        try:
+            before = _ops_per_second(_legacy_process_commit, commits, options.repeat)
+            writer = PartitionWriter()
+            after = _ops_per_second(
+                lambda commit: parser.process_commit(commit, writer),
+                commits,
+                options.repeat,
+            )
+            writer.close()
+        finally:
+            os.chdir(cwd)
+
+    print(f"{options.commits} commits x {options.ops} ops")
+    print(f"before (per op):     {before:>10,.0f} ops/s")
+    print(f"after  (per commit): {after:>10,.0f} ops/s")
+    print(f"speedup:             {after / before:>10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Records per second of parser.process_commit in each record mode.
+
+"model" validates every record with its lexicon model, "raw" emits the
+decoded CAR block with CIDs and bytes converted to strings. The lines are
+collected in memory, so the numbers do not include disk writes.
+
+    python -m benchmarks.bench_record_mode --commits 5000 --ops 1
+"""
+
+import argparse
+import time
+
+from atproto import models
+
+import sinitaivas_live.parser as parser
+from sinitaivas_live.workers import EncodedMessage
+from tests.support.synthetic import make_commits
+from utils.json_lines import get_line_encoder
+from utils.logging import logger
+
+
+def _records_per_second(
+    options: parser.ParseOptions,
+    commits: list[models.ComAtprotoSyncSubscribeRepos.Commit],
+    repeat: int,
+) -> float:
+    n_records = sum(
+        1 for commit in commits for op in commit.ops if op.action != "delete"
+    )
+    best = float("inf")
+    for _ in range(repeat):
+        collected = EncodedMessage()
+        start = time.perf_counter()
+        for commit in commits:
+            parser.process_commit(commit, collected, options)
+        best = min(best, time.perf_counter() - start)
+    return n_records / best
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--commits", type=int, default=5000)
+    args.add_argument("--ops", type=int, default=1, help="ops per commit")
+    args.add_argument("--repeat", type=int, default=3)
+    args.add_argument("--json-backend", default="json", choices=["json", "orjson"])
+    options = args.parse_args()
+
+    # the unknown collections of the corpus log a warning in model mode
+    logger.remove()
+    commits = make_commits(options.commits, n_ops=options.ops)
+    encode_line = get_line_encoder(options.json_backend)
+    modes: tuple[parser.RecordMode, ...] = ("model", "raw")
+    results = {
+        mode: _records_per_second(
+            parser.ParseOptions(record_mode=mode, encode_line=encode_line),
+            commits,
+            options.repeat,
+        )
+        for mode in modes
+    }
+
+    print(f"{options.commits} commits x {options.ops} ops, {options.json_backend}")
+    for mode, records_per_second in results.items():
+        print(f"{mode:<6} {records_per_second:>10,.0f} records/s")
+    print(f"raw/model {results['raw'] / results['model']:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
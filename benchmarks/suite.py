@@ -0,0 +1,340 @@
+"""Benchmark suite of the parser, writer and checkpoint hot paths.
+
+Each benchmark is run `--repeat` times and its best rate is kept. The results
+are written to JSON, and compared with the results of a previous run when a
+baseline is given: a benchmark slower than the baseline by more than
+`--threshold` is a regression, and makes the run fail.
+
+    python -m benchmarks.suite --output main.json
+    python -m benchmarks.suite --baseline main.json --output branch.json
+    python -m benchmarks.suite --only process_commit --only replay
+
+Compare runs made on the same, otherwise idle, machine: the rates depend on
+it, and a busy or shared machine varies by more than the default threshold.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from atproto import CAR, models
+
+import sinitaivas_live.parser as parser
+import utils.bytes_io as bytes_io
+import utils.datetime_utils as dt_utils
+from sinitaivas_live.capture import CaptureWriter, ReplayClient
+from sinitaivas_live.checkpoint import CheckpointManager
+from sinitaivas_live.streamer import MessageHandler
+from sinitaivas_live.workers import EncodedMessage
+from sinitaivas_live.writer import PartitionWriter
+from tests.support.synthetic import (
+    COLLECTION_MIX,
+    iter_commit_frames,
+    make_commits,
+    make_record,
+)
+from utils.compression import Compression
+from utils.logging import logger
+
+# a run returns the number of items it processed and the seconds it took
+Run = Callable[[], tuple[int, float]]
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    """A benchmark of the suite.
+
+    Attributes:
+        name (str): The name of the benchmark, the key of its result.
+        unit (str): What is counted, e.g. "ops".
+        run (Run): Runs the benchmark once.
+    """
+
+    name: str
+    unit: str
+    run: Run
+
+
+def _timed(function: Callable[[], int]) -> tuple[int, float]:
+    started_at = time.perf_counter()
+    count = function()
+    return count, time.perf_counter() - started_at
+
+
+def _process_commit(n_commits: int, n_ops: int) -> Run:
+    commits = make_commits(n_commits, n_ops=n_ops)
+
+    def run() -> tuple[int, float]:
+        collected = EncodedMessage()
+        started_at = time.perf_counter()
+        for commit in commits:
+            parser.process_commit(commit, collected)
+        return len(collected.lines), time.perf_counter() - started_at
+
+    return run
+
+
+def _extract_record(n_records: int, collection: str) -> Run:
+    ops: list[tuple[CAR, models.ComAtprotoSyncSubscribeRepos.RepoOp]] = []
+    for commit in make_commits(n_records, collections=[collection]):
+        car = CAR.from_bytes(commit.blocks)
+        ops.extend((car, op) for op in commit.ops if op.action == "create")
+
+    def run() -> tuple[int, float]:
+        started_at = time.perf_counter()
+        for car, op in ops:
+            parser._extract_record_from_blocks({}, car, op)
+        return len(ops), time.perf_counter() - started_at
+
+    return run
+
+
+def _nested_payload(rng: random.Random, depth: int) -> Any:
+    """A record-like payload with bytes at every level."""
+    payload: dict[str, Any] = {
+        "text": " ".join(rng.choices(["sky", "firehose", "kiitos"], k=8)),
+        "cid": rng.randbytes(36),
+        "tags": [rng.randbytes(4) for _ in range(4)],
+    }
+    if depth > 0:
+        payload["children"] = [_nested_payload(rng, depth - 1) for _ in range(2)]
+    return payload
+
+
+def _convert_bytes_to_str(n_payloads: int) -> Run:
+    rng = random.Random(0)
+    payloads = [_nested_payload(rng, 4) for _ in range(n_payloads)]
+
+    def run() -> tuple[int, float]:
+        started_at = time.perf_counter()
+        for payload in payloads:
+            bytes_io.convert_bytes_to_str(payload)
+        return len(payloads), time.perf_counter() - started_at
+
+    return run
+
+
+def _checkpoint(n_messages: int, flush_every: int, directory: str) -> Run:
+    def run() -> tuple[int, float]:
+        checkpoint = CheckpointManager(
+            None,
+            lambda: None,
+            path=f"{directory}/cursors-{flush_every}.json",
+            flush_every=flush_every,
+            flush_interval_ms=3_600_000,
+        )
+        return _timed(lambda: _advance(checkpoint, n_messages))
+
+    return run
+
+
+def _advance(checkpoint: CheckpointManager, n_messages: int) -> int:
+    for seq in range(1, n_messages + 1):
+        checkpoint.advance(seq)
+    checkpoint.flush()
+    return n_messages
+
+
+def _write(n_lines: int, compression: Compression, directory: str) -> Run:
+    rng = random.Random(0)
+    lines = [
+        (json.dumps(make_record("app.bsky.feed.post", rng), default=str) + "\n")
+        for _ in range(1000)
+    ]
+    encoded = [line.encode() for line in lines]
+    partition = dt_utils.datetime_as_date_and_hour_str(dt_utils.current_datetime_utc())
+
+    def run() -> tuple[int, float]:
+        root = tempfile.mkdtemp(dir=directory)
+        writer = PartitionWriter(root, compression=compression)
+        started_at = time.perf_counter()
+        for i in range(n_lines):
+            writer.write(partition, encoded[i % len(encoded)])
+        writer.close()
+        return n_lines, time.perf_counter() - started_at
+
+    return run
+
+
+def _replay(n_frames: int, directory: str) -> Run:
+    capture_path = f"{directory}/replay.cap"
+    capture = CaptureWriter(capture_path)
+    for seq, frame in enumerate(iter_commit_frames(), start=1):
+        capture.write_frame(frame, seq)
+        if seq == n_frames:
+            break
+    capture.close()
+
+    def run() -> tuple[int, float]:
+        root = tempfile.mkdtemp(dir=directory)
+        client = ReplayClient(capture_path)
+        writer = PartitionWriter(root)
+        checkpoint = CheckpointManager(client, writer.sync, path=f"{root}/cursors.json")
+        handler = MessageHandler(checkpoint, writer)
+        started_at = time.perf_counter()
+        client.start(handler)
+        handler.close()
+        checkpoint.flush()
+        writer.close()
+        return client.frames, time.perf_counter() - started_at
+
+    return run
+
+
+def benchmarks(directory: str, scale: float = 1.0) -> list[Benchmark]:
+    """The benchmarks of the suite.
+
+    Parameters:
+        directory (str): A scratch directory for the files they write.
+        scale (float): Multiplier of the number of items of each benchmark.
+
+    Returns:
+        benchmarks (list[Benchmark]): The benchmarks, set up and ready to run.
+    """
+
+    def n(count: int) -> int:
+        return max(1, int(count * scale))
+
+    suite = [
+        Benchmark("process_commit/1_op", "ops", _process_commit(n(2000), 1)),
+        Benchmark("process_commit/8_ops", "ops", _process_commit(n(250), 8)),
+    ]
+    for collection, _ in COLLECTION_MIX:
+        if collection.startswith("app.bsky."):
+            suite.append(
+                Benchmark(
+                    f"extract_record/{collection}",
+                    "records",
+                    _extract_record(n(1000), collection),
+                )
+            )
+    suite += [
+        Benchmark(
+            "convert_bytes_to_str/nested", "payloads", _convert_bytes_to_str(n(1000))
+        ),
+        Benchmark(
+            "checkpoint/advance", "messages", _checkpoint(n(200_000), 1000, directory)
+        ),
+        Benchmark("checkpoint/flush", "messages", _checkpoint(n(500), 1, directory)),
+        Benchmark("writer/none", "lines", _write(n(50_000), "none", directory)),
+        Benchmark("writer/gzip", "lines", _write(n(50_000), "gzip", directory)),
+        Benchmark("replay/end_to_end", "frames", _replay(n(3000), directory)),
+    ]
+    return suite
+
+
+def run_benchmark(benchmark: Benchmark, repeat: int) -> dict[str, Any]:
+    """Run a benchmark `repeat` times and keep its best rate.
+
+    Parameters:
+        benchmark (Benchmark): The benchmark to run.
+        repeat (int): How many times to run it.
+
+    Returns:
+        result (dict[str, Any]): The unit, count, best time and rate per second.
+    """
+    best_count, best_seconds = 0, float("inf")
+    for _ in range(max(1, repeat)):
+        count, seconds = benchmark.run()
+        if seconds / max(count, 1) < best_seconds / max(best_count, 1):
+            best_count, best_seconds = count, seconds
+    return {
+        "unit": benchmark.unit,
+        "count": best_count,
+        "seconds": round(best_seconds, 6),
+        "per_second": round(best_count / best_seconds, 1) if best_seconds else 0.0,
+    }
+
+
+def compare(
+    results: dict[str, Any], baseline: dict[str, Any], threshold: float
+) -> list[str]:
+    """Print the change of each benchmark from a baseline.
+
+    Parameters:
+        results (dict[str, Any]): The results of this run, by benchmark.
+        baseline (dict[str, Any]): The results of the baseline, by benchmark.
+        threshold (float): The slowdown, as a fraction, beyond which a
+            benchmark is a regression.
+
+    Returns:
+        regressions (list[str]): The names of the benchmarks that regressed.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name, {}).get("per_second")
+        if not before:
+            print(f"{name:<45} {result['per_second']:>12,.0f}  (new)")
+            continue
+        change = result["per_second"] / before - 1
+        regressed = change < -threshold
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<45} {result['per_second']:>12,.0f} {before:>12,.0f}"
+            f" {change:>+8.1%}{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--output", help="write the results to this JSON file")
+    args.add_argument("--baseline", help="compare with the results of this file")
+    args.add_argument("--threshold", type=float, default=0.2)
+    args.add_argument("--repeat", type=int, default=5)
+    args.add_argument("--scale", type=float, default=1.0)
+    args.add_argument(
+        "--only", action="append", default=[], help="name prefix (repeatable)"
+    )
+    options = args.parse_args()
+
+    # the unknown collections and invalid bytes of the corpus log warnings
+    logger.remove()
+    baseline: Optional[dict[str, Any]] = None
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)["benchmarks"]
+
+    results: dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for benchmark in benchmarks(directory, options.scale):
+            if options.only and not any(
+                benchmark.name.startswith(prefix) for prefix in options.only
+            ):
+                continue
+            results[benchmark.name] = run_benchmark(benchmark, options.repeat)
+            if baseline is None:
+                result = results[benchmark.name]
+                print(
+                    f"{benchmark.name:<45} {result['per_second']:>12,.0f}"
+                    f" {benchmark.unit}/s"
+                )
+
+    if options.output:
+        document = {
+            "created_at": dt_utils.current_datetime_utc().isoformat(),
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()} {os.cpu_count()}",
+            "benchmarks": results,
+        }
+        with open(options.output, "w") as f:
+            json.dump(document, f, indent=2)
+            f.write("\n")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, options.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {options.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
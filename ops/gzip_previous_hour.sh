@@ -33,13 +33,19 @@ fi
 date_part=$(date -u -d '2 hours ago' +'%Y-%m-%d')
 hour_part=$(date -u -d '2 hours ago' +'%Y-%m-%dT%H')
 
-file_to_gzip="$DATA_DIR/$date_part/$hour_part.ndjson"
-
-echo "Looking for file to gzip: $file_to_gzip"
-
-if [[ -f "$file_to_gzip" ]]; then
-  gzip "$file_to_gzip"
-  echo "✔ Gzipped: $file_to_gzip"
-else
-  echo "⚠ File not found, skipping: $file_to_gzip"
-fi
\ No newline at end of file
+# the hourly file, and the hourly files of the collection shards
+# (--shard-by-collection), in YYYY-MM-DD/<collection>/
+echo "Looking for files to gzip: $DATA_DIR/$date_part/[*/]$hour_part.ndjson"
+
+found=0
+for file_to_gzip in "$DATA_DIR/$date_part/$hour_part.ndjson" "$DATA_DIR/$date_part"/*/"$hour_part.ndjson"; do
+  if [[ -f "$file_to_gzip" ]]; then
+    gzip "$file_to_gzip"
+    echo "✔ Gzipped: $file_to_gzip"
+    found=1
+  fi
+done
+
+if (( ! found )); then
+  echo "⚠ File not found, skipping: $DATA_DIR/$date_part/$hour_part.ndjson"
+fi
@@ -0,0 +1,304 @@
+import os
+import struct
+import time
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Iterator, Optional
+
+import libipld
+from atproto import firehose_models, models
+
+from utils.logging import logger
+
+# first bytes of a capture file, with the version of the format
+MAGIC = b"SINICAP1"
+
+# before each frame: its length, its seq (-1 if it has none) and the wall
+# clock time it was received, in nanoseconds
+_RECORD_HEADER = struct.Struct(">Iqq")
+
+_NO_SEQ = -1
+
+
+@dataclass(frozen=True)
+class CapturedFrame:
+    """A websocket frame read from a capture file.
+
+    Attributes:
+        seq (int | None): The seq of the message, None if it has none.
+        received_at_ns (int): When the frame was received, in nanoseconds
+            since the epoch.
+        frame (bytes): The frame, header and body, as sent by the relay.
+    """
+
+    seq: Optional[int]
+    received_at_ns: int
+    frame: bytes
+
+
+def encode_message_frame(message: firehose_models.MessageFrame) -> bytes:
+    """Encode a message frame back to its websocket bytes. DAG-CBOR has a
+    single encoding of a value, so the bytes are the ones sent by the relay.
+
+    Parameters:
+        message (firehose_models.MessageFrame): The decoded message frame.
+
+    Returns:
+        frame (bytes): The header and body of the frame.
+    """
+    return libipld.encode_dag_cbor(
+        {"op": 1, "t": message.type}
+    ) + libipld.encode_dag_cbor(message.body)
+
+
+class CaptureWriter:
+    """Append the frames received from the relay to a capture file, to replay
+    them later with `ReplayClient`.
+
+    The file starts with `MAGIC`, then each frame is written after its length,
+    seq and time of reception. A frame cut by a crash at the end of the file
+    is ignored when reading it, and the next frames are appended after it.
+
+    Parameters:
+        path (str): The capture file, created if it does not exist.
+
+    Raises:
+        ValueError: If the file exists and is not a capture file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._file: BinaryIO = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        else:
+            with open(path, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    self._file.close()
+                    raise ValueError(f"Not a capture file: {path}")
+            # do not append to a frame cut by a crash
+            length = _complete_length(path)
+            if length < self._file.tell():
+                logger.bind(file=path).warning("Dropping incomplete captured frame")
+                self._file.truncate(length)
+                self._file.seek(length)
+        self.frames = 0
+
+    def wrap(
+        self, handler: Callable[[firehose_models.MessageFrame], None]
+    ) -> Callable[[firehose_models.MessageFrame], None]:
+        """Wrap a message handler to capture each message before handling it.
+
+        Parameters:
+            handler (Callable[[MessageFrame], None]): Processes each message.
+
+        Returns:
+            handler (Callable[[MessageFrame], None]): The capturing handler.
+        """
+
+        def capturing_handler(message: firehose_models.MessageFrame) -> None:
+            try:
+                self.write(message)
+            except Exception as e:
+                logger.bind(file=self._path).error(f"Failed to capture frame: {e}")
+            handler(message)
+
+        return capturing_handler
+
+    def write(self, message: firehose_models.MessageFrame) -> None:
+        """Append a message to the capture file.
+
+        Parameters:
+            message (firehose_models.MessageFrame): The decoded message frame.
+
+        Returns:
+            None
+        """
+        seq = message.body.get("seq")
+        self.write_frame(
+            encode_message_frame(message), seq if isinstance(seq, int) else None
+        )
+
+    def write_frame(self, frame: bytes, seq: Optional[int] = None) -> None:
+        """Append the bytes of a frame to the capture file.
+
+        Parameters:
+            frame (bytes): The header and body of the frame.
+            seq (int | None): The seq of the message, if it has one.
+
+        Returns:
+            None
+        """
+        self._file.write(
+            _RECORD_HEADER.pack(
+                len(frame), _NO_SEQ if seq is None else seq, time.time_ns()
+            )
+        )
+        self._file.write(frame)
+        self.frames += 1
+
+    def close(self) -> None:
+        """Flush and close the capture file.
+
+        Returns:
+            None
+        """
+        self._file.close()
+        logger.bind(file=self._path, frames=self.frames).info("Closed capture file")
+
+
+def read_capture(path: str) -> Iterator[CapturedFrame]:
+    """Read the frames of a capture file, in order.
+
+    Parameters:
+        path (str): The capture file.
+
+    Returns:
+        frames (Iterator[CapturedFrame]): The frames, up to the last complete one.
+
+    Raises:
+        ValueError: If the file is not a capture file.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a capture file: {path}")
+        while header := f.read(_RECORD_HEADER.size):
+            if len(header) < _RECORD_HEADER.size:
+                return
+            length, seq, received_at_ns = _RECORD_HEADER.unpack(header)
+            frame = f.read(length)
+            if len(frame) < length:
+                return
+            yield CapturedFrame(None if seq == _NO_SEQ else seq, received_at_ns, frame)
+
+
+def _complete_length(path: str) -> int:
+    """Get the length of the complete frames of a capture file, with its magic.
+
+    Parameters:
+        path (str): The capture file.
+
+    Returns:
+        length (int): The offset of the end of the last complete frame.
+    """
+    size = os.path.getsize(path)
+    end = offset = len(MAGIC)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while header := f.read(_RECORD_HEADER.size):
+            if len(header) < _RECORD_HEADER.size:
+                break
+            length = _RECORD_HEADER.unpack(header)[0]
+            offset += _RECORD_HEADER.size + length
+            if offset > size:
+                break
+            end = offset
+            f.seek(offset)
+    return end
+
+
+class ReplayClient:
+    """Stand in for the firehose client, and send the frames of a capture file
+    to the message callback instead of the frames of a relay, so that the
+    whole processing can be run and measured without a network.
+
+    The frames are decoded as the firehose client does. With a `speed`, they
+    are sent at the rate they were received, times `speed`; without, as fast
+    as possible. The cursor set with `update_params` skips the frames up to
+    it, as a relay would. Only the synchronous client is replaced: the
+    frames are processed in the calling thread.
+
+    Parameters:
+        path (str): The capture file.
+        speed (float | None): Multiplier of the recorded rate, None (or 0)
+            to replay as fast as possible.
+        clock (Callable[[], float]): Monotonic clock in seconds.
+        sleep (Callable[[float], None]): Waits for a number of seconds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        speed: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self._path = path
+        self._speed = speed or None
+        self._clock = clock
+        self._sleep = sleep
+        self._cursor: Optional[int] = None
+        self._stopped = False
+        self.frames = 0
+
+    def update_params(self, params: Any) -> None:
+        """Set the cursor to replay from, like the firehose client.
+
+        Parameters:
+            params (ComAtprotoSyncSubscribeRepos.Params | dict): The params
+                of the subscription.
+
+        Returns:
+            None
+        """
+        if isinstance(params, models.ComAtprotoSyncSubscribeRepos.Params):
+            self._cursor = params.cursor
+        elif isinstance(params, dict):
+            self._cursor = params.get("cursor")
+
+    def start(
+        self,
+        on_message_callback: Callable[[firehose_models.MessageFrame], None],
+        on_callback_error_callback: Optional[Callable[[BaseException], None]] = None,
+    ) -> None:
+        """Send the frames of the capture file to the callback, until the end
+        of the file or `stop()`, then log the throughput.
+
+        Parameters:
+            on_message_callback (Callable[[MessageFrame], None]): Processes
+                each message.
+            on_callback_error_callback (Callable[[BaseException], None] | None):
+                Receives the errors raised by the callback.
+
+        Returns:
+            None
+        """
+        cursor = self._cursor
+        started_at = self._clock()
+        first_received_at_ns: Optional[int] = None
+        for captured in read_capture(self._path):
+            if self._stopped:
+                break
+            if cursor is not None and captured.seq is not None:
+                if captured.seq <= cursor:
+                    continue
+            if self._speed is not None:
+                if first_received_at_ns is None:
+                    first_received_at_ns = captured.received_at_ns
+                due = (captured.received_at_ns - first_received_at_ns) / 1e9
+                wait = due / self._speed - (self._clock() - started_at)
+                if wait > 0:
+                    self._sleep(wait)
+            try:
+                message = firehose_models.Frame.from_bytes(captured.frame)
+                if isinstance(message, firehose_models.MessageFrame):
+                    on_message_callback(message)
+            except Exception as e:
+                if on_callback_error_callback is None:
+                    raise
+                on_callback_error_callback(e)
+            self.frames += 1
+        elapsed = self._clock() - started_at
+        logger.bind(
+            file=self._path,
+            frames=self.frames,
+            seconds=round(elapsed, 3),
+            frames_per_s=round(self.frames / elapsed) if elapsed > 0 else None,
+        ).info("Replayed capture file")
+
+    def stop(self) -> None:
+        """Stop the replay after the current frame.
+
+        Returns:
+            None
+        """
+        self._stopped = True
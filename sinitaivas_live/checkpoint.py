@@ -0,0 +1,161 @@
+from atproto import (
+    AsyncFirehoseSubscribeReposClient,
+    FirehoseSubscribeReposClient,
+    models,
+)
+import json
+import time
+from typing import Any, Callable, Optional, Union
+
+import sinitaivas_live.constants as const
+import sinitaivas_live.metrics as metrics
+import utils.datetime_utils as dt_utils
+import utils.files_storage as fs
+from utils.logging import logger
+
+
+class CheckpointManager:
+    """Keep the latest processed sequence number in memory and persist it to the
+    cursor file in batches, instead of rewriting the file after every message.
+
+    The cursor is flushed after `flush_every` messages or `flush_interval_ms`
+    milliseconds, whichever comes first, and on `flush()` (shutdown, signals).
+    Before a seq is recorded, `sync_output` is called so that every event up to
+    that seq is written and fsynced: the cursor file never runs ahead of the data.
+    The committed seq starts from the cursor already in the file, if any.
+
+    Parameters:
+        client (FirehoseSubscribeReposClient | None): The client whose cursor
+            param is kept up to date for reconnects.
+        sync_output (Callable[[], None]): Flushes and fsyncs the output written
+            so far. Raising from it aborts the checkpoint.
+        path (str): The cursor file to write.
+        flush_every (int): Number of messages between two checkpoints.
+        flush_interval_ms (int): Maximum milliseconds between two checkpoints.
+        clock (Callable[[], float]): Monotonic clock in seconds.
+    """
+
+    def __init__(
+        self,
+        client: Optional[
+            Union[FirehoseSubscribeReposClient, AsyncFirehoseSubscribeReposClient]
+        ],
+        sync_output: Callable[[], None],
+        path: str = const.PATH_TO_CURSORS_FILE,
+        flush_every: int = const.CHECKPOINT_EVERY_N_MESSAGES,
+        flush_interval_ms: int = const.CHECKPOINT_INTERVAL_MS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._client = client
+        self._sync_output = sync_output
+        self._path = path
+        self._flush_every = max(1, flush_every)
+        self._flush_interval = max(0, flush_interval_ms) / 1000
+        self._clock = clock
+
+        self._pending_seq: Optional[int] = None
+        self._pending_messages = 0
+        self._last_flush_at = clock()
+        # keep the other keys of the cursor file, read it only once
+        self._document = self._read_document()
+        seq = self._document.get("streamer", {}).get("cursor")
+        self._committed_seq: Optional[int] = seq if isinstance(seq, int) else None
+
+    @property
+    def pending_seq(self) -> Optional[int]:
+        """The latest seq whose events have been handed to the writer."""
+        return self._pending_seq
+
+    @property
+    def committed_seq(self) -> Optional[int]:
+        """The latest seq that is durably recorded in the cursor file."""
+        return self._committed_seq
+
+    def attach(
+        self,
+        client: Union[FirehoseSubscribeReposClient, AsyncFirehoseSubscribeReposClient],
+    ) -> None:
+        """Keep the cursor param of this client up to date from now on, e.g.
+        the client of a new connection.
+
+        Parameters:
+            client (FirehoseSubscribeReposClient | AsyncFirehoseSubscribeReposClient):
+                The client of the subscription.
+
+        Returns:
+            None
+        """
+        self._client = client
+
+    def _read_document(self) -> dict[str, Any]:
+        """Read the current content of the cursor file, or an empty dictionary
+        if the file does not exist or cannot be read.
+
+        Returns:
+            document (dict[str, Any]): The content of the cursor file.
+        """
+        try:
+            with open(self._path, "r") as f:
+                document = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.bind(file=self._path).error(f"Failed to read cursor file: {e}")
+            return {}
+        return document if isinstance(document, dict) else {}
+
+    def advance(self, seq: int) -> None:
+        """Record that all events up to `seq` have been handed to the writer.
+        This is cheap and meant to be called once per message; the cursor file
+        is only written when a checkpoint is due.
+
+        Parameters:
+            seq (int): The sequence number of the processed message.
+
+        Returns:
+            None
+        """
+        self._pending_seq = seq
+        self._pending_messages += 1
+        metrics.CURSOR_SEQ.set(seq)
+        if (
+            self._pending_messages >= self._flush_every
+            or self._clock() - self._last_flush_at >= self._flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Sync the output and persist the pending seq to the cursor file,
+        atomically (write to a temporary file, then rename).
+        If syncing or writing fails, it logs an error and keeps the seq pending.
+
+        Returns:
+            None
+        """
+        self._last_flush_at = self._clock()
+        seq = self._pending_seq
+        if seq is None or seq == self._committed_seq:
+            self._pending_messages = 0
+            return
+
+        try:
+            self._sync_output()
+            self._document["streamer"] = {
+                "cursor": seq,
+                "updated_at": dt_utils.datetime_as_zulu_str(
+                    dt_utils.current_datetime_utc()
+                ),
+            }
+            fs.write_file_atomic(self._path, json.dumps(self._document))
+        except Exception as e:
+            logger.bind(file=self._path, seq=seq).error(
+                f"Failed to checkpoint cursor: {e}"
+            )
+            return
+
+        self._committed_seq = seq
+        self._pending_messages = 0
+        if self._client is not None:
+            self._client.update_params(
+                models.ComAtprotoSyncSubscribeRepos.Params(cursor=seq)
+            )
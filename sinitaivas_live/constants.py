@@ -2,6 +2,65 @@ import utils.files_storage as fs
 from typing import Final
 
 
+# XRPC endpoint of the relay streaming the firehose
+RELAY_URI: Final = "wss://bsky.network/xrpc"
+
 CURSORS_FILE: Final = "cursors.json"
 
 PATH_TO_CURSORS_FILE: Final = f"{fs.current_dir()}/{CURSORS_FILE}"
+
+# persist the cursor after this many messages or this many milliseconds,
+# whichever comes first
+CHECKPOINT_EVERY_N_MESSAGES: Final = 1000
+CHECKPOINT_INTERVAL_MS: Final = 1000
+
+# size of the write buffer of the partition file, and the maximum time
+# an event stays in it before being handed to the OS
+WRITER_BUFFER_SIZE: Final = 1024 * 1024
+WRITER_FLUSH_INTERVAL_MS: Final = 1000
+
+# maximum number of partition files open at once, with one shard per collection
+WRITER_MAX_OPEN_FILES: Final = 64
+
+# bytes of lines between two entries of the sidecar index of a partition file
+WRITER_INDEX_EVERY_BYTES: Final = 16 * 1024 * 1024
+
+# async engine: maximum frames waiting to be processed, frames handed to the
+# consumer at once, and seconds between two reports of the queue depth
+QUEUE_SIZE: Final = 50_000
+QUEUE_BATCH_SIZE: Final = 256
+QUEUE_REPORT_INTERVAL_S: Final = 60.0
+
+# spill buffer (sync engine): default size of the frames kept in memory, the
+# rest is spilled to disk, and estimated size of a frame besides its blocks
+SPILL_MEMORY_BYTES: Final = 256 * 1024 * 1024
+SPILL_FRAME_OVERHEAD_BYTES: Final = 1024
+
+# connection supervisor: bounds of the jittered exponential delay
+# before a reconnect, and seconds without a frame before the connection is
+# considered stalled and replaced
+RECONNECT_MIN_DELAY_S: Final = 1.0
+RECONNECT_MAX_DELAY_S: Final = 60.0
+STALL_TIMEOUT_S: Final = 60.0
+
+# decode workers: frames sent to a worker at once, maximum time a frame waits
+# for its chunk to fill, and chunks in flight per worker
+WORKERS_CHUNK_SIZE: Final = 64
+WORKERS_CHUNK_INTERVAL_MS: Final = 100
+WORKERS_IN_FLIGHT_PER_WORKER: Final = 4
+
+# seconds between two reports of the ops dropped by the filters
+FILTER_REPORT_INTERVAL_S: Final = 60.0
+
+# parquet sink: size of the buffered JSON of a collection written as a row group
+PARQUET_ROW_GROUP_BYTES: Final = 64 * 1024 * 1024
+
+# metrics: maximum number of label sets of a metric, e.g. collections counted
+# apart; the others are counted together
+METRICS_MAX_LABEL_SETS: Final = 1000
+
+# profiler: one stage timing out of this many is sampled, seconds between two
+# reports of the percentiles, and seconds profiled for the cProfile dump
+PROFILE_SAMPLE_EVERY: Final = 10
+PROFILE_REPORT_INTERVAL_S: Final = 60.0
+PROFILE_WINDOW_S: Final = 60.0
@@ -1,26 +1,39 @@
 from atproto import (
+    AsyncFirehoseSubscribeReposClient,
     FirehoseSubscribeReposClient,
     models,
 )
 import json
-import glob
-from typing import Any
-from collections import deque
+import os
+import re
+from io import BytesIO
+from typing import Any, BinaryIO, Iterable, Iterator, Optional, Union
 
 import sinitaivas_live.constants as const
-import utils.datetime_utils as dt_utils
 import utils.files_storage as fs
+from utils.compression import compression_of, read_tail
 from utils.logging import logger
 
+# names of the daily directories and of the partition files in them, or in
+# the directories of their collection shards
+_DAY = re.compile(r"\d{4}-\d{2}-\d{2}$")
+_PARTITION = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}\.ndjson(\.gz|\.zst)?(\.part)?$")
 
-def reset_cursor(client: FirehoseSubscribeReposClient) -> None:
+# bytes read at once when reading a file backwards
+_TAIL_BLOCK_SIZE = 64 * 1024
+
+
+def reset_cursor(
+    client: Union[FirehoseSubscribeReposClient, AsyncFirehoseSubscribeReposClient],
+) -> None:
     """Reset the cursor in the client and in cursor file.
     This function sets the cursor to None in the client and removes the
     "streamer" key from the cursor file. It also handles any exceptions
     that may occur while writing to the cursor file.
 
     Parameters:
-        client (FirehoseSubscribeReposClient): The client to reset.
+        client (FirehoseSubscribeReposClient | AsyncFirehoseSubscribeReposClient):
+            The client to reset.
 
     Returns:
         None
@@ -39,35 +52,6 @@ def reset_cursor(client: FirehoseSubscribeReposClient) -> None:
         )
 
 
-def update_cursor(client: FirehoseSubscribeReposClient, cursor_position: int) -> None:
-    """Update the cursor position in the client and writes the updated cursor position
-    to the cursor file, with the new cursor position and the current UTC time.
-    If the cursor file cannot be written, it logs an error.
-
-    Parameters:
-        client (FirehoseSubscribeReposClient): The client to update
-        cursor_position (int): The cursor value to update
-
-    Returns:
-        None
-    """
-    client.update_params(
-        models.ComAtprotoSyncSubscribeRepos.Params(cursor=cursor_position)
-    )
-    cursor = read_cursor()
-    cursor["streamer"] = {
-        "cursor": cursor_position,
-        "updated_at": dt_utils.datetime_as_zulu_str(dt_utils.current_datetime_utc()),
-    }
-    try:
-        with open(const.PATH_TO_CURSORS_FILE, "w") as f:
-            json.dump(cursor, f)
-    except Exception as e:
-        logger.bind(file=const.PATH_TO_CURSORS_FILE).error(
-            f"Failed to update cursor file: {e}"
-        )
-
-
 def read_cursor() -> dict[str, Any]:
     """Read the cursor file and return its content.
     If the file does not exist or cannot be read, it logs an error and returns an empty dictionary.
@@ -85,51 +69,159 @@ def read_cursor() -> dict[str, Any]:
         return {}
 
 
-def read_last_seq_from_file() -> int:
-    """Read the last sequence value from the latest ndjson file in the firehose_stream directory.
-    This function searches for all ndjson files in the firehose_stream directory,
-    sorts them by name to find the latest file, and reads the last line of that file.
-    If no ndjson files are found or if the last line cannot be read, returns 0.
+def read_last_seq_from_file(root: Optional[str] = None) -> int:
+    """Read the last sequence value from the latest partition in the
+    firehose_stream directory, plain or compressed, sharded by collection
+    or not: with shards, the max seq of the files of the latest hour.
+
+    The files are read backwards from their end, so the time does not depend
+    on their size: a plain file block by block, skipping a partially written
+    last line, a compressed one from its last complete member. If the latest
+    hour has no event yet (e.g. just after an hour rotation), the previous
+    ones are tried. If no partition file is found or no seq can be read,
+    returns 0.
+
+    Parameters:
+        root (str | None): The output directory, by default `firehose_stream`
+            under the current working directory.
 
     Returns:
         seq (int): The last sequence value.
     """
-    json_files = _get_json_files()
-    if not json_files:
+    found = False
+    for paths in _iter_hourly_partitions(root):
+        found = True
+        seqs = []
+        for path in paths:
+            try:
+                seq = _read_last_seq(path)
+            except Exception as e:
+                logger.bind(latest_file=path).error(
+                    f"Failed to read last seq from file: {e}"
+                )
+                continue
+            if seq is not None:
+                seqs.append(seq)
+        if seqs:
+            return max(seqs)
+        logger.bind(latest_files=paths).warning("No seq in the latest files")
+
+    if not found:
         logger.warning("No ndjson files found")
-        return 0
+    return 0
 
-    # max by name, which is the latest date and hour
-    latest_file = json_files[-1]
 
-    try:
-        # read last line from the latest json file
-        with open(latest_file, "r") as file:
-            last_line = deque(file, maxlen=1)
-            if last_line:
-                last_line_json = json.loads(last_line[0])
-                return int(last_line_json["seq"])
-            logger.bind(last_line=last_line).warning("No content in the latest line")
-            return 0
+def _read_last_seq(path: str) -> Optional[int]:
+    """Read the seq of the last complete event of a partition file.
 
-    except Exception as e:
-        logger.bind(latest_file=latest_file).error(
-            f"Failed to read last seq from file: {e}"
-        )
-        return 0
+    Parameters:
+        path (str): The path of the partition file.
+
+    Returns:
+        seq (int | None): The last seq, None if the file has no complete event.
+    """
+    compression = compression_of(path)
+    if compression == "none":
+        with open(path, "rb") as file:
+            return _last_seq(_iter_lines_backwards(file))
+    with BytesIO(read_tail(path, compression)) as tail:
+        return _last_seq(_iter_lines_backwards(tail))
 
 
-def _get_json_files() -> list[str]:
-    """Find all files with the .ndjson extension in the firehose_stream directory
-    and return them sorted by name.
+def _last_seq(lines: Iterable[bytes]) -> Optional[int]:
+    """Get the seq of the first line that is an event, going backwards.
+
+    Parameters:
+        lines (Iterable[bytes]): The lines, from the last one.
 
     Returns:
-        json_files (list[str]): A sorted list of file paths to ndjson files.
+        seq (int | None): The seq, None if no line has one.
     """
-    # get all ndjson files under firehose_stream
-    return sorted(
-        file
-        for file in glob.glob(
-            f"{fs.current_dir()}/firehose_stream/**/*.ndjson", recursive=False
-        )
-    )
+    for line in lines:
+        try:
+            return int(json.loads(line)["seq"])
+        except (ValueError, KeyError, TypeError):
+            continue
+    return None
+
+
+def _iter_lines_backwards(
+    file: BinaryIO, block_size: int = _TAIL_BLOCK_SIZE
+) -> Iterator[bytes]:
+    """Yield the complete lines of a file, from the last to the first, reading
+    it backwards block by block. The bytes after the last newline are a line
+    still being written, and are skipped.
+
+    Parameters:
+        file (BinaryIO): The file, opened in binary mode.
+        block_size (int): Number of bytes read at once.
+
+    Yields:
+        line (bytes): The lines, without the newline.
+    """
+    position = file.seek(0, os.SEEK_END)
+    buffer = b""
+    complete = False  # whether the end of the buffer is the end of a line
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        file.seek(position)
+        lines = (file.read(size) + buffer).split(b"\n")
+        # the first piece may start in the previous block
+        buffer = lines[0]
+        for line in reversed(lines[1:]):
+            if complete and line:
+                yield line
+            complete = True
+    if complete and buffer:
+        yield buffer
+
+
+def _iter_hourly_partitions(root: Optional[str] = None) -> Iterator[list[str]]:
+    """Find the partition files in the firehose_stream directory, by hour,
+    newest first, without listing more than needed: the daily directories are
+    listed, and only the files of the day being read, with those of its
+    collection shards.
+
+    Parameters:
+        root (str | None): The output directory, by default `firehose_stream`
+            under the current working directory.
+
+    Yields:
+        paths (list[str]): The paths of the files of an hour.
+    """
+    root = root or f"{fs.current_dir()}/firehose_stream"
+    try:
+        with os.scandir(root) as entries:
+            days = [e.name for e in entries if _DAY.match(e.name) and e.is_dir()]
+    except FileNotFoundError:
+        return
+    for day in sorted(days, reverse=True):
+        hours: dict[str, list[str]] = {}
+        for directory, name in _iter_day_files(f"{root}/{day}"):
+            hours.setdefault(name[:13], []).append(f"{directory}/{name}")
+        for hour in sorted(hours, reverse=True):
+            yield sorted(hours[hour])
+
+
+def _iter_day_files(day_dir: str) -> Iterator[tuple[str, str]]:
+    """Find the partition files of a day, and of its collection shards.
+
+    Parameters:
+        day_dir (str): The directory of the day.
+
+    Yields:
+        (directory, name) (tuple[str, str]): The directory and name of a file.
+    """
+    with os.scandir(day_dir) as entries:
+        shards = []
+        for entry in entries:
+            if _PARTITION.match(entry.name):
+                yield day_dir, entry.name
+            elif entry.is_dir():
+                shards.append(entry.path)
+    for shard in shards:
+        with os.scandir(shard) as entries:
+            for entry in entries:
+                if _PARTITION.match(entry.name):
+                    yield shard, entry.name
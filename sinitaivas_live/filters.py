@@ -0,0 +1,169 @@
+from atproto import firehose_models
+import time
+from typing import Callable, Iterable
+
+import sinitaivas_live.constants as const
+import sinitaivas_live.metrics as metrics
+from utils.logging import logger
+
+# names of the filters, as reported in the drop counters
+AUTHOR: str = "author"
+ACTION: str = "action"
+COLLECTION: str = "collection"
+
+
+class _Match:
+    """Match a value against exact values and prefixes (values ending with `*`).
+
+    Parameters:
+        patterns (Iterable[str]): The values and prefixes to match.
+    """
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        patterns = list(patterns)
+        self._exact = frozenset(p for p in patterns if not p.endswith("*"))
+        self._prefixes = tuple(p[:-1] for p in patterns if p.endswith("*"))
+
+    def __bool__(self) -> bool:
+        return bool(self._exact or self._prefixes)
+
+    def __call__(self, value: str) -> bool:
+        return value in self._exact or value.startswith(self._prefixes)
+
+
+class OpFilter:
+    """Drop the repo operations of the commits by collection, action and author,
+    before the commit is parsed and its blocks decoded, so that the ops that
+    are filtered out cost almost nothing.
+
+    The filters work on the body of the message frame: the author is the
+    `repo` of the commit, the collection is the first segment of the `path`
+    of the op. For each filter, an op passes if it matches one of the included
+    values (or there are none) and none of the excluded ones. Values ending
+    with `*` match as prefixes, e.g. `app.bsky.feed.*`.
+
+    The ops dropped by each filter are counted, in
+    `sinitaivas_ops_dropped_total{reason}` and in counters logged every
+    `report_interval_s` seconds and on `report()`.
+
+    Parameters:
+        collections (Iterable[str]): Collections to keep.
+        exclude_collections (Iterable[str]): Collections to drop.
+        actions (Iterable[str]): Actions to keep (create, update, delete).
+        exclude_actions (Iterable[str]): Actions to drop.
+        authors (Iterable[str]): DIDs of the authors to keep.
+        exclude_authors (Iterable[str]): DIDs of the authors to drop.
+        report_interval_s (float): Seconds between two reports in the log.
+        clock (Callable[[], float]): Monotonic clock in seconds.
+    """
+
+    def __init__(
+        self,
+        collections: Iterable[str] = (),
+        exclude_collections: Iterable[str] = (),
+        actions: Iterable[str] = (),
+        exclude_actions: Iterable[str] = (),
+        authors: Iterable[str] = (),
+        exclude_authors: Iterable[str] = (),
+        report_interval_s: float = const.FILTER_REPORT_INTERVAL_S,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._collections = _Match(collections)
+        self._exclude_collections = _Match(exclude_collections)
+        self._actions = _Match(actions)
+        self._exclude_actions = _Match(exclude_actions)
+        self._authors = _Match(authors)
+        self._exclude_authors = _Match(exclude_authors)
+        self._report_interval_s = report_interval_s
+        self._clock = clock
+
+        self._dropped = {AUTHOR: 0, ACTION: 0, COLLECTION: 0}
+        self._dropped_metrics = {
+            name: metrics.OPS_DROPPED.labels(name) for name in self._dropped
+        }
+        self._last_report_at = clock()
+
+    @property
+    def active(self) -> bool:
+        """Whether any filter is configured."""
+        return any(
+            (
+                self._collections,
+                self._exclude_collections,
+                self._actions,
+                self._exclude_actions,
+                self._authors,
+                self._exclude_authors,
+            )
+        )
+
+    @property
+    def dropped(self) -> dict[str, int]:
+        """The number of ops dropped so far by each filter."""
+        return dict(self._dropped)
+
+    def apply(self, message: firehose_models.MessageFrame) -> bool:
+        """Remove the filtered-out ops from a #commit message, in place.
+        Other messages are left untouched.
+
+        Parameters:
+            message (firehose_models.MessageFrame): The incoming message frame
+
+        Returns:
+            bool: False if the message is a commit with no op left, which does
+                not need to be parsed.
+        """
+        if message.type != "#commit":
+            return True
+        body = message.body
+        ops = body.get("ops") or []
+
+        if self._clock() - self._last_report_at >= self._report_interval_s:
+            self.report()
+
+        if not self._accepts(self._authors, self._exclude_authors, body.get("repo")):
+            self._dropped[AUTHOR] += len(ops)
+            self._dropped_metrics[AUTHOR].inc(len(ops))
+            body["ops"] = []
+            return False
+
+        kept = [op for op in ops if self._accepts_op(op)]
+        if len(kept) != len(ops):
+            body["ops"] = kept
+        return bool(kept)
+
+    def report(self) -> None:
+        """Log the number of ops dropped by each filter.
+
+        Returns:
+            None
+        """
+        self._last_report_at = self._clock()
+        logger.bind(**self._dropped).info("Ops dropped by the filters")
+
+    @staticmethod
+    def _accepts(include: _Match, exclude: _Match, value: object) -> bool:
+        if not isinstance(value, str):
+            return not include
+        return (not include or include(value)) and not (exclude and exclude(value))
+
+    def _accepts_op(self, op: dict) -> bool:
+        """Check an op against the action and collection filters, and count it
+        if it is dropped.
+
+        Parameters:
+            op (dict): The op as in the body of the message.
+
+        Returns:
+            bool: True if the op is kept.
+        """
+        if not self._accepts(self._actions, self._exclude_actions, op.get("action")):
+            self._dropped[ACTION] += 1
+            self._dropped_metrics[ACTION].inc()
+            return False
+        collection = (op.get("path") or "").split("/", 1)[0]
+        if not self._accepts(self._collections, self._exclude_collections, collection):
+            self._dropped[COLLECTION] += 1
+            self._dropped_metrics[COLLECTION].inc()
+            return False
+        return True
@@ -1,9 +1,11 @@
 #TODO checkout after a couple of days if delete_daily_folder script works
 import click
-from typing import Literal
+from typing import Literal, Optional
 
+import sinitaivas_live.constants as const
+from sinitaivas_live.settings import StreamerSettings
 from sinitaivas_live.streamer import streamer_main
-from utils.logging import logger, handle_catch_error
+from utils.logging import LogMode, configure_logging, handle_catch_error, logger
 
 
 @handle_catch_error
@@ -11,7 +13,280 @@ from utils.logging import logger, handle_catch_error
 @click.option(
     "--mode", default="fresh", help="Mode to run the streamer [fresh/resume]."
 )
-def main(mode: Literal["fresh", "resume"]) -> None:
+@click.option(
+    "--checkpoint-every",
+    default=const.CHECKPOINT_EVERY_N_MESSAGES,
+    show_default=True,
+    help="Persist the cursor after this many messages.",
+)
+@click.option(
+    "--checkpoint-interval-ms",
+    default=const.CHECKPOINT_INTERVAL_MS,
+    show_default=True,
+    help="Persist the cursor at least every this many milliseconds.",
+)
+@click.option(
+    "--buffer-size",
+    default=const.WRITER_BUFFER_SIZE,
+    show_default=True,
+    help="Size in bytes of the write buffer of the partition file.",
+)
+@click.option(
+    "--flush-interval-ms",
+    default=const.WRITER_FLUSH_INTERVAL_MS,
+    show_default=True,
+    help="Flush the write buffer at least every this many milliseconds.",
+)
+@click.option(
+    "--compression",
+    default="none",
+    type=click.Choice(["none", "gzip", "zstd"]),
+    show_default=True,
+    help="Compress the partition files while writing them.",
+)
+@click.option(
+    "--compression-level",
+    type=int,
+    default=None,
+    help="Compression level, by default 6 for gzip and 3 for zstd.",
+)
+@click.option(
+    "--shard-by-collection",
+    is_flag=True,
+    help="Write each collection to its own hourly file, "
+    "YYYY-MM-DD/<collection>/YYYY-MM-DDTHH.ndjson.",
+)
+@click.option(
+    "--max-open-files",
+    default=const.WRITER_MAX_OPEN_FILES,
+    show_default=True,
+    help="Maximum number of partition files open at once (with shards).",
+)
+@click.option(
+    "--index-every-mb",
+    default=const.WRITER_INDEX_EVERY_BYTES // (1024 * 1024),
+    show_default=True,
+    help="MB of events between two entries of the .idx file of a partition, "
+    "0 to write no index.",
+)
+@click.option(
+    "--engine",
+    default="sync",
+    type=click.Choice(["sync", "async"]),
+    show_default=True,
+    help="Process messages in the receiving loop (sync), "
+    "or behind a bounded queue on the asyncio client (async).",
+)
+@click.option(
+    "--queue-size",
+    default=const.QUEUE_SIZE,
+    show_default=True,
+    help="Maximum number of frames waiting to be processed (async engine).",
+)
+@click.option(
+    "--spill-memory-mb",
+    default=0,
+    show_default=True,
+    help="Sync engine: buffer the frames received, keeping this many MB in memory "
+    "and spilling the rest to disk; 0 processes them in the receiving loop.",
+)
+@click.option(
+    "--stall-timeout-s",
+    default=const.STALL_TIMEOUT_S,
+    show_default=True,
+    help="Replace the connection after this many seconds without a frame, "
+    "0 to never.",
+)
+@click.option(
+    "--workers",
+    default=0,
+    show_default=True,
+    help="Number of processes decoding the messages, 0 to decode in the main one.",
+)
+@click.option(
+    "--json-backend",
+    default="json",
+    type=click.Choice(["json", "orjson"]),
+    show_default=True,
+    help="Encode the output lines with the json module, or with orjson if installed.",
+)
+@click.option(
+    "--record-mode",
+    default="model",
+    type=click.Choice(["model", "raw"]),
+    show_default=True,
+    help="Validate the records with the lexicon models (model), "
+    "or write the decoded blocks as they are (raw).",
+)
+@click.option(
+    "--collection",
+    "collections",
+    multiple=True,
+    help="Keep only the ops of this collection, e.g. app.bsky.feed.post "
+    "or app.bsky.feed.* (repeatable).",
+)
+@click.option(
+    "--exclude-collection",
+    "exclude_collections",
+    multiple=True,
+    help="Drop the ops of this collection (repeatable).",
+)
+@click.option(
+    "--action",
+    "actions",
+    multiple=True,
+    type=click.Choice(["create", "update", "delete"]),
+    help="Keep only the ops with this action (repeatable).",
+)
+@click.option(
+    "--exclude-action",
+    "exclude_actions",
+    multiple=True,
+    type=click.Choice(["create", "update", "delete"]),
+    help="Drop the ops with this action (repeatable).",
+)
+@click.option(
+    "--author",
+    "authors",
+    multiple=True,
+    help="Keep only the commits of this DID (repeatable).",
+)
+@click.option(
+    "--exclude-author",
+    "exclude_authors",
+    multiple=True,
+    help="Drop the commits of this DID (repeatable).",
+)
+@click.option(
+    "--parquet",
+    is_flag=True,
+    help="Also write the events to hourly Parquet files, by collection "
+    "(needs the parquet extra).",
+)
+@click.option(
+    "--parquet-row-group-mb",
+    default=const.PARQUET_ROW_GROUP_BYTES // (1024 * 1024),
+    show_default=True,
+    help="Size in MB of the buffered events of a collection written as a row group.",
+)
+@click.option(
+    "--metrics-port",
+    default=0,
+    show_default=True,
+    help="Serve Prometheus metrics at http://<metrics-host>:<port>/metrics, "
+    "0 to not serve them.",
+)
+@click.option(
+    "--metrics-host",
+    default="127.0.0.1",
+    show_default=True,
+    help="Address the metrics server listens on.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Sample the duration of each processing stage and log p50/p99 every minute.",
+)
+@click.option(
+    "--profile-sample-every",
+    default=const.PROFILE_SAMPLE_EVERY,
+    show_default=True,
+    help="Keep one timing out of this many, per stage (with --profile).",
+)
+@click.option(
+    "--profile-dump",
+    default="none",
+    type=click.Choice(["none", "cprofile", "pyinstrument"]),
+    show_default=True,
+    help="Also profile the first --profile-window-s seconds and write "
+    "profile-<time>.prof (cprofile) or .html (pyinstrument, needs the profile extra).",
+)
+@click.option(
+    "--profile-window-s",
+    default=const.PROFILE_WINDOW_S,
+    show_default=True,
+    help="Seconds profiled for --profile-dump.",
+)
+@click.option(
+    "--capture",
+    "capture_path",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Append the frames received from the relay to this capture file.",
+)
+@click.option(
+    "--replay",
+    "replay_path",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="Process the frames of a capture file instead of connecting to the relay.",
+)
+@click.option(
+    "--replay-speed",
+    default=0.0,
+    show_default=True,
+    help="Replay at the recorded rate times this, 0 for as fast as possible.",
+)
+@click.option(
+    "--relay-uri",
+    default=const.RELAY_URI,
+    show_default=True,
+    help="XRPC endpoint of the relay, e.g. a local relay for load tests.",
+)
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory of firehose_stream/ and firehose_parquet/ "
+    "[default: working directory].",
+)
+@click.option(
+    "--log-mode",
+    default="debug",
+    type=click.Choice(["debug", "production"]),
+    show_default=True,
+    help="production: INFO to stderr, rate-limited warnings to a queued log file, "
+    "no per-op log context.",
+)
+def main(
+    mode: Literal["fresh", "resume"],
+    checkpoint_every: int,
+    checkpoint_interval_ms: int,
+    buffer_size: int,
+    flush_interval_ms: int,
+    compression: Literal["none", "gzip", "zstd"],
+    compression_level: Optional[int],
+    shard_by_collection: bool,
+    max_open_files: int,
+    index_every_mb: int,
+    engine: Literal["sync", "async"],
+    queue_size: int,
+    spill_memory_mb: int,
+    stall_timeout_s: float,
+    workers: int,
+    json_backend: Literal["json", "orjson"],
+    record_mode: Literal["model", "raw"],
+    collections: tuple[str, ...],
+    exclude_collections: tuple[str, ...],
+    actions: tuple[str, ...],
+    exclude_actions: tuple[str, ...],
+    authors: tuple[str, ...],
+    exclude_authors: tuple[str, ...],
+    parquet: bool,
+    parquet_row_group_mb: int,
+    metrics_port: int,
+    metrics_host: str,
+    profile: bool,
+    profile_sample_every: int,
+    profile_dump: Literal["none", "cprofile", "pyinstrument"],
+    profile_window_s: float,
+    capture_path: Optional[str],
+    replay_path: Optional[str],
+    replay_speed: float,
+    relay_uri: str,
+    output_dir: Optional[str],
+    log_mode: LogMode,
+) -> None:
     """
     Main function to run the streamer.
 
@@ -20,6 +295,109 @@ def main(mode: Literal["fresh", "resume"]) -> None:
             The mode in which to run the streamer.
             "fresh" starts a new stream, while "resume" continues from the last
             known state of the cursor, if available.
+        checkpoint_every (int):
+            Number of messages between two writes of the cursor file.
+        checkpoint_interval_ms (int):
+            Maximum milliseconds between two writes of the cursor file.
+        buffer_size (int):
+            Size in bytes of the write buffer of the partition file.
+        flush_interval_ms (int):
+            Maximum milliseconds an event stays in the write buffer.
+        compression (Literal["none", "gzip", "zstd"]):
+            Compress the hourly files as they are written, to
+            `YYYY-MM-DDTHH.ndjson.gz` or `.zst` (needs the `zstd` extra).
+            The file of the current hour ends with `.part` until it is finalized.
+        compression_level (Optional[int]):
+            Compression level, None for the default of the compression.
+        shard_by_collection (bool):
+            Write each collection to `YYYY-MM-DD/<collection>/YYYY-MM-DDTHH.ndjson`
+            instead of one file per hour for all of them.
+        max_open_files (int):
+            Maximum number of partition files open at once; the least recently
+            written one is closed to open another.
+        index_every_mb (int):
+            MB of events between two entries of the `.idx` file next to each
+            partition, which maps a seq and commit time to an offset to start
+            reading from; a gzip member or zstd frame is cut at each entry.
+        engine (Literal["sync", "async"]):
+            "sync" processes each message in the receiving loop, "async" receives
+            on the asyncio client and processes behind a bounded queue.
+        queue_size (int):
+            Maximum number of frames waiting to be processed (async engine).
+        spill_memory_mb (int):
+            With the sync engine, put the frames received on a buffer processed
+            by a consumer thread, so that a stalled disk does not stop the
+            websocket from being read: up to this many MB of frames are kept in
+            memory, the next ones are appended to `firehose_spill.seg` in the
+            output directory and read back in order. 0 processes each frame in
+            the receiving loop.
+        stall_timeout_s (float):
+            The subscription is reconnected without end (jittered exponential
+            delay, up to a minute) from the checkpointed cursor; this also
+            replaces the connection when no frame has been received for this
+            many seconds, 0 to never.
+        workers (int):
+            Number of worker processes that parse and serialize the messages;
+            the results are written back in seq order. 0 decodes in the main process.
+        json_backend (Literal["json", "orjson"]):
+            "json" writes the same bytes as before, "orjson" is faster and writes
+            compact, non-escaped JSON; it needs the `fast` extra.
+        record_mode (Literal["model", "raw"]):
+            "model" builds the lexicon model of each record, "raw" skips it and
+            writes the decoded record with CIDs and bytes as strings (faster,
+            for archival; the field order and nested `$type` are not normalized).
+        collections, exclude_collections (tuple[str, ...]):
+            Collections of the ops to keep or to drop; `*` at the end matches
+            a prefix.
+        actions, exclude_actions (tuple[str, ...]):
+            Actions of the ops to keep or to drop.
+        authors, exclude_authors (tuple[str, ...]):
+            DIDs of the authors whose commits are kept or dropped.
+        The filters are applied before the records are decoded.
+        parquet (bool):
+            Also write the events to `firehose_parquet/date=.../hour=.../collection=...`,
+            with typed columns for the commit and op fields and the record as JSON.
+        parquet_row_group_mb (int):
+            Size in MB of the buffered events of a collection written as a row group.
+        metrics_port (int):
+            Serve the metrics (messages and ops by type, bytes written, cursor
+            and commit lag, queue depth, stage latencies, reconnects) in the
+            Prometheus text format on this port; 0 does not start the server.
+        metrics_host (str):
+            The address the metrics server listens on.
+        profile (bool):
+            Sample the timings of the stages of each message (parse, CAR decode,
+            model build, serialize, write, and the whole message) and log their
+            p50 and p99 every minute.
+        profile_sample_every (int):
+            Keep one timing out of this many, per stage.
+        profile_dump (Literal["none", "cprofile", "pyinstrument"]):
+            With --profile, also profile the processing of the messages for
+            the first `profile_window_s` seconds and write the result to
+            `profile-<time>.prof` (open it with pstats or snakeviz) or `.html`.
+        profile_window_s (float):
+            Seconds profiled for the dump.
+        capture_path (Optional[str]):
+            Append each frame received, with its seq and time of reception,
+            to this capture file.
+        replay_path (Optional[str]):
+            Process the frames of a capture file through the same handler,
+            instead of connecting to the relay, e.g. to benchmark offline.
+        replay_speed (float):
+            Replay at the recorded rate times this, 0 for as fast as possible.
+        relay_uri (str):
+            The XRPC endpoint of the relay, e.g. `ws://127.0.0.1:8765/xrpc`
+            for the fake relay of the load tests.
+        output_dir (Optional[str]):
+            The directory where `firehose_stream/` (and `firehose_parquet/`)
+            are written, instead of the working directory. The cursor file
+            and the logs stay in the working directory.
+        log_mode (LogMode):
+            "debug" logs everything from DEBUG, with the bound values and the
+            op being processed. "production" logs INFO and above to stderr,
+            and writes the warnings and errors to the log file from a thread;
+            at most 10 warnings of a line of code are logged per minute, the
+            others are counted, and the op is not bound to the records.
 
     Returns:
         None
@@ -31,11 +409,77 @@ def main(mode: Literal["fresh", "resume"]) -> None:
     python -m sinitavas_live.main --mode fresh
 
     python -m sinitaivas_live.main --mode resume
+
+    python -m sinitaivas_live.main --mode resume --engine async
+
+    python -m sinitaivas_live.main --mode resume --spill-memory-mb 512
+
+    python -m sinitaivas_live.main --mode resume --stall-timeout-s 30
+
+    python -m sinitaivas_live.main --mode resume --workers 4
+
+    python -m sinitaivas_live.main --mode resume --compression zstd
+
+    python -m sinitaivas_live.main --collection app.bsky.feed.post --exclude-action delete
+
+    python -m sinitaivas_live.main --mode resume --parquet
+
+    python -m sinitaivas_live.main --mode resume --metrics-port 9464
+
+    python -m sinitaivas_live.main --mode resume --profile --profile-dump cprofile
+
+    python -m sinitaivas_live.main --mode resume --capture firehose.cap
+
+    python -m sinitaivas_live.main --mode fresh --replay firehose.cap --profile
+
+    python -m sinitaivas_live.main --mode fresh --relay-uri ws://127.0.0.1:8765/xrpc
+
+    python -m sinitaivas_live.main --mode resume --output-dir /data/sinitaivas
+
+    python -m sinitaivas_live.main --mode resume --log-mode production
     """
+    configure_logging(log_mode)
     logger.info(f"Starting streamer process as {mode}")
     if mode not in ["fresh", "resume"]:
         raise ValueError("Only fresh and resume modes are supported")
-    streamer_main(mode)
+    settings = StreamerSettings(
+        checkpoint_every=checkpoint_every,
+        checkpoint_interval_ms=checkpoint_interval_ms,
+        writer_buffer_size=buffer_size,
+        writer_flush_interval_ms=flush_interval_ms,
+        compression=compression,
+        compression_level=compression_level,
+        shard_by_collection=shard_by_collection,
+        max_open_files=max_open_files,
+        index_every_bytes=index_every_mb * 1024 * 1024,
+        engine=engine,
+        queue_size=queue_size,
+        spill_memory_bytes=spill_memory_mb * 1024 * 1024,
+        stall_timeout_s=stall_timeout_s,
+        workers=workers,
+        json_backend=json_backend,
+        record_mode=record_mode,
+        collections=collections,
+        exclude_collections=exclude_collections,
+        actions=actions,
+        exclude_actions=exclude_actions,
+        authors=authors,
+        exclude_authors=exclude_authors,
+        parquet=parquet,
+        parquet_row_group_bytes=parquet_row_group_mb * 1024 * 1024,
+        metrics_port=metrics_port,
+        metrics_host=metrics_host,
+        profile=profile,
+        profile_sample_every=profile_sample_every,
+        profile_dump=profile_dump,
+        profile_window_s=profile_window_s,
+        capture_path=capture_path,
+        replay_path=replay_path,
+        replay_speed=replay_speed,
+        relay_uri=relay_uri,
+        output_dir=output_dir,
+    )
+    streamer_main(mode, settings)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,477 @@
+import abc
+import math
+import threading
+import time
+from bisect import bisect_left
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterator, Optional
+
+import sinitaivas_live.constants as const
+import utils.datetime_utils as dt_utils
+from utils.logging import logger
+
+# label values of a metric beyond `METRICS_MAX_LABEL_SETS` are counted here,
+# so that an unexpected collection cannot grow the registry without bounds
+OTHER_LABEL = "_other"
+
+# upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS: tuple[float, ...] = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+# upper bounds in seconds of the buckets of the reconnect and gap histograms
+RECONNECT_BUCKETS: tuple[float, ...] = (
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+    600.0,
+)
+
+LabelValues = tuple[str, ...]
+
+# the counts and sum of each set of label values of a histogram
+HistogramState = dict[LabelValues, tuple[list[int], float]]
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class _GaugeValue:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "listener")
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        # the last count is for the values above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        # also receives the observations, e.g. the profiler
+        self.listener: Optional[Callable[[float], None]] = None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        if self.listener is not None:
+            self.listener(value)
+
+
+class _Metric(abc.ABC):
+    """A metric and its values, one per set of label values.
+
+    The values are plain attributes updated without a lock, so each metric
+    must be updated from a single thread, as `+=` is not atomic: the metrics
+    of the messages (e.g. `DROPPED_MESSAGES`) from the thread processing
+    them, the ones of the connection (reconnects, spilled frames) from the
+    thread receiving the frames, and `STALLS` from the watchdog. A scrape
+    from the server thread only reads them, at worst one update behind.
+
+    Parameters:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        labelnames (tuple[str, ...]): The names of the labels.
+        registry (Registry | None): Where the metric is registered, by
+            default the registry of the process.
+    """
+
+    type_name = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        registry: Optional["Registry"] = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[LabelValues, Any] = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values: str) -> Any:
+        """Get the value of a set of label values, created on first use.
+        Keep the result to update it in a hot path.
+
+        Parameters:
+            values (str): The label values, in the order of `labelnames`.
+
+        Returns:
+            value: The counter, gauge or histogram value to update.
+        """
+        value = self._values.get(values)
+        if value is None:
+            if len(self._values) >= const.METRICS_MAX_LABEL_SETS:
+                values = (OTHER_LABEL,) * len(self.labelnames)
+                value = self._values.get(values)
+            if value is None:
+                value = self._values[values] = self._new_value()
+        return value
+
+    def samples(self) -> Iterator[tuple[str, LabelValues, float]]:
+        """The (suffix, label values, value) samples of the metric."""
+        for values, value in list(self._values.items()):
+            yield "", values, value.value
+
+    @abc.abstractmethod
+    def _new_value(self) -> Any:
+        """Create the value of a new set of label values."""
+
+
+class Counter(_Metric):
+    """A value that only goes up; `rate()` turns it into a per-second rate."""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def _new_value(self) -> _CounterValue:
+        return _CounterValue()
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, set directly or computed when scraped."""
+
+    type_name = "gauge"
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Optional[Callable[[], float]]) -> None:
+        """Compute the value when it is scraped, e.g. the size of a queue.
+
+        Parameters:
+            function (Callable[[], float] | None): Returns the value; None to
+                go back to the value that is set.
+
+        Returns:
+            None
+        """
+        self._function = function
+
+    def samples(self) -> Iterator[tuple[str, LabelValues, float]]:
+        if self._function is None:
+            yield from super().samples()
+            return
+        try:
+            yield "", (), self._function()
+        except Exception as e:
+            logger.bind(metric=self.name).error(f"Failed to compute gauge: {e}")
+
+    def _new_value(self) -> _GaugeValue:
+        return _GaugeValue()
+
+
+class Histogram(_Metric):
+    """Counts of observations in fixed buckets, with their sum.
+
+    Parameters:
+        buckets (tuple[float, ...]): The upper bounds of the buckets, sorted.
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self, *args: Any, buckets: tuple[float, ...] = LATENCY_BUCKETS, **kwargs: Any
+    ) -> None:
+        self.buckets = buckets
+        super().__init__(*args, **kwargs)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def set_listener(
+        self, listener: Optional[Callable[[LabelValues, float], None]]
+    ) -> None:
+        """Also hand the observations of the current label sets to `listener`,
+        with their label values.
+
+        Parameters:
+            listener (Callable[[LabelValues, float], None] | None): Receives
+                each observation; None to stop.
+
+        Returns:
+            None
+        """
+        for values, value in list(self._values.items()):
+            value.listener = None if listener is None else partial(listener, values)
+
+    def pop_state(self) -> HistogramState:
+        """Take the counts and sums observed so far, and reset them. Used to
+        send the observations of a worker process to the main process.
+
+        Returns:
+            state (HistogramState): The counts
+                and sum of each set of label values.
+        """
+        state: HistogramState = {}
+        for values, value in list(self._values.items()):
+            if value.sum or any(value.counts):
+                state[values] = (value.counts, value.sum)
+                value.counts = [0] * len(value.counts)
+                value.sum = 0.0
+        return state
+
+    def merge(self, state: HistogramState) -> None:
+        """Add the observations taken with `pop_state`.
+
+        Parameters:
+            state (HistogramState): The counts and
+                sum of each set of label values.
+
+        Returns:
+            None
+        """
+        for values, (counts, total) in state.items():
+            value = self.labels(*values)
+            for i, count in enumerate(counts):
+                value.counts[i] += count
+            value.sum += total
+
+    def samples(self) -> Iterator[tuple[str, LabelValues, float]]:
+        for values, value in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), list(value.counts)):
+                cumulative += count
+                yield "_bucket", (*values, _format_value(bound)), cumulative
+            yield "_sum", values, value.sum
+            yield "_count", values, cumulative
+
+    def _new_value(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+
+class Registry:
+    """The metrics of the process, rendered in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format.
+
+        Returns:
+            text (str): One line per sample, after the help and type of each
+                metric.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for suffix, values, value in metric.samples():
+                names = metric.labelnames + (("le",) if suffix == "_bucket" else ())
+                labels = ",".join(
+                    f'{name}="{_escape(label)}"' for name, label in zip(names, values)
+                )
+                labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = Registry()
+
+MESSAGES = Counter(
+    "sinitaivas_messages_total", "Messages received, by type.", ("type",)
+)
+DROPPED_MESSAGES = Counter(
+    "sinitaivas_dropped_messages_total",
+    "Messages received and not archived, by type and reason.",
+    ("type", "reason"),
+)
+OPS = Counter(
+    "sinitaivas_ops_total",
+    "Repo ops processed, after the filters, by collection and action.",
+    ("collection", "action"),
+)
+OPS_DROPPED = Counter(
+    "sinitaivas_ops_dropped_total",
+    "Repo ops dropped by the filters, by filter.",
+    ("reason",),
+)
+BYTES_WRITTEN = Counter(
+    "sinitaivas_bytes_written_total",
+    "Bytes written to the partition files, after compression.",
+)
+CURSOR_SEQ = Gauge(
+    "sinitaivas_cursor_seq", "Seq of the latest message handed to the writer."
+)
+COMMIT_LAG_SECONDS = Gauge(
+    "sinitaivas_commit_lag_seconds",
+    "Seconds between the wall clock and the time of the latest commit.",
+)
+QUEUE_DEPTH = Gauge(
+    "sinitaivas_queue_depth",
+    "Frames waiting to be processed (async engine or spill buffer).",
+)
+SPILLED_FRAMES = Counter(
+    "sinitaivas_spilled_frames_total",
+    "Frames written to the segment file of the spill buffer.",
+)
+STAGE_SECONDS = Histogram(
+    "sinitaivas_stage_seconds",
+    "Seconds spent per message (parse) or per op in each processing stage.",
+    ("stage",),
+)
+RECONNECTS = Counter(
+    "sinitaivas_reconnects_total", "Restarts of the subscription after a failure."
+)
+STALLS = Counter(
+    "sinitaivas_stalls_total",
+    "Connections replaced because no frame was received for too long.",
+)
+RECONNECT_SECONDS = Histogram(
+    "sinitaivas_reconnect_seconds",
+    "Seconds from the end of a connection to the first frame of the next one.",
+    buckets=RECONNECT_BUCKETS,
+)
+GAP_SECONDS = Histogram(
+    "sinitaivas_gap_seconds",
+    "Seconds between the last frame of a connection and the first of the next.",
+    buckets=RECONNECT_BUCKETS,
+)
+
+# the values of the stages, updated in the hot path
+PARSE_SECONDS = STAGE_SECONDS.labels("parse")
+CAR_DECODE_SECONDS = STAGE_SECONDS.labels("car_decode")
+MODEL_BUILD_SECONDS = STAGE_SECONDS.labels("model_build")
+SERIALIZE_SECONDS = STAGE_SECONDS.labels("serialize")
+WRITE_SECONDS = STAGE_SECONDS.labels("write")
+
+_latest_commit_time: Any = None
+
+
+def set_commit_time(commit_time: Any) -> None:
+    """Record the time of the latest commit; it is only parsed when the lag
+    is scraped.
+
+    Parameters:
+        commit_time (Any): The `time` of the commit, an ISO 8601 string.
+
+    Returns:
+        None
+    """
+    global _latest_commit_time
+    _latest_commit_time = commit_time
+
+
+def _commit_lag_seconds() -> float:
+    if not isinstance(_latest_commit_time, str):
+        return math.nan
+    try:
+        commit_time = dt_utils.iso_to_utc_datetime(_latest_commit_time)
+    except ValueError:
+        return math.nan
+    return time.time() - commit_time.timestamp()
+
+
+COMMIT_LAG_SECONDS.set_function(_commit_lag_seconds)
+
+
+class MetricsServer:
+    """Serve the metrics of a registry at `http://<host>:<port>/metrics`, from
+    a daemon thread.
+
+    Parameters:
+        port (int): The port to listen on, 0 for any free port.
+        host (str): The address to listen on, local only by default.
+        registry (Registry): The metrics to serve.
+    """
+
+    def __init__(
+        self, port: int, host: str = "127.0.0.1", registry: Registry = REGISTRY
+    ) -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="sinitaivas-metrics", daemon=True
+        )
+
+    @property
+    def port(self) -> int:
+        """The port the server listens on."""
+        return self._server.server_address[1]
+
+    def start(self) -> None:
+        self._thread.start()
+        logger.info(f"Serving metrics on port {self.port}")
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
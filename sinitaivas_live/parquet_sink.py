@@ -0,0 +1,265 @@
+import glob
+import os
+from datetime import datetime
+from typing import Any, Optional
+
+import sinitaivas_live.constants as const
+import utils.datetime_utils as dt_utils
+import utils.files_storage as fs
+import utils.json_lines as json_lines
+from utils.logging import logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, installed with the `parquet` extra
+    pa = None  # type: ignore[assignment]
+    pq = None  # type: ignore[assignment]
+
+# suffix of a parquet file that is still being written; the leading dot of
+# its name hides it from Spark, DuckDB globs on `*.parquet` skip it as well
+PART_SUFFIX = ".part"
+
+# the fields of the events kept as they are in a string column; with `seq`
+# and `commit_time`, they are not repeated in the `record` column, which
+# holds the other fields as JSON
+STRING_FIELDS: tuple[str, ...] = (
+    "author",
+    "action",
+    "type",
+    "collected_at",
+    "rev",
+    "since",
+    "path",
+    "cid",
+    "uri",
+    "uri_rkey",
+)
+
+_EVENT_FIELDS = frozenset(("seq", "commit_time", *STRING_FIELDS))
+
+# approximate size in bytes of the typed columns of a row, added to the size
+# of its record to decide when a row group is full
+_ROW_OVERHEAD = 200
+
+
+def _schema() -> "pa.Schema":
+    timestamp = pa.timestamp("us", tz="UTC")
+    return pa.schema(
+        [
+            ("seq", pa.int64()),
+            ("created_at", timestamp),
+            ("commit_time", timestamp),
+            *((name, pa.string()) for name in STRING_FIELDS),
+            ("record", pa.string()),
+        ]
+    )
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    """Parse an ISO 8601 timestamp, as UTC if it has no timezone.
+
+    Parameters:
+        value (Any): The value of the event field.
+
+    Returns:
+        timestamp (datetime | None): The timestamp, None if the value is not one.
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        return dt_utils.iso_to_utc_datetime(value)
+    except ValueError:
+        return None
+
+
+class _RowGroup:
+    """The rows of one collection buffered for the next row group."""
+
+    def __init__(self) -> None:
+        self.columns: dict[str, list[Any]] = {
+            name: []
+            for name in ("seq", "created_at", "commit_time", *STRING_FIELDS, "record")
+        }
+        self.size = 0
+        self.first_seq: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.columns["seq"])
+
+
+class ParquetSink:
+    """Write the events to hourly Parquet files, one per collection, next to
+    the NDJSON partitions:
+    `<root>/date=YYYY-MM-DD/hour=HH/collection=<type>/YYYY-MM-DDTHH-<seq>.parquet`,
+    where `<seq>` is the first seq of the file.
+
+    The fields queried the most get a typed column (`seq`, `author`, `action`,
+    `type`, the `created_at` of the record and the `commit_time` as UTC
+    timestamps, ...). The record itself is kept as a JSON string in the
+    `record` column. The directories follow the Hive layout, so that DuckDB
+    and Spark only read the partitions and columns a query needs.
+
+    The rows are buffered per collection, and written as a row group once the
+    buffer reaches `row_group_bytes` of JSON. The files of an hour are closed
+    when the first event of the next hour arrives, and on `close()`. A file
+    is named `.<name>.part` until it is closed: the Parquet footer is only
+    written then, so the files left open by a crash are unreadable and
+    `recover()` removes them; the NDJSON partitions keep those events.
+
+    Parameters:
+        root (str | None): The output directory, by default `firehose_parquet`
+            under the current working directory.
+        row_group_bytes (int): Size of the buffered JSON of a collection that
+            triggers a row group.
+        encode_line (LineEncoder): Encodes the record as JSON.
+        compression (str): The Parquet compression codec.
+
+    Raises:
+        ValueError: If pyarrow is not installed.
+    """
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        row_group_bytes: int = const.PARQUET_ROW_GROUP_BYTES,
+        encode_line: json_lines.LineEncoder = json_lines.encode_line_json,
+        compression: str = "zstd",
+    ) -> None:
+        if pa is None:
+            raise ValueError("pyarrow is not installed, install the `parquet` extra")
+        self._root = root or f"{fs.current_dir()}/firehose_parquet"
+        self._row_group_bytes = max(1, row_group_bytes)
+        self._encode_line = encode_line
+        self._compression = compression
+        self._schema = _schema()
+
+        self._partition: Optional[str] = None
+        self._row_groups: dict[str, _RowGroup] = {}
+        self._files: dict[str, tuple[str, "pq.ParquetWriter"]] = {}
+
+    @property
+    def root(self) -> str:
+        """The output directory."""
+        return self._root
+
+    def collection_dir(self, partition: str, collection: str) -> str:
+        """Get the directory of the files of a collection in an hourly partition.
+
+        Parameters:
+            partition (str): The date and hour of the partition (%Y-%m-%dT%H).
+            collection (str): The collection of the events.
+
+        Returns:
+            path (str): The directory of the Parquet files.
+        """
+        return (
+            f"{self._root}/date={partition[:10]}/hour={partition[11:13]}"
+            f"/collection={collection}"
+        )
+
+    def write_event(self, partition: str, event: dict[str, Any]) -> None:
+        """Buffer an event in the row group of its collection, and write the
+        row group if it is full. The files of the previous hour are closed
+        first if the partition changed.
+
+        Parameters:
+            partition (str): The date and hour of the partition (%Y-%m-%dT%H).
+            event (dict[str, Any]): The event, as written to the NDJSON files.
+
+        Returns:
+            None
+        """
+        if partition != self._partition:
+            self.close()
+            self._partition = partition
+
+        record = {k: v for k, v in event.items() if k not in _EVENT_FIELDS}
+        record_json = self._encode_line(record)[:-1].decode() if record else None
+
+        collection = event.get("type") or "unknown"
+        row_group = self._row_groups.get(collection)
+        if row_group is None:
+            row_group = self._row_groups[collection] = _RowGroup()
+        if row_group.first_seq is None:
+            row_group.first_seq = event.get("seq")
+
+        columns = row_group.columns
+        columns["seq"].append(event.get("seq"))
+        columns["created_at"].append(_parse_timestamp(event.get("createdAt")))
+        columns["commit_time"].append(_parse_timestamp(event.get("commit_time")))
+        for name in STRING_FIELDS:
+            columns[name].append(event.get(name))
+        columns["record"].append(record_json)
+        row_group.size += len(record_json or "") + _ROW_OVERHEAD
+
+        if row_group.size >= self._row_group_bytes:
+            self._write_row_group(collection)
+
+    def close(self) -> None:
+        """Write the buffered rows, and close and finalize the files of the
+        current hour.
+
+        Returns:
+            None
+        """
+        for collection in list(self._row_groups):
+            try:
+                self._write_row_group(collection)
+            except Exception as e:
+                logger.bind(collection=collection).error(
+                    f"Failed to write row group: {e}"
+                )
+        self._row_groups = {}
+
+        for path, file in self._files.values():
+            try:
+                file.close()
+                fs.fsync_file(path)
+                os.replace(path, self._final_path(path))
+            except Exception as e:
+                logger.bind(file=path).error(f"Failed to finalize parquet file: {e}")
+        self._files = {}
+        self._partition = None
+
+    def recover(self) -> None:
+        """Remove the files left open by a previous run, which have no footer
+        and cannot be read.
+
+        Returns:
+            None
+        """
+        for path in glob.glob(f"{self._root}/*/*/*/.*{PART_SUFFIX}"):
+            logger.bind(file=path).warning("Removing unfinished parquet file")
+            os.remove(path)
+
+    def _write_row_group(self, collection: str) -> None:
+        """Write the buffered rows of a collection as a row group of its file,
+        opening the file first if needed.
+
+        Parameters:
+            collection (str): The collection of the rows.
+
+        Returns:
+            None
+        """
+        row_group = self._row_groups.pop(collection, None)
+        if not row_group:
+            return
+        if collection not in self._files:
+            directory = self.collection_dir(self._partition or "", collection)
+            fs.create_dir_if_not_exists(directory)
+            path = (
+                f"{directory}/.{self._partition}-{row_group.first_seq}"
+                f".parquet{PART_SUFFIX}"
+            )
+            file = pq.ParquetWriter(path, self._schema, compression=self._compression)
+            self._files[collection] = (path, file)
+            logger.bind(file=path).info("Writing to new parquet file")
+        table = pa.Table.from_pydict(row_group.columns, schema=self._schema)
+        self._files[collection][1].write_table(table)
+
+    @staticmethod
+    def _final_path(path: str) -> str:
+        directory, name = os.path.split(path)
+        return f"{directory}/{name[1:].removesuffix(PART_SUFFIX)}"
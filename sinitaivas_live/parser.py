@@ -1,96 +1,304 @@
+from atproto_client.models.base import ModelBase
+from atproto_client.models.dot_dict import DotDict
 from atproto_client.models.utils import (
     get_or_create,
-    get_model_as_json,
     get_model_as_dict,
 )
 from atproto import (
     CAR,
     AtUri,
+    firehose_models,
     models,
+    parse_subscribe_repos_message,
 )
-import json
-from typing import Any
+import re
+import time
+from dataclasses import dataclass
+from pydantic_core import to_jsonable_python
+from typing import Any, Literal, Optional, Protocol, Union
 
+import sinitaivas_live.metrics as metrics
 import utils.datetime_utils as dt_utils
-import utils.files_storage as fs
 import utils.bytes_io as bytes_io
-from utils.logging import logger
+import utils.json_lines as json_lines
+from sinitaivas_live.writer import LineWriter, event_partition, shard_partition
+from utils.logging import log_context, logger
 
+RecordMode = Literal["model", "raw"]
 
-def process_commit(commit: models.ComAtprotoSyncSubscribeRepos.Commit) -> None:
+
+class EventSink(Protocol):
+    """Anything the parser can hand the events to, besides their JSON lines."""
+
+    def write_event(self, partition: str, event: dict[str, Any]) -> None: ...
+
+
+@dataclass(frozen=True)
+class ParseOptions:
+    """How the events are built from the commits and encoded.
+
+    Attributes:
+        record_mode (RecordMode): "model" validates the records with the lexicon
+            models, "raw" emits the decoded CAR blocks as they are, with CIDs
+            and bytes converted to strings.
+        encode_line (LineEncoder): Encodes an event as a JSON line.
+        shard_by_collection (bool): Write the events of each collection to
+            their own hourly file.
+    """
+
+    record_mode: RecordMode = "model"
+    encode_line: json_lines.LineEncoder = json_lines.encode_line_json
+    shard_by_collection: bool = False
+
+
+DEFAULT_OPTIONS = ParseOptions()
+
+# time of the collected_at field and of the output partition
+_clock = dt_utils.UtcClock()
+
+# why a message is not archived, the `reason` of the dropped messages metric
+INVALID_COMMIT = "invalid_commit"
+NO_SEQ = "no_seq"
+UNKNOWN_TYPE = "unknown_type"
+# a frame received again, e.g. after a reconnect
+DUPLICATE = "duplicate"
+
+# type of a message saved by `process_event`, e.g. "#identity", and its kind
+_EVENT_TYPE = re.compile(r"#([a-z][A-Za-z0-9]*)")
+
+# fields of the body of a message saved under the names of the commit events
+_EVENT_RENAMED_FIELDS = frozenset(("did", "time"))
+
+
+def process_message(
+    message: firehose_models.MessageFrame,
+    writer: LineWriter,
+    options: ParseOptions = DEFAULT_OPTIONS,
+    sink: Optional[EventSink] = None,
+) -> tuple[Optional[int], Optional[str]]:
+    """Process a message of any type from the Firehose stream.
+    A #commit is parsed to its model and processed by `process_commit`; the
+    other messages with a seq (#identity, #account, #sync...) are saved from
+    their body by `process_event`, without a model, and an #info is logged.
+    A dropped message is not logged, the caller counts it by reason.
+
+    Parameters:
+        message (firehose_models.MessageFrame): The incoming message frame
+        writer (LineWriter): The writer of the hourly partitions.
+        options (ParseOptions): How the events are built and encoded.
+        sink (EventSink | None): Also receives the events of a commit.
+
+    Returns:
+        seq (int | None): The seq the cursor can advance to, None if the
+            message has none or is dropped.
+        dropped (str | None): Why the message is dropped, None if it is not.
+    """
+    if message.type == "#commit":
+        started_at = time.perf_counter()
+        commit = parse_subscribe_repos_message(message)
+        metrics.PARSE_SECONDS.observe(time.perf_counter() - started_at)
+        if (
+            not isinstance(commit, models.ComAtprotoSyncSubscribeRepos.Commit)
+            or not commit.blocks
+        ):
+            return None, INVALID_COMMIT
+        process_commit(commit, writer, options, sink)
+        return commit.seq, None
+
+    body = message.body
+    if message.type == "#info":
+        logger.bind(name=body.get("name")).info(f"Relay info: {body.get('message')}")
+        return None, None
+    event_type = _EVENT_TYPE.fullmatch(message.type)
+    if event_type is None:
+        return None, UNKNOWN_TYPE
+    seq = body.get("seq")
+    if not isinstance(seq, int):
+        return None, NO_SEQ
+    process_event(event_type[1], body, writer, options)
+    return seq, None
+
+
+def process_commit(
+    commit: models.ComAtprotoSyncSubscribeRepos.Commit,
+    writer: LineWriter,
+    options: ParseOptions = DEFAULT_OPTIONS,
+    sink: Optional[EventSink] = None,
+) -> None:
     """Process a commit message from the Firehose stream, by extracting the blocks
     and processing each operation in the commit.
+    The CAR blocks, the commit fields, the collection time and the output partition
+    are computed once per commit and shared by all of its operations.
 
     Parameters:
         commit (models.ComAtprotoSyncSubscribeRepos.Commit): The commit message to process.
+        writer (LineWriter): The writer of the hourly partitions.
+        options (ParseOptions): How the events are built and encoded.
+        sink (EventSink | None): Also receives each event, e.g. the Parquet sink.
 
     Returns:
         None
     """
+    if not commit.ops:
+        return
+
+    collected_at, partition = _clock.now()
+
+    commit_event = _init_commit_event(commit)
+    if not commit_event:
+        return
+
+    commit_event = _add_current_utc_time_to_commit_event(commit_event, collected_at)
+
+    started_at = time.perf_counter()
+    car = CAR.from_bytes(commit.blocks)
+    metrics.CAR_DECODE_SECONDS.observe(time.perf_counter() - started_at)
     for op in commit.ops:
-        with logger.contextualize(op=op):
-            _process_op(commit, op)
+        with log_context(op=op):
+            _process_op(
+                commit,
+                op,
+                commit_event.copy(),
+                car,
+                writer,
+                partition,
+                options,
+                sink,
+            )
+
+
+def process_event(
+    kind: str,
+    body: dict[str, Any],
+    writer: LineWriter,
+    options: ParseOptions = DEFAULT_OPTIONS,
+) -> None:
+    """Process a message other than a commit (#identity, #account, #sync...),
+    by saving its body as an event of its own partition, `<partition>/_<kind>`.
+    No model is built: the fields of the body are kept as they are, after the
+    `kind` of the message and the `author`, `seq`, `commit_time` and
+    `collected_at` fields of the commit events (`author` and `commit_time`
+    are the `did` and `time` of the message). Bytes, like the CAR `blocks`
+    of a #sync, are converted to base64 when the event is encoded.
+
+    Parameters:
+        kind (str): The kind of message, its type without the `#`.
+        body (dict[str, Any]): The decoded body of the message frame.
+        writer (LineWriter): The writer of the hourly partitions.
+        options (ParseOptions): How the events are encoded.
+
+    Returns:
+        None
+    """
+    collected_at, partition = _clock.now()
+    event = {
+        "kind": kind,
+        "author": body.get("did"),
+        "seq": body.get("seq"),
+        "commit_time": body.get("time"),
+        "collected_at": collected_at,
+    }
+    for key, value in body.items():
+        if key not in _EVENT_RENAMED_FIELDS:
+            event[key] = value
+    _save_commit_event(
+        event, writer, event_partition(partition, kind), options.encode_line
+    )
 
 
 def _process_op(
     commit: models.ComAtprotoSyncSubscribeRepos.Commit,
     op: models.ComAtprotoSyncSubscribeRepos.RepoOp,
+    commit_event: dict[str, Any],
+    car: CAR,
+    writer: LineWriter,
+    partition: str,
+    options: ParseOptions = DEFAULT_OPTIONS,
+    sink: Optional[EventSink] = None,
 ) -> None:
     """Process a single repo operation from the commit.
-    This function initializes the commit event, extracts the record from the blocks,
-    and saves the commit event to a file.
-    It also creates the necessary directories for saving the file.
+    This function completes the commit event with the operation, extracts the
+    record from the blocks, and saves the commit event to its partition.
 
     Parameters:
         commit (models.ComAtprotoSyncSubscribeRepos.Commit): The commit message.
         op (models.ComAtprotoSyncSubscribeRepos.RepoOp): The repo operation to process
+        commit_event (dict[str, Any]): The event initialized from the commit,
+            owned by this operation.
+        car (CAR): The decoded blocks of the commit.
+        writer (LineWriter): The writer of the hourly partitions.
+        partition (str): The date and hour of the output partition.
+        options (ParseOptions): How the events are built and encoded.
+        sink (EventSink | None): Also receives the event.
 
     Returns:
         None
     """
-    # time and date for the collected_at field, and output dir and filename
-    current_utc_time = dt_utils.current_datetime_utc()
-    current_utc_time_str = dt_utils.datetime_as_date_and_hour_str(current_utc_time)
-    current_utc_date_str = dt_utils.datetime_as_date_str(current_utc_time)
-
-    # output directory and filename
-    prefix = f"{fs.current_dir()}/firehose_stream/{current_utc_date_str}"
-    fs.create_dir_if_not_exists(prefix)
-    output_filename = f"{prefix}/{current_utc_time_str}.ndjson"
-
-    commit_event = _init_commit_event(commit)
-    if not commit_event:
-        return
-
-    commit_event = _add_current_utc_time_to_commit_event(
-        commit_event, current_utc_time_str
-    )
     commit_event = _update_commit_event_with_op(commit_event, op)
 
     uri = AtUri.from_str(f"at://{commit.repo}/{op.path}")
     commit_event = _update_commit_event_with_uri(commit_event, uri)
 
-    car = CAR.from_bytes(commit.blocks)
-    commit_event = _extract_record_from_blocks(commit_event, car, op)
-    _save_commit_event(commit_event, output_filename)
+    started_at = time.perf_counter()
+    if options.record_mode == "raw":
+        commit_event = _extract_raw_record_from_blocks(commit_event, car, op)
+    else:
+        commit_event = _extract_record_from_blocks(commit_event, car, op)
+    metrics.MODEL_BUILD_SECONDS.observe(time.perf_counter() - started_at)
+    _save_commit_event(
+        commit_event,
+        writer,
+        partition,
+        options.encode_line,
+        sink,
+        options.shard_by_collection,
+    )
 
 
-def _save_commit_event(commit_event: dict[str, Any], output_filename: str) -> None:
-    """Save the commit event to a JSON file.
+def _save_commit_event(
+    commit_event: dict[str, Any],
+    writer: LineWriter,
+    partition: str,
+    encode_line: json_lines.LineEncoder = json_lines.encode_line_json,
+    sink: Optional[EventSink] = None,
+    shard_by_collection: bool = False,
+) -> None:
+    """Save the commit event as a JSON line of its partition file, and hand it
+    to the sink, if any.
 
     Parameters:
         commit_event (dict[str, Any]): The commit event to save.
-        output_filename (str): The output file name.
+        writer (LineWriter): The writer of the hourly partitions.
+        partition (str): The date and hour of the output partition.
+        encode_line (LineEncoder): Encodes the event as a JSON line.
+        sink (EventSink | None): Also receives the event.
+        shard_by_collection (bool): Write the line to the shard of the
+            collection of the event in the partition.
 
     Returns:
         None
     """
+    line_partition = (
+        shard_partition(partition, commit_event.get("type"))
+        if shard_by_collection
+        else partition
+    )
     try:
-        with open(output_filename, "a", encoding="utf-8") as json_file:
-            json_file.write(json.dumps(commit_event) + "\n")
+        started_at = time.perf_counter()
+        line = encode_line(commit_event)
+        metrics.SERIALIZE_SECONDS.observe(time.perf_counter() - started_at)
+        writer.write(line_partition, line)
     except Exception as e:
-        logger.bind(file=output_filename, commit_event=commit_event).error(
-            f"Failed to write to file: {e}"
+        logger.bind(
+            file=writer.partition_path(line_partition), commit_event=commit_event
+        ).error(f"Failed to write to file: {e}")
+    if sink is None:
+        return
+    try:
+        sink.write_event(partition, commit_event)
+    except Exception as e:
+        logger.bind(commit_event=commit_event).error(
+            f"Failed to write event to sink: {e}"
         )
 
 
@@ -101,7 +309,10 @@ def _extract_record_from_blocks(
 ) -> dict[str, Any]:
     """Extract the record from the CAR blocks and update the commit event.
     This function retrieves the record from the CAR blocks using the operation's CID,
-    converts it to JSON or dictionary format, and updates the commit event with the record data.
+    converts it to its JSON representation or dictionary format, and updates the
+    commit event with the record data. A record with bytes that are not valid
+    UTF-8 is added as a dictionary, its bytes (dict keys included) converted
+    to base64.
     If the record cannot be retrieved or converted, it logs a warning or error.
 
     Parameters:
@@ -118,16 +329,17 @@ def _extract_record_from_blocks(
         logger.bind(model_data=model_data).warning("No model instance")
         return commit_event
     try:
-        model_json = get_model_as_json(model_instance)
-        commit_event.update(json.loads(model_json))
+        commit_event.update(_get_model_as_json_dict(model_instance))
     except Exception as e:
         # this fails for invalid utf-8 bytes
         logger.bind(model_instance=model_instance).warning(
             f"Failed to update commit event with model instance json: {e}"
         )
         try:
-            model_dict = get_model_as_dict(model_instance)
-            model_dict = bytes_io.convert_bytes_to_str(model_dict)
+            # the encoders only convert bytes values, not bytes dict keys
+            model_dict = bytes_io.convert_bytes_to_str(
+                get_model_as_dict(model_instance)
+            )
             commit_event.update(model_dict)
         except Exception as e:
             logger.bind(model_instance=model_instance).error(
@@ -136,6 +348,61 @@ def _extract_record_from_blocks(
     return commit_event
 
 
+def _extract_raw_record_from_blocks(
+    commit_event: dict[str, Any],
+    car: CAR,
+    op: models.ComAtprotoSyncSubscribeRepos.RepoOp,
+) -> dict[str, Any]:
+    """Extract the record from the CAR blocks as it was decoded, without building
+    a lexicon model, and update the commit event.
+    CID links are converted to strings and other bytes to base64, whatever the
+    collection of the record.
+
+    Parameters:
+        commit_event (dict[str, Any]): The commit event to update.
+        car (CAR): The CAR object.
+        op (models.ComAtprotoSyncSubscribeRepos.RepoOp): The operation to process.
+
+    Returns:
+        commit_event (dict[str, Any]): The updated commit event.
+    """
+    model_data = car.blocks.get(op.cid)
+    if not isinstance(model_data, dict):
+        logger.bind(model_data=model_data).warning("No record data")
+        return commit_event
+    try:
+        commit_event.update(bytes_io.convert_ipld_to_json(model_data))
+    except Exception as e:
+        logger.bind(model_data=model_data).error(
+            f"Failed to update commit event with record data: {e}"
+        )
+    return commit_event
+
+
+def _get_model_as_json_dict(
+    model_instance: Union[DotDict, ModelBase],
+) -> dict[str, Any]:
+    """Get the JSON representation of a record as a dictionary, without going
+    through a JSON string: it is the same as `json.loads(get_model_as_json(...))`,
+    with the field order, nested `$type` and blob `$link` of the lexicon models.
+    Like the JSON serialization, it fails for bytes that are not valid UTF-8.
+
+    Parameters:
+        model_instance (DotDict | ModelBase): The record model.
+
+    Returns:
+        model_dict (dict[str, Any]): The record as JSON-compatible values.
+    """
+    model_dict: dict[str, Any]
+    if isinstance(model_instance, DotDict):
+        model_dict = to_jsonable_python(model_instance.to_dict())
+    else:
+        model_dict = model_instance.model_dump(
+            mode="json", exclude_none=True, by_alias=True
+        )
+    return model_dict
+
+
 def _init_commit_event(
     commit: models.ComAtprotoSyncSubscribeRepos.Commit,
 ) -> dict[str, Any]:
@@ -0,0 +1,184 @@
+from atproto import (
+    AsyncFirehoseSubscribeReposClient,
+    firehose_models,
+)
+import asyncio
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Union
+
+import sinitaivas_live.constants as const
+import sinitaivas_live.metrics as metrics
+from sinitaivas_live.supervisor import AsyncConnectionSupervisor
+from utils.logging import logger
+
+# put on the queue by the receiver when the subscription ends
+_END_OF_STREAM = None
+
+QueueItem = Optional[firehose_models.MessageFrame]
+
+
+class AsyncPipeline:
+    """Ingestion pipeline on the asyncio firehose client.
+
+    The receiver only puts the raw message frames on a bounded queue, so the
+    websocket keeps being read (and pinged) while the frames are processed.
+    The consumer takes the frames off the queue in batches and hands them to
+    `handle_message` in a dedicated thread, in arrival order, so that parsing
+    and slow disk writes never block the event loop. When the queue is full,
+    the receiver waits for the consumer to catch up.
+
+    Parameters:
+        client (AsyncFirehoseSubscribeReposClient | AsyncConnectionSupervisor):
+            The client to start, or the supervisor of the clients.
+        handle_message (Callable[[MessageFrame], None]): Parses, processes and
+            checkpoints one message; called from the consumer thread.
+        queue_size (int): Maximum number of frames waiting on the queue.
+        batch_size (int): Maximum number of frames handed over at once.
+        report_interval_s (float): Seconds between two queue reports in the log.
+    """
+
+    def __init__(
+        self,
+        client: Union[AsyncFirehoseSubscribeReposClient, AsyncConnectionSupervisor],
+        handle_message: Callable[[firehose_models.MessageFrame], None],
+        queue_size: int = const.QUEUE_SIZE,
+        batch_size: int = const.QUEUE_BATCH_SIZE,
+        report_interval_s: float = const.QUEUE_REPORT_INTERVAL_S,
+    ) -> None:
+        self._client = client
+        self._handle_message = handle_message
+        self._batch_size = max(1, batch_size)
+        self._report_interval_s = report_interval_s
+
+        self._queue: asyncio.Queue[QueueItem] = asyncio.Queue(maxsize=queue_size)
+        self._high_watermark = 0
+        self._stopping: Optional[asyncio.Future[None]] = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="sinitaivas-consumer"
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of frames currently waiting to be processed."""
+        return self._queue.qsize()
+
+    @property
+    def high_watermark(self) -> int:
+        """The largest queue depth seen so far."""
+        return self._high_watermark
+
+    async def run(self) -> None:
+        """Start the subscription and process the messages until the client
+        stops, then drain the frames left on the queue.
+
+        Returns:
+            None
+        """
+        consumer = asyncio.create_task(self._consume())
+        reporter = asyncio.create_task(self._report())
+        metrics.QUEUE_DEPTH.set_function(self._queue.qsize)
+        try:
+            await self._client.start(self._enqueue, self._on_callback_error)
+        finally:
+            reporter.cancel()
+            metrics.QUEUE_DEPTH.set_function(None)
+            await self._queue.put(_END_OF_STREAM)
+            await consumer
+            self._executor.shutdown(wait=True)
+            logger.info(
+                f"Pipeline stopped, queue high-watermark: {self._high_watermark}"
+            )
+
+    def stop(self) -> None:
+        """Stop the subscription; must be called from the event loop thread.
+        The frames already on the queue are still processed.
+
+        Returns:
+            None
+        """
+        if self._stopping is None:
+            self._stopping = asyncio.ensure_future(self._client.stop())
+
+    def install_signal_handlers(self) -> None:
+        """Stop the pipeline on SIGTERM and SIGINT.
+
+        Returns:
+            None
+        """
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self._on_signal, signum)
+
+    def _on_signal(self, signum: int) -> None:
+        logger.info(f"Received {signal.Signals(signum).name}, stopping streamer")
+        self.stop()
+
+    async def _enqueue(self, message: firehose_models.MessageFrame) -> None:
+        """Receiver callback: put the frame on the queue, waiting if it is full.
+
+        Parameters:
+            message (firehose_models.MessageFrame): The incoming message frame
+
+        Returns:
+            None
+        """
+        await self._queue.put(message)
+        depth = self._queue.qsize()
+        if depth > self._high_watermark:
+            self._high_watermark = depth
+
+    async def _on_callback_error(self, error: BaseException) -> None:
+        logger.error(error)
+
+    async def _consume(self) -> None:
+        """Take the frames off the queue in batches and process them in the
+        consumer thread, until the end of the stream.
+
+        Returns:
+            None
+        """
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        end_of_stream = False
+        while not end_of_stream:
+            batch = [await queue.get()]
+            while len(batch) < self._batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            if batch[-1] is _END_OF_STREAM:
+                end_of_stream = True
+                batch.pop()
+            if batch:
+                await loop.run_in_executor(self._executor, self._process_batch, batch)
+
+    def _process_batch(self, batch: list[QueueItem]) -> None:
+        """Process a batch of frames in order; an error only drops its frame.
+
+        Parameters:
+            batch (list[firehose_models.MessageFrame]): The frames to process.
+
+        Returns:
+            None
+        """
+        for message in batch:
+            try:
+                if message is not None:
+                    self._handle_message(message)
+            except Exception as e:
+                logger.error(e)
+
+    async def _report(self) -> None:
+        """Periodically log the queue depth and high-watermark.
+
+        Returns:
+            None
+        """
+        started_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self._report_interval_s)
+            logger.bind(
+                queue_depth=self.queue_depth,
+                high_watermark=self._high_watermark,
+                uptime_s=round(time.monotonic() - started_at),
+            ).info("Pipeline queue")
@@ -0,0 +1,208 @@
+import cProfile
+import time
+from typing import Any, Callable, Literal
+
+import sinitaivas_live.constants as const
+import sinitaivas_live.metrics as metrics
+import utils.datetime_utils as dt_utils
+import utils.files_storage as fs
+from utils.logging import logger
+
+try:
+    import pyinstrument
+except ImportError:  # optional, installed with the `profile` extra
+    pyinstrument = None  # type: ignore[assignment]
+
+ProfileDump = Literal["none", "cprofile", "pyinstrument"]
+
+# name of the stage that times the whole handling of a message
+MESSAGE_STAGE = "message"
+
+
+def percentile(samples: list[int], fraction: float) -> int:
+    """Get a percentile of samples by the nearest-rank method.
+
+    Parameters:
+        samples (list[int]): The samples, sorted.
+        fraction (float): The percentile, between 0 and 1.
+
+    Returns:
+        value (int): The sample at that rank, 0 if there is none.
+    """
+    if not samples:
+        return 0
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class StageProfiler:
+    """Sample the duration of the processing stages and log their p50 and p99
+    every `report_interval_s` seconds.
+
+    The stages are the ones timed for `sinitaivas_stage_seconds` (parse, CAR
+    decode, model build, serialize, write): the profiler listens to one
+    timing out of `sample_every` of each stage, plus the whole handling of
+    one message out of `sample_every`, timed by the handler returned by
+    `wrap`. Nothing of it runs when the profiler is not installed. With decode
+    workers, the stages run in the workers are not sampled: only the write
+    and the whole messages are.
+
+    It can also profile the thread that handles the messages for the first
+    `window_s` seconds, with cProfile or pyinstrument, and dump the result
+    next to the logs.
+
+    Parameters:
+        sample_every (int): Keep one timing out of this many, per stage.
+        report_interval_s (float): Seconds between two reports in the log.
+        dump (ProfileDump): Profile the first `window_s` seconds with
+            "cprofile" or "pyinstrument", or "none".
+        window_s (float): Seconds profiled for the dump.
+        clock (Callable[[], float]): Monotonic clock in seconds.
+
+    Raises:
+        ValueError: If the dump needs pyinstrument and it is not installed.
+    """
+
+    def __init__(
+        self,
+        sample_every: int = const.PROFILE_SAMPLE_EVERY,
+        report_interval_s: float = const.PROFILE_REPORT_INTERVAL_S,
+        dump: ProfileDump = "none",
+        window_s: float = const.PROFILE_WINDOW_S,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if dump == "pyinstrument" and pyinstrument is None:
+            raise ValueError(
+                "pyinstrument is not installed, install the `profile` extra"
+            )
+        self._sample_every = max(1, sample_every)
+        self._report_interval_s = report_interval_s
+        self._dump = dump
+        self._window_s = window_s
+        self._clock = clock
+
+        self._samples: dict[str, list[int]] = {}
+        self._seen: dict[str, int] = {}
+        self._last_report_at = clock()
+        self._profile: Any = None
+        self._profile_started_at = 0.0
+        self._dumped = dump == "none"
+
+    def install(self) -> None:
+        """Start sampling the stage timings.
+
+        Returns:
+            None
+        """
+        metrics.STAGE_SECONDS.set_listener(self._observe)
+
+    def close(self) -> None:
+        """Stop sampling, write the dump if it is still running, and log the
+        last report.
+
+        Returns:
+            None
+        """
+        metrics.STAGE_SECONDS.set_listener(None)
+        if self._profile is not None:
+            self._write_dump()
+        self.report()
+
+    def wrap(self, handler: Callable[[Any], None]) -> Callable[[Any], None]:
+        """Wrap a message handler to sample its duration, report the
+        timings when due, and run the profile for the dump.
+
+        Parameters:
+            handler (Callable[[MessageFrame], None]): Processes each message.
+
+        Returns:
+            handler (Callable[[MessageFrame], None]): The profiled handler.
+        """
+
+        def profiled_handler(message: Any) -> None:
+            if not self._dumped:
+                self._run_dump()
+            seen = self._seen.get(MESSAGE_STAGE, 0) + 1
+            if seen < self._sample_every:
+                self._seen[MESSAGE_STAGE] = seen
+                handler(message)
+            else:
+                self._seen[MESSAGE_STAGE] = 0
+                started_at = time.perf_counter_ns()
+                try:
+                    handler(message)
+                finally:
+                    self._add(MESSAGE_STAGE, time.perf_counter_ns() - started_at)
+            if self._clock() - self._last_report_at >= self._report_interval_s:
+                self.report()
+
+        return profiled_handler
+
+    def report(self) -> None:
+        """Log the number of samples, p50 and p99 of each stage in
+        microseconds, and start new samples.
+
+        Returns:
+            None
+        """
+        self._last_report_at = self._clock()
+        samples, self._samples = self._samples, {}
+        for stage, durations in samples.items():
+            durations.sort()
+            logger.bind(
+                stage=stage,
+                samples=len(durations),
+                p50_us=round(percentile(durations, 0.5) / 1000, 1),
+                p99_us=round(percentile(durations, 0.99) / 1000, 1),
+            ).info("Stage timings")
+
+    def _observe(self, labels: metrics.LabelValues, seconds: float) -> None:
+        stage = labels[0]
+        seen = self._seen.get(stage, 0) + 1
+        if seen < self._sample_every:
+            self._seen[stage] = seen
+            return
+        self._seen[stage] = 0
+        self._add(stage, int(seconds * 1e9))
+
+    def _add(self, stage: str, duration_ns: int) -> None:
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = self._samples[stage] = []
+        samples.append(duration_ns)
+
+    def _run_dump(self) -> None:
+        """Start the profile on the first message, in the thread that handles
+        them, and write it once the window is over.
+
+        Returns:
+            None
+        """
+        if self._profile is None:
+            if self._dump == "pyinstrument":
+                self._profile = pyinstrument.Profiler()
+                self._profile.start()
+            else:
+                self._profile = cProfile.Profile()
+                self._profile.enable()
+            self._profile_started_at = self._clock()
+        elif self._clock() - self._profile_started_at >= self._window_s:
+            self._write_dump()
+
+    def _write_dump(self) -> None:
+        self._dumped = True
+        profile, self._profile = self._profile, None
+        written_at = dt_utils.current_datetime_utc().strftime("%Y-%m-%dT%H-%M-%S")
+        try:
+            if self._dump == "pyinstrument":
+                profile.stop()
+                path = f"{fs.current_dir()}/profile-{written_at}.html"
+                with open(path, "w") as f:
+                    f.write(profile.output_html())
+            else:
+                profile.disable()
+                path = f"{fs.current_dir()}/profile-{written_at}.prof"
+                profile.dump_stats(path)
+        except Exception as e:
+            logger.error(f"Failed to write profile: {e}")
+            return
+        logger.bind(file=path).info("Wrote profile")
@@ -0,0 +1,160 @@
+import gzip
+import json
+import os
+import zlib
+from typing import IO, Any, Iterable, Iterator, NamedTuple, Optional
+
+from sinitaivas_live.writer import index_path
+from utils.compression import compression_of
+from utils.logging import logger
+
+try:
+    import zstandard
+except ImportError:  # optional, installed with the `zstd` extra
+    zstandard = None  # type: ignore[assignment]
+
+
+class IndexEntry(NamedTuple):
+    """An entry of the sidecar index of a partition file: the line at
+    `offset` (the start of a member, if compressed) is the event `seq`."""
+
+    seq: int
+    commit_time: str
+    offset: int
+
+
+def read_index(path: str) -> list[IndexEntry]:
+    """Read the sidecar index of a partition file. Entries that point beyond
+    the end of the file (e.g. cut by a crash recovery) are dropped.
+
+    Parameters:
+        path (str): The path of the partition file.
+
+    Returns:
+        entries (list[IndexEntry]): The entries, by offset; empty if the file
+            has no index.
+    """
+    try:
+        size = os.path.getsize(path)
+        with open(index_path(path)) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in lines:
+        try:
+            seq, commit_time, offset = line.split("\t")
+            entry = IndexEntry(int(seq), commit_time, int(offset))
+        except ValueError:
+            continue
+        if entry.offset < size:
+            entries.append(entry)
+    return sorted(entries, key=lambda entry: entry.offset)
+
+
+def seek(
+    path: str,
+    seq: Optional[int] = None,
+    commit_time: Optional[str] = None,
+) -> Iterator[dict[str, Any]]:
+    """Iterate the events of a partition file, plain or compressed, from the
+    first one with a seq at least `seq`, or a `commit_time` at least
+    `commit_time` (an ISO 8601 string in UTC, as in the events).
+
+    The decoding starts from the last index entry strictly before the target,
+    so only the events after it are read, instead of the whole file: an entry
+    can point in the middle of a commit, whose first events are before it.
+    Without an index, the file is read from the start. A partially written
+    last line, or member, ends the iteration.
+
+    Parameters:
+        path (str): The path of the partition file.
+        seq (int | None): The first seq to return.
+        commit_time (str | None): The first commit time to return.
+
+    Returns:
+        events (Iterator[dict[str, Any]]): The events, in file order.
+    """
+    offset = 0
+    for entry in read_index(path):
+        if (seq is not None and entry.seq < seq) or (
+            commit_time is not None and entry.commit_time < commit_time
+        ):
+            offset = entry.offset
+
+    started = seq is None and commit_time is None
+    for event in _iter_events(path, offset):
+        if not started:
+            started = (seq is not None and event.get("seq", -1) >= seq) or (
+                commit_time is not None
+                and str(event.get("commit_time", "")) >= commit_time
+            )
+        if started:
+            yield event
+
+
+def _iter_events(path: str, offset: int) -> Iterator[dict[str, Any]]:
+    """Decode the events of a partition file from a line or member offset.
+
+    Parameters:
+        path (str): The path of the partition file.
+        offset (int): Where to start reading.
+
+    Returns:
+        events (Iterator[dict[str, Any]]): The events.
+    """
+    with open(path, "rb") as raw:
+        raw.seek(offset)
+        try:
+            for line in _open_lines(raw, compression_of(path)):
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logger.bind(file=path).warning("Skipping invalid line")
+        except (EOFError, zlib.error) as e:
+            logger.bind(file=path).warning(f"Partition ends early: {e}")
+        except Exception as e:
+            if zstandard is None or not isinstance(e, zstandard.ZstdError):
+                raise
+            logger.bind(file=path).warning(f"Partition ends early: {e}")
+
+
+def _open_lines(raw: IO[bytes], compression: str) -> Iterable[bytes]:
+    """Iterate the decompressed lines of a partition file from its position.
+
+    Parameters:
+        raw (IO[bytes]): The partition file, at a line or member offset.
+        compression (str): "none", "gzip" or "zstd".
+
+    Returns:
+        lines (Iterable[bytes]): The lines, with their newline.
+    """
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstandard is not installed, install the `zstd` extra")
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            raw, read_across_frames=True
+        )
+        return _BufferedLines(reader)
+    return raw
+
+
+class _BufferedLines:
+    """Iterate the lines of a binary stream that can only be read."""
+
+    def __init__(self, stream: Any) -> None:
+        self._stream = stream
+
+    def __iter__(self) -> Iterator[bytes]:
+        rest = b""
+        while chunk := self._stream.read(64 * 1024):
+            lines = (rest + chunk).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line + b"\n"
+        if rest:
+            yield rest
@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+from typing import Literal, Optional
+
+import sinitaivas_live.constants as const
+from sinitaivas_live.parser import RecordMode
+from sinitaivas_live.profiler import ProfileDump
+from utils.compression import Compression
+from utils.json_lines import JsonBackend
+
+
+@dataclass(frozen=True)
+class StreamerSettings:
+    """Runtime options of the streamer, as given on the command line.
+
+    Attributes:
+        checkpoint_every (int): Persist the cursor after this many messages.
+        checkpoint_interval_ms (int): Persist the cursor at least this often.
+        writer_buffer_size (int): Size in bytes of the partition write buffer.
+        writer_flush_interval_ms (int): Flush the write buffer at least this often.
+        compression (Compression): Compress the partitions while writing them,
+            with gzip or zstd, or not at all.
+        compression_level (int | None): The compression level, None for the
+            default of the compression.
+        shard_by_collection (bool): Write each collection to its own hourly file.
+        max_open_files (int): Maximum number of partition files open at once.
+        index_every_bytes (int): Bytes of events between two entries of the
+            index of a partition, 0 for no index.
+        engine (Literal["sync", "async"]): Run on the synchronous client, or on
+            the asyncio client with a bounded queue between receive and processing.
+        queue_size (int): Maximum number of frames waiting on the async queue.
+        spill_memory_bytes (int): With the sync engine, buffer the frames
+            between receive and processing, keeping this many bytes of them in
+            memory and spilling the rest to disk; 0 processes them in the
+            receiving loop.
+        stall_timeout_s (float): Replace the connection after this many
+            seconds without a frame, 0 to never.
+        workers (int): Number of decode worker processes, 0 to decode in the
+            main process.
+        json_backend (JsonBackend): Encode the output lines with the json module
+            or with orjson.
+        record_mode (RecordMode): Validate the records with the lexicon models,
+            or emit the decoded blocks as they are.
+        collections (tuple[str, ...]): Keep only the ops of these collections.
+        exclude_collections (tuple[str, ...]): Drop the ops of these collections.
+        actions (tuple[str, ...]): Keep only the ops with these actions.
+        exclude_actions (tuple[str, ...]): Drop the ops with these actions.
+        authors (tuple[str, ...]): Keep only the commits of these DIDs.
+        exclude_authors (tuple[str, ...]): Drop the commits of these DIDs.
+        parquet (bool): Also write the events to hourly Parquet files.
+        parquet_row_group_bytes (int): Size of the buffered JSON of a collection
+            written as a Parquet row group.
+        metrics_port (int): Serve the metrics at `/metrics` on this port, 0 to
+            not serve them.
+        metrics_host (str): The address the metrics server listens on.
+        profile (bool): Sample the stage timings and log their percentiles.
+        profile_sample_every (int): Keep one timing out of this many, per stage.
+        profile_dump (ProfileDump): Also profile the first `profile_window_s`
+            seconds with cProfile or pyinstrument and dump the result.
+        profile_window_s (float): Seconds profiled for the dump.
+        capture_path (str | None): Append the frames received to this capture
+            file.
+        replay_path (str | None): Process the frames of this capture file
+            instead of connecting to the relay.
+        replay_speed (float): Multiplier of the recorded rate of the replay,
+            0 to replay as fast as possible.
+        relay_uri (str): The XRPC endpoint of the relay.
+        output_dir (str | None): The directory of `firehose_stream/` and
+            `firehose_parquet/`, by default the working directory.
+    """
+
+    checkpoint_every: int = const.CHECKPOINT_EVERY_N_MESSAGES
+    checkpoint_interval_ms: int = const.CHECKPOINT_INTERVAL_MS
+    writer_buffer_size: int = const.WRITER_BUFFER_SIZE
+    writer_flush_interval_ms: int = const.WRITER_FLUSH_INTERVAL_MS
+    compression: Compression = "none"
+    compression_level: Optional[int] = None
+    shard_by_collection: bool = False
+    max_open_files: int = const.WRITER_MAX_OPEN_FILES
+    index_every_bytes: int = const.WRITER_INDEX_EVERY_BYTES
+    engine: Literal["sync", "async"] = "sync"
+    queue_size: int = const.QUEUE_SIZE
+    spill_memory_bytes: int = 0
+    stall_timeout_s: float = const.STALL_TIMEOUT_S
+    workers: int = 0
+    json_backend: JsonBackend = "json"
+    record_mode: RecordMode = "model"
+    collections: tuple[str, ...] = ()
+    exclude_collections: tuple[str, ...] = ()
+    actions: tuple[str, ...] = ()
+    exclude_actions: tuple[str, ...] = ()
+    authors: tuple[str, ...] = ()
+    exclude_authors: tuple[str, ...] = ()
+    parquet: bool = False
+    parquet_row_group_bytes: int = const.PARQUET_ROW_GROUP_BYTES
+    metrics_port: int = 0
+    metrics_host: str = "127.0.0.1"
+    profile: bool = False
+    profile_sample_every: int = const.PROFILE_SAMPLE_EVERY
+    profile_dump: ProfileDump = "none"
+    profile_window_s: float = const.PROFILE_WINDOW_S
+    capture_path: Optional[str] = None
+    replay_path: Optional[str] = None
+    replay_speed: float = 0.0
+    relay_uri: str = const.RELAY_URI
+    output_dir: Optional[str] = None
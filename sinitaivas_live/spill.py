@@ -0,0 +1,221 @@
+import os
+import struct
+import threading
+from collections import deque
+from typing import BinaryIO, Callable, Optional
+
+from atproto import firehose_models
+
+import sinitaivas_live.constants as const
+import sinitaivas_live.metrics as metrics
+from sinitaivas_live.capture import encode_message_frame
+from utils.logging import logger
+
+# before each frame of the segment file: its length
+_RECORD_HEADER = struct.Struct(">I")
+
+
+class SpillBuffer:
+    """FIFO of the frames received, between the receiver and the processing.
+
+    The frames are kept in memory up to `memory_bytes`; beyond that, the next
+    ones are appended to a segment file, and keep going there until the
+    frames on disk are read back, so that they come out in arrival order.
+    The segment is emptied each time it is drained, and removed on close:
+    after a crash, its frames were not checkpointed and are received again.
+
+    Every frame is kept, even one sent again by a relay resuming from the
+    checkpointed cursor while the first one is still in the buffer: it comes
+    out after it, and the handler drops it once the first one is written
+    (see `PartitionWriter.is_written`). `put` does not wait for the
+    processing, only for the segment write when it spills.
+
+    Parameters:
+        path (str): The segment file, created when the buffer first spills.
+        memory_bytes (int): Approximate size of the frames kept in memory:
+            the length of their CAR blocks plus `SPILL_FRAME_OVERHEAD_BYTES`.
+    """
+
+    def __init__(self, path: str, memory_bytes: int = const.SPILL_MEMORY_BYTES) -> None:
+        self._path = path
+        self._memory_bytes = memory_bytes
+        self._memory: deque[tuple[firehose_models.MessageFrame, int]] = deque()
+        self._memory_used = 0
+        # frames in the segment file not read yet, and its open handles
+        self._spilled = 0
+        self._writer: Optional[BinaryIO] = None
+        self._reader: Optional[BinaryIO] = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self.high_watermark = 0
+        if os.path.exists(path):
+            os.remove(path)
+
+    @property
+    def depth(self) -> int:
+        """The number of frames waiting to be processed, in memory and on disk."""
+        return len(self._memory) + self._spilled
+
+    @property
+    def spilled(self) -> int:
+        """The number of frames waiting in the segment file."""
+        return self._spilled
+
+    def put(self, message: firehose_models.MessageFrame) -> None:
+        """Add a frame at the end of the buffer, in memory or in the segment.
+
+        Parameters:
+            message (firehose_models.MessageFrame): The incoming message frame
+
+        Returns:
+            None
+        """
+        with self._condition:
+            blocks = message.body.get("blocks")
+            size = const.SPILL_FRAME_OVERHEAD_BYTES + (
+                len(blocks) if isinstance(blocks, bytes) else 0
+            )
+            if self._spilled or self._memory_used + size > self._memory_bytes:
+                self._spill(message)
+            else:
+                self._memory.append((message, size))
+                self._memory_used += size
+            depth = self.depth
+            if depth > self.high_watermark:
+                self.high_watermark = depth
+            self._condition.notify()
+
+    def _spill(self, message: firehose_models.MessageFrame) -> None:
+        if self._writer is None:
+            self._writer = open(self._path, "wb", buffering=0)
+            self._reader = open(self._path, "rb")
+        if not self._spilled:
+            logger.bind(file=self._path, depth=self.depth).warning(
+                "Processing is behind, spilling frames to disk"
+            )
+        frame = encode_message_frame(message)
+        self._writer.write(_RECORD_HEADER.pack(len(frame)) + frame)
+        self._spilled += 1
+        metrics.SPILLED_FRAMES.inc()
+
+    def get(self) -> Optional[firehose_models.MessageFrame]:
+        """Take the oldest frame, waiting for one.
+
+        Returns:
+            message (firehose_models.MessageFrame | None): The frame, None once
+                the buffer is closed and empty.
+        """
+        with self._condition:
+            while not self._memory and not self._spilled:
+                if self._closed:
+                    return None
+                self._condition.wait()
+            if self._memory:
+                message, size = self._memory.popleft()
+                self._memory_used -= size
+                return message
+        # only the consumer reads, and a frame counted in `_spilled` is
+        # written whole, so the segment is read without holding the lock
+        message = self._read_spilled()
+        with self._condition:
+            self._spilled -= 1
+            if not self._spilled:
+                self._reset_segment()
+        return message
+
+    def _read_spilled(self) -> firehose_models.MessageFrame:
+        assert self._reader is not None
+        (length,) = _RECORD_HEADER.unpack(self._reader.read(_RECORD_HEADER.size))
+        frame = firehose_models.Frame.from_bytes(self._reader.read(length))
+        return frame  # type: ignore[return-value]
+
+    def _reset_segment(self) -> None:
+        """Empty the drained segment, so that it does not grow without bounds."""
+        assert self._writer is not None and self._reader is not None
+        self._writer.truncate(0)
+        self._writer.seek(0)
+        self._reader.seek(0)
+        logger.bind(file=self._path).info("Spilled frames drained")
+
+    def close(self) -> None:
+        """Stop taking frames: `get` returns None once the buffer is drained.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def remove(self) -> None:
+        """Close and remove the segment file.
+
+        Returns:
+            None
+        """
+        for f in (self._writer, self._reader):
+            if f is not None:
+                f.close()
+        self._writer = self._reader = None
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+class BufferedConsumer:
+    """Decouple the receiving loop of the synchronous client from the
+    processing: the frames received are put on a `SpillBuffer`, and a
+    consumer thread hands them to the handler in order, so that a stalled
+    disk does not stop the websocket from being read. The handler still
+    advances the checkpoint, only once a frame is processed.
+
+    Parameters:
+        handler (Callable[[MessageFrame], None]): Processes each message,
+            usually a MessageHandler; called from the consumer thread.
+        buffer (SpillBuffer): Holds the frames waiting to be processed.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[firehose_models.MessageFrame], None],
+        buffer: SpillBuffer,
+    ) -> None:
+        self._handler = handler
+        self._buffer = buffer
+        self._thread = threading.Thread(
+            target=self._consume, name="sinitaivas-consumer", daemon=True
+        )
+        self._thread.start()
+        metrics.QUEUE_DEPTH.set_function(lambda: buffer.depth)
+
+    def __call__(self, message: firehose_models.MessageFrame) -> None:
+        """Receiver callback: add the frame to the buffer.
+
+        Parameters:
+            message (firehose_models.MessageFrame): The incoming message frame
+
+        Returns:
+            None
+        """
+        self._buffer.put(message)
+
+    def _consume(self) -> None:
+        while (message := self._buffer.get()) is not None:
+            try:
+                self._handler(message)
+            except Exception as e:
+                logger.error(e)
+
+    def close(self) -> None:
+        """Process the frames left in the buffer, then stop the consumer and
+        remove the segment file.
+
+        Returns:
+            None
+        """
+        self._buffer.close()
+        self._thread.join()
+        metrics.QUEUE_DEPTH.set_function(None)
+        self._buffer.remove()
+        logger.bind(high_watermark=self._buffer.high_watermark).info(
+            "Buffered consumer stopped"
+        )
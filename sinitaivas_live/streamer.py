@@ -1,39 +1,120 @@
 from atproto import (
+    AsyncFirehoseSubscribeReposClient,
     FirehoseSubscribeReposClient,
     firehose_models,
     models,
-    parse_subscribe_repos_message,
 )
-from typing import Literal
-from tenacity import retry, stop_after_attempt, wait_exponential
+import asyncio
+import functools
+import os
+import signal
+import threading
+from types import FrameType
+from typing import Any, Callable, Literal, Optional, Union
 
+import sinitaivas_live.constants as const
 import sinitaivas_live.cursor as cursor
+import sinitaivas_live.metrics as metrics
 import sinitaivas_live.parser as parser
-from utils.logging import logger, log_before_retry, log_after_retry
+import utils.files_storage as fs
+import utils.json_lines as json_lines
+from sinitaivas_live.capture import CaptureWriter, ReplayClient
+from sinitaivas_live.checkpoint import CheckpointManager
+from sinitaivas_live.filters import OpFilter
+from sinitaivas_live.metrics import MetricsServer
+from sinitaivas_live.parquet_sink import ParquetSink
+from sinitaivas_live.pipeline import AsyncPipeline
+from sinitaivas_live.profiler import StageProfiler
+from sinitaivas_live.settings import StreamerSettings
+from sinitaivas_live.spill import BufferedConsumer, SpillBuffer
+from sinitaivas_live.supervisor import AsyncConnectionSupervisor, ConnectionSupervisor
+from sinitaivas_live.workers import DecodeWorkers
+from sinitaivas_live.writer import PartitionWriter
+from utils.logging import logger
 
+FirehoseClient = Union[
+    FirehoseSubscribeReposClient, AsyncFirehoseSubscribeReposClient, ReplayClient
+]
 
-def get_fresh_client() -> FirehoseSubscribeReposClient:
+
+def get_fresh_client(
+    engine: Literal["sync", "async"] = "sync",
+    replay_path: Optional[str] = None,
+    replay_speed: float = 0.0,
+    base_uri: str = const.RELAY_URI,
+) -> FirehoseClient:
     """Start a Firehose Subscriber client without considering the cursor position.
 
+    Parameters:
+        engine (Literal["sync", "async"]): Whether to use the synchronous or the
+            asyncio client.
+        replay_path (str | None): Replay this capture file instead of
+            connecting to the relay.
+        replay_speed (float): Multiplier of the recorded rate of the replay,
+            0 to replay as fast as possible.
+        base_uri (str): The XRPC endpoint of the relay, e.g. a local relay
+            for load tests.
+
     Returns:
-        FirehoseSubscribeReposClient: The client instance.
+        FirehoseClient: The client instance.
     """
-    return FirehoseSubscribeReposClient(base_uri="wss://bsky.network/xrpc")
+    if replay_path:
+        return ReplayClient(replay_path, replay_speed)
+    if engine == "async":
+        return AsyncFirehoseSubscribeReposClient(base_uri=base_uri)
+    return FirehoseSubscribeReposClient(base_uri=base_uri)
 
 
-def resume_streamer() -> FirehoseSubscribeReposClient:
-    """Resume the streamer from the last known cursor position.
-    The cursor position is read from the cursor file.
+def read_resume_cursor(output_dir: Optional[str] = None) -> Optional[int]:
+    """The cursor position to resume from, read from the cursor file.
     If the cursor position is not found, it reads the last sequence from the latest ndjson file.
 
+    Parameters:
+        output_dir (str | None): The directory of `firehose_stream/`, by
+            default the working directory.
+
     Returns:
-        FirehoseSubscribeReposClient: The client instance.
+        cursor_position (int | None): The cursor, None if none is found.
     """
-    client = get_fresh_client()
-    cursor_position = cursor.read_cursor().get("streamer", {}).get("cursor")
+    cursor_position: Optional[int] = (
+        cursor.read_cursor().get("streamer", {}).get("cursor")
+    )
     if not cursor_position:
-        last_seq = cursor.read_last_seq_from_file()
+        last_seq = cursor.read_last_seq_from_file(
+            f"{output_dir}/firehose_stream" if output_dir else None
+        )
         cursor_position = last_seq
+    return cursor_position
+
+
+def resume_streamer(
+    engine: Literal["sync", "async"] = "sync",
+    replay_path: Optional[str] = None,
+    replay_speed: float = 0.0,
+    base_uri: str = const.RELAY_URI,
+    output_dir: Optional[str] = None,
+    cursor_position: Optional[int] = None,
+) -> FirehoseClient:
+    """Resume the streamer from the last known cursor position.
+    The cursor position is read with `read_resume_cursor` when not given.
+
+    Parameters:
+        engine (Literal["sync", "async"]): Whether to use the synchronous or the
+            asyncio client.
+        replay_path (str | None): Replay this capture file instead of
+            connecting to the relay.
+        replay_speed (float): Multiplier of the recorded rate of the replay.
+        base_uri (str): The XRPC endpoint of the relay.
+        output_dir (str | None): The directory of `firehose_stream/`, by
+            default the working directory.
+        cursor_position (int | None): The cursor to resume from.
+
+    Returns:
+        FirehoseClient: The client instance.
+    """
+    client = get_fresh_client(engine, replay_path, replay_speed, base_uri)
+    if cursor_position is None:
+        cursor_position = read_resume_cursor(output_dir)
     client.update_params(
         models.ComAtprotoSyncSubscribeRepos.Params(cursor=cursor_position)
     )
@@ -41,17 +122,199 @@ def resume_streamer() -> FirehoseSubscribeReposClient:
     return client
 
 
-def start(client: FirehoseSubscribeReposClient) -> FirehoseSubscribeReposClient:
+def connect_client(
+    base_uri: str, cursor_position: Optional[int]
+) -> FirehoseSubscribeReposClient:
+    """Start a synchronous client from a cursor position, e.g. for a reconnect.
+
+    Parameters:
+        base_uri (str): The XRPC endpoint of the relay.
+        cursor_position (int | None): The cursor, None for the head of the stream.
+
+    Returns:
+        FirehoseSubscribeReposClient: The client instance.
+    """
+    client = FirehoseSubscribeReposClient(base_uri=base_uri)
+    client.update_params(
+        models.ComAtprotoSyncSubscribeRepos.Params(cursor=cursor_position)
+    )
+    return client
+
+
+def connect_async_client(
+    base_uri: str, cursor_position: Optional[int]
+) -> AsyncFirehoseSubscribeReposClient:
+    """Start an asyncio client from a cursor position, e.g. for a reconnect.
+
+    Parameters:
+        base_uri (str): The XRPC endpoint of the relay.
+        cursor_position (int | None): The cursor, None for the head of the stream.
+
+    Returns:
+        AsyncFirehoseSubscribeReposClient: The client instance.
+    """
+    client = AsyncFirehoseSubscribeReposClient(base_uri=base_uri)
+    client.update_params(
+        models.ComAtprotoSyncSubscribeRepos.Params(cursor=cursor_position)
+    )
+    return client
+
+
+def handle_message(
+    message: firehose_models.MessageFrame,
+    checkpoint: CheckpointManager,
+    writer: PartitionWriter,
+    options: parser.ParseOptions = parser.DEFAULT_OPTIONS,
+    sink: Optional[parser.EventSink] = None,
+) -> None:
+    """Handle incoming messages from the Firehose stream.
+    This function processes the message of any type (see
+    `parser.process_message`), records its seq as written and advances the
+    cursor checkpoint to it. A dropped message is counted, not logged.
+
+    Parameters:
+        message (firehose_models.MessageFrame): The incoming message frame
+        checkpoint (CheckpointManager): Tracks the cursor of processed messages.
+        writer (PartitionWriter): The writer of the hourly partitions.
+        options (ParseOptions): How the events are built and encoded.
+        sink (EventSink | None): Also receives the events, e.g. the Parquet sink.
+
+    Returns:
+        None
+    """
+    seq, dropped = parser.process_message(message, writer, options, sink)
+    if dropped is not None:
+        metrics.DROPPED_MESSAGES.labels(message.type, dropped).inc()
+    if seq is not None:
+        writer.record_seq(seq)
+        checkpoint.advance(seq)
+
+
+class MessageHandler:
+    """Handle the messages of the stream: drop the filtered-out ops, then parse,
+    write and checkpoint the message in place, or hand it to the decode workers.
+    A commit whose ops are all filtered out only advances the cursor, and a
+    message whose events are already written (see `PartitionWriter.is_written`)
+    is dropped.
+
+    Parameters:
+        checkpoint (CheckpointManager): Tracks the cursor of processed messages.
+        writer (PartitionWriter): The writer of the hourly partitions.
+        options (ParseOptions): How the events are built and encoded.
+        workers (DecodeWorkers | None): Decode the messages in worker processes
+            instead of in the calling thread.
+        op_filter (OpFilter | None): Drops ops by collection, action and author.
+        sink (EventSink | None): Also receives the events, when they are
+            decoded in the calling thread.
+    """
+
+    def __init__(
+        self,
+        checkpoint: CheckpointManager,
+        writer: PartitionWriter,
+        options: parser.ParseOptions = parser.DEFAULT_OPTIONS,
+        workers: Optional[DecodeWorkers] = None,
+        op_filter: Optional[OpFilter] = None,
+        sink: Optional[parser.EventSink] = None,
+    ) -> None:
+        self._checkpoint = checkpoint
+        self._writer = writer
+        self._options = options
+        self._workers = workers
+        self._op_filter = op_filter
+        self._sink = sink
+
+    def __call__(self, message: firehose_models.MessageFrame) -> None:
+        """Handle an incoming message from the Firehose stream.
+
+        Parameters:
+            message (firehose_models.MessageFrame): The incoming message frame
+
+        Returns:
+            None
+        """
+        metrics.MESSAGES.labels(str(message.type)).inc()
+        seq = message.body.get("seq")
+        if isinstance(seq, int) and self._writer.is_written(seq):
+            metrics.DROPPED_MESSAGES.labels(str(message.type), parser.DUPLICATE).inc()
+            return
+        if message.type == "#commit":
+            metrics.set_commit_time(message.body.get("time"))
+        if self._op_filter is not None and not self._op_filter.apply(message):
+            self._skip(seq)
+            return
+        if message.type == "#commit":
+            self._count_ops(message.body)
+        if self._workers is not None:
+            self._workers.submit(message)
+        else:
+            handle_message(
+                message, self._checkpoint, self._writer, self._options, self._sink
+            )
+
+    @staticmethod
+    def _count_ops(body: dict[str, Any]) -> None:
+        """Count the ops of a commit that are processed, by collection and action.
+
+        Parameters:
+            body (dict[str, Any]): The body of the #commit message frame.
+
+        Returns:
+            None
+        """
+        for op in body.get("ops") or []:
+            collection = (op.get("path") or "").split("/", 1)[0]
+            metrics.OPS.labels(collection, str(op.get("action"))).inc()
+
+    def _skip(self, seq: Optional[int]) -> None:
+        """Advance the cursor past a commit that has nothing to write, after
+        the messages before it.
+
+        Parameters:
+            seq (int | None): The seq of the commit.
+
+        Returns:
+            None
+        """
+        if not isinstance(seq, int):
+            return
+        if self._workers is not None:
+            self._workers.skip(seq)
+        else:
+            self._checkpoint.advance(seq)
+
+    def close(self) -> None:
+        """Write the messages still in the decode workers and report the
+        filtered-out ops.
+
+        Returns:
+            None
+        """
+        if self._workers is not None:
+            self._workers.close()
+        if self._op_filter is not None:
+            self._op_filter.report()
+
+
+def start(
+    client: Union[FirehoseSubscribeReposClient, ReplayClient, ConnectionSupervisor],
+    handler: Callable[[firehose_models.MessageFrame], None],
+) -> Union[FirehoseSubscribeReposClient, ReplayClient, ConnectionSupervisor]:
     """Start the subscription to the Firehose and process incoming messages.
 
+    Parameters:
+        client (FirehoseSubscribeReposClient | ReplayClient | ConnectionSupervisor):
+            The client to start, or the supervisor of the clients.
+        handler (Callable[[MessageFrame], None]): Processes each message,
+            usually a MessageHandler.
+
     Returns:
-        FirehoseSubscribeReposClient: The client instance
+        client (FirehoseSubscribeReposClient | ReplayClient | ConnectionSupervisor):
+            The client instance
     """
 
     def on_message_callback(message: firehose_models.MessageFrame) -> None:
         """Handle incoming messages from the Firehose stream.
-        This function parses the incoming message, processes the commit if valid,
-        and updates the cursor position in the client.
 
         Parameters:
             message (firehose_models.MessageFrame): The incoming message frame
@@ -59,16 +322,7 @@ def start(client: FirehoseSubscribeReposClient) -> FirehoseSubscribeReposClient:
         Returns:
             None
         """
-        commit = parse_subscribe_repos_message(message)
-        if (
-            not isinstance(commit, models.ComAtprotoSyncSubscribeRepos.Commit)
-            or not commit.blocks
-        ):
-            logger.bind(commit=commit).warning("Invalid commit")
-            return
-
-        parser.process_commit(commit)
-        cursor.update_cursor(client, commit.seq)
+        handler(message)
 
     def on_callback_error_callback(error: BaseException) -> None:
         """Callback to handle errors encountered during message processing.
@@ -85,33 +339,226 @@ def start(client: FirehoseSubscribeReposClient) -> FirehoseSubscribeReposClient:
     return client
 
 
-@retry(
-    stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    before=log_before_retry,
-    after=log_after_retry,
-)
-def start_with_retry(
-    client: FirehoseSubscribeReposClient,
-) -> FirehoseSubscribeReposClient:
-    return start(client)
+async def start_async(
+    client: AsyncConnectionSupervisor,
+    handler: Callable[[firehose_models.MessageFrame], None],
+    queue_size: int,
+) -> AsyncConnectionSupervisor:
+    """Start the subscription with the asyncio client: a receiver puts the frames
+    on a bounded queue, a consumer hands them to `handler` in its own thread.
 
+    Parameters:
+        client (AsyncConnectionSupervisor): The supervisor of the clients.
+        handler (Callable[[MessageFrame], None]): Processes each message,
+            usually a MessageHandler.
+        queue_size (int): Maximum number of frames waiting to be processed.
 
-def streamer_main(mode: Literal["fresh", "resume"]) -> None:
+    Returns:
+        AsyncConnectionSupervisor: The supervisor instance
+    """
+    pipeline = AsyncPipeline(client, handler, queue_size=queue_size)
+    pipeline.install_signal_handlers()
+    await pipeline.run()
+    return client
+
+
+def _install_signal_handlers(
+    client: Union[FirehoseSubscribeReposClient, ReplayClient, ConnectionSupervisor],
+) -> dict[int, Any]:
+    """Stop the client on SIGTERM and SIGINT, so that the streamer returns and
+    shuts down cleanly (last checkpoint, writer closed). The handler does not
+    touch the writer itself: it may interrupt a write in progress.
+    Signal handlers can only be installed from the main thread; elsewhere
+    this is a no-op.
+
+    Parameters:
+        client (FirehoseSubscribeReposClient | ReplayClient | ConnectionSupervisor):
+            The client, or the supervisor of the clients, to stop.
+
+    Returns:
+        previous_handlers (dict[int, Any]): The handlers that were replaced.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return {}
+
+    def on_signal(signum: int, frame: Optional[FrameType]) -> None:
+        logger.info(f"Received {signal.Signals(signum).name}, stopping streamer")
+        client.stop()
+
+    return {
+        signum: signal.signal(signum, on_signal)
+        for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+
+
+def streamer_main(
+    mode: Literal["fresh", "resume"],
+    settings: StreamerSettings = StreamerSettings(),
+) -> None:
     """Main function to run the streamer.
 
     Parameters:
         mode (str): Mode to run the streamer [fresh/resume].
+        settings (StreamerSettings): Runtime options of the streamer.
     Returns:
         None
     """
+    # resolved once, the working directory may change while running
+    output_dir = os.path.abspath(settings.output_dir or fs.current_dir())
+    resume_from: Optional[int] = None
     if mode == "fresh":
-        client = get_fresh_client()
+        client = get_fresh_client(
+            settings.engine,
+            settings.replay_path,
+            settings.replay_speed,
+            settings.relay_uri,
+        )
         cursor.reset_cursor(client)
     else:
-        client = resume_streamer()
+        resume_from = read_resume_cursor(output_dir)
+        client = resume_streamer(
+            settings.engine,
+            settings.replay_path,
+            settings.replay_speed,
+            settings.relay_uri,
+            output_dir,
+            cursor_position=resume_from,
+        )
 
+    writer = PartitionWriter(
+        f"{output_dir}/firehose_stream",
+        buffer_size=settings.writer_buffer_size,
+        flush_interval_ms=settings.writer_flush_interval_ms,
+        compression=settings.compression,
+        compression_level=settings.compression_level,
+        max_open_files=settings.max_open_files,
+        index_every_bytes=settings.index_every_bytes,
+    )
+    writer.recover()
+    checkpoint = CheckpointManager(
+        client,
+        writer.sync,
+        flush_every=settings.checkpoint_every,
+        flush_interval_ms=settings.checkpoint_interval_ms,
+    )
+    if mode == "resume" and checkpoint.committed_seq is not None:
+        # the events up to the checkpoint are synced, in every file
+        writer.record_seq(checkpoint.committed_seq)
+        logger.bind(seq=checkpoint.committed_seq).info(
+            "Dropping the messages already written"
+        )
+    options = parser.ParseOptions(
+        record_mode=settings.record_mode,
+        encode_line=json_lines.get_line_encoder(settings.json_backend),
+        shard_by_collection=settings.shard_by_collection,
+    )
+    sink = (
+        ParquetSink(
+            f"{output_dir}/firehose_parquet",
+            row_group_bytes=settings.parquet_row_group_bytes,
+            encode_line=options.encode_line,
+        )
+        if settings.parquet
+        else None
+    )
+    if sink is not None:
+        sink.recover()
+    workers = (
+        DecodeWorkers(settings.workers, checkpoint, writer, options=options, sink=sink)
+        if settings.workers > 0
+        else None
+    )
+    op_filter = OpFilter(
+        collections=settings.collections,
+        exclude_collections=settings.exclude_collections,
+        actions=settings.actions,
+        exclude_actions=settings.exclude_actions,
+        authors=settings.authors,
+        exclude_authors=settings.exclude_authors,
+    )
+    handler = MessageHandler(
+        checkpoint,
+        writer,
+        options,
+        workers,
+        op_filter if op_filter.active else None,
+        sink,
+    )
+    metrics_server = (
+        MetricsServer(settings.metrics_port, settings.metrics_host)
+        if settings.metrics_port
+        else None
+    )
+    if metrics_server is not None:
+        metrics_server.start()
+    profiler = (
+        StageProfiler(
+            sample_every=settings.profile_sample_every,
+            dump=settings.profile_dump,
+            window_s=settings.profile_window_s,
+        )
+        if settings.profile or settings.profile_dump != "none"
+        else None
+    )
+    on_message: Callable[[firehose_models.MessageFrame], None] = handler
+    if profiler is not None:
+        profiler.install()
+        on_message = profiler.wrap(handler)
+    consumer = (
+        BufferedConsumer(
+            on_message,
+            SpillBuffer(
+                f"{output_dir}/firehose_spill.seg", settings.spill_memory_bytes
+            ),
+        )
+        if settings.spill_memory_bytes > 0
+        and not isinstance(client, AsyncFirehoseSubscribeReposClient)
+        else None
+    )
+    if consumer is not None:
+        on_message = consumer
+    capture = CaptureWriter(settings.capture_path) if settings.capture_path else None
+    if capture is not None:
+        on_message = capture.wrap(on_message)
+    previous_handlers: dict[int, Any] = {}
     try:
-        client = start_with_retry(client)
+        if isinstance(client, AsyncFirehoseSubscribeReposClient):
+            async_supervisor = AsyncConnectionSupervisor(
+                client,
+                functools.partial(connect_async_client, settings.relay_uri),
+                checkpoint,
+                cursor=resume_from,
+                stall_timeout_s=settings.stall_timeout_s,
+            )
+            asyncio.run(start_async(async_supervisor, on_message, settings.queue_size))
+        elif isinstance(client, ReplayClient):
+            previous_handlers = _install_signal_handlers(client)
+            start(client, on_message)
+        else:
+            supervisor = ConnectionSupervisor(
+                client,
+                functools.partial(connect_client, settings.relay_uri),
+                checkpoint,
+                cursor=resume_from,
+                stall_timeout_s=settings.stall_timeout_s,
+            )
+            previous_handlers = _install_signal_handlers(supervisor)
+            start(supervisor, on_message)
     except Exception as e:
         logger.error(f"Cannot recover from failures: {e}")
+    finally:
+        if consumer is not None:
+            consumer.close()
+        handler.close()
+        checkpoint.flush()
+        writer.close()
+        if sink is not None:
+            sink.close()
+        if metrics_server is not None:
+            metrics_server.close()
+        if profiler is not None:
+            profiler.close()
+        if capture is not None:
+            capture.close()
+        for signum, previous_handler in previous_handlers.items():
+            signal.signal(signum, previous_handler)
@@ -0,0 +1,452 @@
+from atproto import (
+    AsyncFirehoseSubscribeReposClient,
+    FirehoseSubscribeReposClient,
+    firehose_models,
+)
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Generic, Optional, TypeVar
+
+import sinitaivas_live.constants as const
+import sinitaivas_live.metrics as metrics
+from sinitaivas_live.checkpoint import CheckpointManager
+from utils.logging import logger
+
+_Client = TypeVar(
+    "_Client", FirehoseSubscribeReposClient, AsyncFirehoseSubscribeReposClient
+)
+
+
+class _Supervisor(Generic[_Client]):
+    """The bookkeeping shared by the synchronous and the asyncio supervisors:
+    the cursor and delay of the next connection, the frames of the current
+    one, and the reconnect metrics.
+
+    Parameters:
+        client (FirehoseSubscribeReposClient | AsyncFirehoseSubscribeReposClient):
+            The client of the first connection, its cursor param already set.
+        connect (Callable[[Optional[int]], client]): Returns the client of a
+            new connection from a cursor, None for the head of the stream.
+        checkpoint (CheckpointManager): Keeps the cursor param of the current
+            client up to date, and gives the cursor of the next connection.
+        cursor (int | None): The cursor param of `client`.
+        stall_timeout_s (float): Seconds without a frame before the connection
+            is replaced, 0 for no watchdog.
+        min_delay_s (float): The delay before the first reconnect.
+        max_delay_s (float): The maximum delay between two reconnects.
+        clock (Callable[[], float]): Monotonic clock in seconds.
+    """
+
+    def __init__(
+        self,
+        client: _Client,
+        connect: Callable[[Optional[int]], _Client],
+        checkpoint: CheckpointManager,
+        cursor: Optional[int] = None,
+        stall_timeout_s: float = const.STALL_TIMEOUT_S,
+        min_delay_s: float = const.RECONNECT_MIN_DELAY_S,
+        max_delay_s: float = const.RECONNECT_MAX_DELAY_S,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._first_client = client
+        self._connect = connect
+        self._checkpoint = checkpoint
+        self._cursor = cursor
+        self._stall_timeout_s = stall_timeout_s
+        self._min_delay_s = min_delay_s
+        self._max_delay_s = max(min_delay_s, max_delay_s)
+        self._clock = clock
+
+        self._client: Optional[_Client] = None
+        # frames of the current connection, and when the last one arrived
+        self._frames = 0
+        self._last_frame_at = clock()
+        self._processing = False
+        self._stalled: Optional[_Client] = None
+        # when the previous connection ended, and when the last frame arrived
+        self._disconnected_at: Optional[float] = None
+        self._last_received_at: Optional[float] = None
+
+    @property
+    def resume_cursor(self) -> Optional[int]:
+        """The cursor of the next connection: the checkpointed one, or the
+        cursor of the first connection until a checkpoint is written."""
+        seq = self._checkpoint.committed_seq
+        return seq if seq is not None else self._cursor
+
+    def _delay(self, attempt: int) -> float:
+        """The delay before a reconnect: between half and all of an exponential
+        ceiling, so that the reconnects of several collectors spread out.
+
+        Parameters:
+            attempt (int): The number of connections in a row without a frame.
+
+        Returns:
+            delay (float): Seconds to wait.
+        """
+        ceiling = min(self._max_delay_s, self._min_delay_s * 2 ** (attempt - 1))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def _connected(self, client: _Client) -> None:
+        """Start the bookkeeping of a connection, before its client starts.
+
+        Parameters:
+            client (FirehoseSubscribeReposClient | AsyncFirehoseSubscribeReposClient):
+                The client of the connection.
+
+        Returns:
+            None
+        """
+        self._checkpoint.attach(client)
+        self._frames = 0
+        self._last_frame_at = self._clock()
+        self._client = client
+
+    def _ended(self, client: _Client, reason: str, attempt: int) -> tuple[int, float]:
+        """Count and log the end of a connection.
+
+        Parameters:
+            client (FirehoseSubscribeReposClient | AsyncFirehoseSubscribeReposClient):
+                The client of the connection.
+            reason (str): Why the client returned.
+            attempt (int): The connections in a row without a frame so far.
+
+        Returns:
+            attempt, delay (tuple[int, float]): The connections in a row
+                without a frame, this one included, and the seconds to wait
+                before the next one.
+        """
+        self._client = None
+        if self._stalled is client:
+            reason = "stalled"
+        if self._disconnected_at is None:
+            self._disconnected_at = self._clock()
+        attempt = 1 if self._frames else attempt + 1
+        delay = self._delay(attempt)
+        metrics.RECONNECTS.inc()
+        logger.bind(
+            reason=reason,
+            attempt=attempt,
+            delay_s=round(delay, 1),
+            cursor=self.resume_cursor,
+        ).warning("Subscription ended, reconnecting")
+        return attempt, delay
+
+    def _received(self) -> None:
+        """Record a frame received, before it is handed to the callback."""
+        now = self._clock()
+        self._frames += 1
+        self._last_frame_at = now
+        if self._disconnected_at is not None:
+            self._observe_reconnect(now)
+        self._last_received_at = now
+
+    def _observe_reconnect(self, now: float) -> None:
+        """Record how long the stream was interrupted, at the first frame of a
+        new connection.
+
+        Parameters:
+            now (float): The time the frame was received.
+
+        Returns:
+            None
+        """
+        assert self._disconnected_at is not None
+        reconnect_s = now - self._disconnected_at
+        metrics.RECONNECT_SECONDS.observe(reconnect_s)
+        gap_s = (
+            reconnect_s
+            if self._last_received_at is None
+            else now - self._last_received_at
+        )
+        metrics.GAP_SECONDS.observe(gap_s)
+        logger.bind(
+            reconnect_s=round(reconnect_s, 1),
+            gap_s=round(gap_s, 1),
+            cursor=self.resume_cursor,
+        ).info("Subscription resumed")
+        self._disconnected_at = None
+
+    def _stalled_client(self) -> Optional[_Client]:
+        """The client of the current connection if it has not received a frame
+        for `stall_timeout_s`, and is not processing one; it is then counted
+        and logged as stalled.
+
+        Returns:
+            client (FirehoseSubscribeReposClient | AsyncFirehoseSubscribeReposClient | None):
+                The client to stop, if any.
+        """
+        client = self._client
+        idle_s = self._clock() - self._last_frame_at
+        if (
+            client is None
+            or client is self._stalled
+            or self._processing
+            or idle_s < self._stall_timeout_s
+        ):
+            return None
+        logger.bind(idle_s=round(idle_s, 1), cursor=self.resume_cursor).warning(
+            "No frame received, replacing the connection"
+        )
+        metrics.STALLS.inc()
+        self._stalled = client
+        return client
+
+
+class ConnectionSupervisor(_Supervisor[FirehoseSubscribeReposClient]):
+    """Keep the subscription of the synchronous client running, for as long as
+    the streamer is not stopped. It is started and stopped like the client.
+
+    The client reconnects by itself after a network error, but it returns when
+    the relay closes the connection and raises on an error frame. The
+    supervisor then connects a new client, after a jittered exponential delay
+    that starts over once a connection has received frames, so that the
+    collectors dropped together by a relay restart do not come back together.
+
+    A new connection resumes from the checkpointed cursor, like the reconnects
+    of the client itself: the frames received but not processed yet (e.g. in
+    the spill buffer) are only given up once processed. The frames sent again
+    up to the last one processed are dropped by the handler, whose writer
+    knows they are written (see `PartitionWriter.is_written`).
+
+    A watchdog thread replaces the connection when no frame has been received
+    for `stall_timeout_s` seconds, except while the callback is processing
+    one: a slow disk is not a stalled relay.
+
+    Parameters:
+        client (FirehoseSubscribeReposClient): The client of the first
+            connection, its cursor param already set.
+        connect (Callable[[Optional[int]], FirehoseSubscribeReposClient]):
+            Returns the client of a new connection from a cursor, None for the
+            head of the stream.
+        checkpoint (CheckpointManager): Keeps the cursor param of the current
+            client up to date, and gives the cursor of the next connection.
+        cursor (int | None): The cursor param of `client`.
+        stall_timeout_s (float): Seconds without a frame before the connection
+            is replaced, 0 for no watchdog.
+        min_delay_s (float): The delay before the first reconnect.
+        max_delay_s (float): The maximum delay between two reconnects.
+        clock (Callable[[], float]): Monotonic clock in seconds.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._stopping = threading.Event()
+        self._on_message_callback: Callable[[firehose_models.MessageFrame], None]
+
+    def start(
+        self,
+        on_message_callback: Callable[[firehose_models.MessageFrame], None],
+        on_callback_error_callback: Optional[Callable[[BaseException], None]] = None,
+    ) -> None:
+        """Run the subscription until `stop` is called.
+
+        Parameters:
+            on_message_callback (Callable[[MessageFrame], None]): Processes
+                each message, usually a MessageHandler.
+            on_callback_error_callback (Callable[[BaseException], None] | None):
+                Called when processing a message raised.
+
+        Returns:
+            None
+        """
+        self._on_message_callback = on_message_callback
+        watchdog = None
+        if self._stall_timeout_s > 0:
+            watchdog = threading.Thread(
+                target=self._watch, name="sinitaivas-watchdog", daemon=True
+            )
+            watchdog.start()
+        client = self._first_client
+        attempt = 0
+        try:
+            while not self._stopping.is_set():
+                self._connected(client)
+                if self._stopping.is_set():
+                    break
+                try:
+                    client.start(self._on_message, on_callback_error_callback)
+                    reason = "closed by the relay"
+                except Exception as e:
+                    reason = str(e)
+                if self._stopping.is_set():
+                    break
+                attempt, delay = self._ended(client, reason, attempt)
+                if self._stopping.wait(delay):
+                    break
+                client = self._connect(self.resume_cursor)
+        finally:
+            self._client = None
+            self._stopping.set()
+            if watchdog is not None:
+                watchdog.join()
+
+    def stop(self) -> None:
+        """Stop the subscription; `start` returns once the frame being
+        processed is done. Safe to call from a signal handler or another thread.
+
+        Returns:
+            None
+        """
+        self._stopping.set()
+        client = self._client
+        if client is not None:
+            client.stop()
+
+    def _on_message(self, message: firehose_models.MessageFrame) -> None:
+        """Client callback: record the frame, then hand it to the callback.
+
+        Parameters:
+            message (firehose_models.MessageFrame): The incoming message frame
+
+        Returns:
+            None
+        """
+        self._received()
+        self._processing = True
+        try:
+            self._on_message_callback(message)
+        finally:
+            self._processing = False
+            self._last_frame_at = self._clock()
+
+    def _watch(self) -> None:
+        """Watchdog thread: stop the client of a connection that has not
+        received a frame for `stall_timeout_s`, so that `start` replaces it.
+
+        Returns:
+            None
+        """
+        interval = min(1.0, self._stall_timeout_s / 4)
+        while not self._stopping.wait(interval):
+            client = self._stalled_client()
+            if client is not None:
+                client.stop()
+
+
+class AsyncConnectionSupervisor(_Supervisor[AsyncFirehoseSubscribeReposClient]):
+    """Keep the subscription of the asyncio client running, for as long as the
+    streamer is not stopped, as `ConnectionSupervisor` does for the
+    synchronous client. It is started and stopped like the client, e.g. by
+    `AsyncPipeline`, and runs on the event loop: the watchdog is a task.
+
+    The callback awaiting, e.g. for room on a full queue, counts as processing
+    a frame, and does not make the connection look stalled.
+
+    Parameters:
+        client (AsyncFirehoseSubscribeReposClient): The client of the first
+            connection, its cursor param already set.
+        connect (Callable[[Optional[int]], AsyncFirehoseSubscribeReposClient]):
+            Returns the client of a new connection from a cursor, None for the
+            head of the stream.
+        checkpoint (CheckpointManager): Keeps the cursor param of the current
+            client up to date, and gives the cursor of the next connection.
+        cursor (int | None): The cursor param of `client`.
+        stall_timeout_s (float): Seconds without a frame before the connection
+            is replaced, 0 for no watchdog.
+        min_delay_s (float): The delay before the first reconnect.
+        max_delay_s (float): The maximum delay between two reconnects.
+        clock (Callable[[], float]): Monotonic clock in seconds.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._stopping = asyncio.Event()
+        self._on_message_callback: Callable[
+            [firehose_models.MessageFrame], Awaitable[None]
+        ]
+
+    async def start(
+        self,
+        on_message_callback: Callable[[firehose_models.MessageFrame], Awaitable[None]],
+        on_callback_error_callback: Optional[
+            Callable[[BaseException], Awaitable[None]]
+        ] = None,
+    ) -> None:
+        """Run the subscription until `stop` is called.
+
+        Parameters:
+            on_message_callback (Callable[[MessageFrame], Awaitable[None]]):
+                Processes each message, e.g. puts it on the pipeline queue.
+            on_callback_error_callback (Callable[[BaseException], Awaitable[None]] | None):
+                Called when processing a message raised.
+
+        Returns:
+            None
+        """
+        self._on_message_callback = on_message_callback
+        watchdog = None
+        if self._stall_timeout_s > 0:
+            watchdog = asyncio.create_task(self._watch())
+        client = self._first_client
+        attempt = 0
+        try:
+            while not self._stopping.is_set():
+                self._connected(client)
+                try:
+                    await client.start(self._on_message, on_callback_error_callback)
+                    reason = "closed by the relay"
+                except Exception as e:
+                    reason = str(e)
+                if self._stopping.is_set():
+                    break
+                attempt, delay = self._ended(client, reason, attempt)
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), delay)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+                client = self._connect(self.resume_cursor)
+        finally:
+            self._client = None
+            self._stopping.set()
+            if watchdog is not None:
+                await watchdog
+
+    async def stop(self) -> None:
+        """Stop the subscription; `start` returns once the frame being
+        processed is done. Must be called from the event loop thread.
+
+        Returns:
+            None
+        """
+        self._stopping.set()
+        client = self._client
+        if client is not None:
+            await client.stop()
+
+    async def _on_message(self, message: firehose_models.MessageFrame) -> None:
+        """Client callback: record the frame, then hand it to the callback.
+
+        Parameters:
+            message (firehose_models.MessageFrame): The incoming message frame
+
+        Returns:
+            None
+        """
+        self._received()
+        self._processing = True
+        try:
+            await self._on_message_callback(message)
+        finally:
+            self._processing = False
+            self._last_frame_at = self._clock()
+
+    async def _watch(self) -> None:
+        """Watchdog task: stop the client of a connection that has not
+        received a frame for `stall_timeout_s`, so that `start` replaces it.
+
+        Returns:
+            None
+        """
+        interval = min(1.0, self._stall_timeout_s / 4)
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            client = self._stalled_client()
+            if client is not None and not self._stopping.is_set():
+                await client.stop()
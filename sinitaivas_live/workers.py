@@ -0,0 +1,305 @@
+from atproto import firehose_models
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional, Union
+
+import sinitaivas_live.constants as const
+import sinitaivas_live.metrics as metrics
+import sinitaivas_live.parser as parser
+from sinitaivas_live.checkpoint import CheckpointManager
+from sinitaivas_live.writer import PartitionWriter
+from utils.logging import logger
+
+
+@dataclass
+class EncodedMessage:
+    """The output lines of one message, as encoded by a decode worker.
+
+    Attributes:
+        seq (int | None): The seq of the message, None if it has none or is
+            dropped, and must not advance the cursor.
+        type (str): The type of the message, empty for a skipped one.
+        lines (list[tuple[str, bytes]]): The (partition, line) pairs to write,
+            in order.
+        events (list[tuple[str, dict[str, Any]]]): The (partition, event) pairs
+            for the sink, if the events are collected.
+        dropped (tuple[str, str] | None): The type of the message and why it
+            is dropped, counted in the main process when it is written.
+    """
+
+    seq: Optional[int] = None
+    type: str = ""
+    lines: list[tuple[str, bytes]] = field(default_factory=list)
+    events: list[tuple[str, dict[str, Any]]] = field(default_factory=list)
+    dropped: Optional[tuple[str, str]] = None
+
+    # collects the lines of `parser.process_commit` instead of writing them
+    def partition_path(self, partition: str) -> str:
+        return partition
+
+    def write(self, partition: str, line: bytes) -> None:
+        self.lines.append((partition, line))
+
+    def write_event(self, partition: str, event: dict[str, Any]) -> None:
+        self.events.append((partition, event))
+
+
+def encode_message(
+    message: firehose_models.MessageFrame,
+    options: parser.ParseOptions = parser.DEFAULT_OPTIONS,
+    with_events: bool = False,
+) -> EncodedMessage:
+    """Process a message of any type and encode the lines of its events, without
+    writing them (see `parser.process_message`). This runs in the worker processes.
+
+    Parameters:
+        message (firehose_models.MessageFrame): The incoming message frame
+        options (ParseOptions): How the events are built and encoded.
+        with_events (bool): Also collect the events, for the sink.
+
+    Returns:
+        encoded (EncodedMessage): The seq and the lines of the message.
+    """
+    encoded = EncodedMessage(type=str(message.type))
+    encoded.seq, dropped = parser.process_message(
+        message, encoded, options, encoded if with_events else None
+    )
+    if dropped is not None:
+        encoded.dropped = (message.type, dropped)
+    return encoded
+
+
+def encode_chunk(
+    chunk: list[Union[firehose_models.MessageFrame, EncodedMessage]],
+    options: parser.ParseOptions = parser.DEFAULT_OPTIONS,
+    with_events: bool = False,
+) -> list[EncodedMessage]:
+    """Encode a chunk of messages in order; an error only drops its message.
+    Messages that are already encoded are passed through.
+
+    Parameters:
+        chunk (list[MessageFrame | EncodedMessage]): The messages to encode.
+        options (ParseOptions): How the events are built and encoded.
+        with_events (bool): Also collect the events, for the sink.
+
+    Returns:
+        encoded (list[EncodedMessage]): The encoded messages, in order.
+    """
+    encoded = []
+    for message in chunk:
+        if isinstance(message, EncodedMessage):
+            encoded.append(message)
+            continue
+        try:
+            encoded.append(encode_message(message, options, with_events))
+        except Exception as e:
+            logger.error(e)
+            encoded.append(EncodedMessage())
+    return encoded
+
+
+def _encode_chunk_with_timings(
+    chunk: list[Union[firehose_models.MessageFrame, EncodedMessage]],
+    options: parser.ParseOptions = parser.DEFAULT_OPTIONS,
+    with_events: bool = False,
+) -> tuple[list[EncodedMessage], metrics.HistogramState]:
+    """Encode a chunk of messages in a worker process, and take the stage
+    latencies observed meanwhile, to merge them in the main process.
+
+    Returns:
+        encoded (list[EncodedMessage]): The encoded messages, in order.
+        timings (HistogramState): The observations of the stage latencies.
+    """
+    encoded = encode_chunk(chunk, options, with_events)
+    return encoded, metrics.STAGE_SECONDS.pop_state()
+
+
+class DecodeWorkers:
+    """Parse, decode and serialize the messages in worker processes, and write
+    the results in arrival order.
+
+    The messages are sent to the workers in chunks. The futures of the chunks
+    are kept in a FIFO that acts as the reorder buffer: the results are only
+    written, and the cursor only advanced, once every earlier chunk has been
+    written, so that the partition files stay in seq order whatever worker
+    finishes first. When too many chunks are in flight, `submit` waits for the
+    oldest one, which holds back the receiver.
+
+    Parameters:
+        workers (int): Number of worker processes.
+        checkpoint (CheckpointManager): Tracks the cursor of processed messages.
+        writer (PartitionWriter): The writer of the hourly partitions.
+        chunk_size (int): Maximum number of messages sent to a worker at once.
+        chunk_interval_ms (int): Maximum milliseconds a message waits for its
+            chunk to fill.
+        max_in_flight (int | None): Maximum number of chunks submitted and not
+            yet written, by default `WORKERS_IN_FLIGHT_PER_WORKER` per worker.
+        options (ParseOptions): How the events are built and encoded.
+        sink (EventSink | None): Also receives the events, after their lines
+            are written.
+        clock (Callable[[], float]): Monotonic clock in seconds.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        checkpoint: CheckpointManager,
+        writer: PartitionWriter,
+        chunk_size: int = const.WORKERS_CHUNK_SIZE,
+        chunk_interval_ms: int = const.WORKERS_CHUNK_INTERVAL_MS,
+        max_in_flight: Optional[int] = None,
+        options: parser.ParseOptions = parser.DEFAULT_OPTIONS,
+        sink: Optional[parser.EventSink] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._checkpoint = checkpoint
+        self._writer = writer
+        self._sink = sink
+        self._chunk_size = max(1, chunk_size)
+        self._chunk_interval = max(0, chunk_interval_ms) / 1000
+        self._max_in_flight = max(
+            1, max_in_flight or workers * const.WORKERS_IN_FLIGHT_PER_WORKER
+        )
+        self._encode_chunk = partial(
+            _encode_chunk_with_timings, options=options, with_events=sink is not None
+        )
+        self._clock = clock
+
+        # a forked worker starts with the timings of the main process: drop
+        # them, so that only its own are sent back
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=metrics.STAGE_SECONDS.pop_state
+        )
+        self._chunk: list[Union[firehose_models.MessageFrame, EncodedMessage]] = []
+        self._chunk_started_at = clock()
+        self._in_flight: deque[
+            Future[tuple[list[EncodedMessage], metrics.HistogramState]]
+        ] = deque()
+
+    @property
+    def in_flight(self) -> int:
+        """The number of chunks submitted and not yet written."""
+        return len(self._in_flight)
+
+    def submit(self, message: firehose_models.MessageFrame) -> None:
+        """Queue a message for decoding, and write the results that are ready.
+
+        Parameters:
+            message (firehose_models.MessageFrame): The incoming message frame
+
+        Returns:
+            None
+        """
+        self._append(message)
+
+    def skip(self, seq: int) -> None:
+        """Queue a message that has nothing to write, so that the cursor is
+        advanced to its seq after the messages before it are written.
+
+        Parameters:
+            seq (int): The seq of the message.
+
+        Returns:
+            None
+        """
+        self._append(EncodedMessage(seq=seq))
+
+    def _append(
+        self, message: Union[firehose_models.MessageFrame, EncodedMessage]
+    ) -> None:
+        if not self._chunk:
+            self._chunk_started_at = self._clock()
+        self._chunk.append(message)
+        if (
+            len(self._chunk) >= self._chunk_size
+            or self._clock() - self._chunk_started_at >= self._chunk_interval
+        ):
+            self._submit_chunk()
+        self._write_ready(block=len(self._in_flight) >= self._max_in_flight)
+
+    def drain(self) -> None:
+        """Submit the pending messages and write all the results.
+
+        Returns:
+            None
+        """
+        self._submit_chunk()
+        while self._in_flight:
+            self._write_ready(block=True)
+
+    def close(self) -> None:
+        """Drain the pending messages and stop the worker processes.
+
+        Returns:
+            None
+        """
+        try:
+            self.drain()
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _submit_chunk(self) -> None:
+        if self._chunk:
+            self._in_flight.append(
+                self._executor.submit(self._encode_chunk, self._chunk)
+            )
+            self._chunk = []
+
+    def _write_ready(self, block: bool) -> None:
+        """Write the results of the oldest chunks that are done, in order.
+
+        Parameters:
+            block (bool): Wait for the oldest chunk if it is not done yet.
+
+        Returns:
+            None
+        """
+        while self._in_flight and (block or self._in_flight[0].done()):
+            future = self._in_flight.popleft()
+            block = False
+            try:
+                encoded, timings = future.result()
+            except Exception as e:
+                logger.error(f"Failed to decode chunk: {e}")
+                continue
+            metrics.STAGE_SECONDS.merge(timings)
+            for message in encoded:
+                self._write(message)
+
+    def _write(self, encoded: EncodedMessage) -> None:
+        """Write the lines of a message, hand its events to the sink, record
+        its seq as written and advance the cursor to it, or count it if it is
+        dropped. A message already written meanwhile, e.g. sent again after a
+        reconnect while the first one was decoded, is dropped as a duplicate.
+
+        Parameters:
+            encoded (EncodedMessage): The encoded message.
+
+        Returns:
+            None
+        """
+        if encoded.seq is not None and self._writer.is_written(encoded.seq):
+            metrics.DROPPED_MESSAGES.labels(encoded.type, parser.DUPLICATE).inc()
+            return
+        for partition, line in encoded.lines:
+            try:
+                self._writer.write(partition, line)
+            except Exception as e:
+                logger.bind(file=self._writer.partition_path(partition)).error(
+                    f"Failed to write to file: {e}"
+                )
+        for partition, event in encoded.events:
+            try:
+                self._sink.write_event(partition, event)  # type: ignore[union-attr]
+            except Exception as e:
+                logger.bind(commit_event=event).error(
+                    f"Failed to write event to sink: {e}"
+                )
+        if encoded.dropped is not None:
+            metrics.DROPPED_MESSAGES.labels(*encoded.dropped).inc()
+        if encoded.seq is not None:
+            self._writer.record_seq(encoded.seq)
+            self._checkpoint.advance(encoded.seq)
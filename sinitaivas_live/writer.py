@@ -0,0 +1,491 @@
+import glob
+import json
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Optional, Protocol
+
+import sinitaivas_live.constants as const
+import sinitaivas_live.metrics as metrics
+import utils.files_storage as fs
+from utils.compression import (
+    EXTENSIONS,
+    Compression,
+    MemberCompressor,
+    compression_of,
+    get_compressor,
+    truncate_to_complete,
+)
+from utils.logging import logger
+
+# suffix of a compressed partition file that is still being written
+PART_SUFFIX = ".part"
+
+# suffix of the sidecar index of a partition file
+INDEX_SUFFIX = ".idx"
+
+# shard of the events whose collection is missing or not a valid NSID
+OTHER_SHARD = "_other"
+
+_COLLECTION = re.compile(r"[A-Za-z0-9-]+(\.[A-Za-z0-9-]+)*")
+
+
+class LineWriter(Protocol):
+    """Anything the parser can write the lines of a partition to."""
+
+    def partition_path(self, partition: str) -> str: ...
+
+    def write(self, partition: str, line: bytes) -> None: ...
+
+
+def shard_partition(partition: str, collection: Optional[str]) -> str:
+    """Get the partition of the shard of a collection in an hourly partition,
+    as understood by `PartitionWriter`.
+
+    Parameters:
+        partition (str): The date and hour of the partition (%Y-%m-%dT%H).
+        collection (str | None): The collection of the event; anything that
+            is not a valid NSID goes to the `_other` shard.
+
+    Returns:
+        partition (str): The partition of the shard, `<partition>/<collection>`.
+    """
+    if not isinstance(collection, str) or not _COLLECTION.fullmatch(collection):
+        collection = OTHER_SHARD
+    return f"{partition}/{collection}"
+
+
+def event_partition(partition: str, kind: str) -> str:
+    """Get the partition of the events of a kind of message other than
+    #commit (e.g. `identity` for #identity) in an hourly partition, kept
+    apart from the commit events.
+
+    Parameters:
+        partition (str): The date and hour of the partition (%Y-%m-%dT%H).
+        kind (str): The kind of message, its type without the `#`.
+
+    Returns:
+        partition (str): The partition of the events, `<partition>/_<kind>`.
+    """
+    return f"{partition}/_{kind}"
+
+
+def index_path(path: str) -> str:
+    """Get the path of the sidecar index of a partition file.
+
+    Parameters:
+        path (str): The path of the partition file, in progress or not.
+
+    Returns:
+        path (str): The path of the index, `<partition file>.idx`.
+    """
+    return path.removesuffix(PART_SUFFIX) + INDEX_SUFFIX
+
+
+@dataclass
+class _OpenFile:
+    """A partition file open for appending, with its compressor, if any, and
+    the index entries of the lines written since it was opened.
+
+    Attributes:
+        path (str): The path of the file.
+        file (BinaryIO): The buffered handle.
+        compressor (MemberCompressor | None): Compresses the lines.
+        offset (int): The size of the file, with the buffered bytes.
+        member_size (int): Uncompressed bytes in the current member.
+        since_index (float): Uncompressed bytes since the last index entry.
+        index (list[tuple[int, str, int]]): The (seq, commit_time, offset)
+            entries not yet written to the index file.
+    """
+
+    path: str
+    file: BinaryIO
+    compressor: Optional[MemberCompressor]
+    offset: int = 0
+    member_size: int = 0
+    since_index: float = math.inf
+    index: list[tuple[int, str, int]] = field(default_factory=list)
+
+    def write(self, line: bytes, index_every: int) -> None:
+        """Write a line, after an index entry for it every `index_every`
+        bytes. A compressed line is only indexed at the start of a member,
+        which is cut early if needed, so that it can be decoded from there.
+        """
+        if index_every:
+            if self.compressor and self.member_size >= index_every:
+                self.end_member()
+            if self.since_index >= index_every and not self.member_size:
+                self._add_index_entry(line)
+        self._write(self.compressor.compress(line) if self.compressor else line)
+        if self.compressor:
+            self.member_size += len(line)
+        self.since_index += len(line)
+
+    def end_member(self) -> None:
+        if self.compressor:
+            self._write(self.compressor.end_member())
+            self.member_size = 0
+
+    def flush(self) -> None:
+        if self.compressor:
+            self._write(self.compressor.flush())
+        self.file.flush()
+
+    def sync(self) -> None:
+        self.end_member()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def write_index(self) -> None:
+        """Append the pending index entries to the index file."""
+        if not self.index:
+            return
+        with open(index_path(self.path), "a") as f:
+            f.writelines(
+                f"{seq}\t{time}\t{offset}\n" for seq, time, offset in self.index
+            )
+        self.index = []
+
+    def _write(self, data: bytes) -> None:
+        if data:
+            self.file.write(data)
+            self.offset += len(data)
+            metrics.BYTES_WRITTEN.inc(len(data))
+
+    def _add_index_entry(self, line: bytes) -> None:
+        try:
+            event = json.loads(line)
+            seq = int(event["seq"])
+            commit_time = str(event.get("commit_time") or "")
+        except (ValueError, KeyError, TypeError):
+            return
+        self.index.append((seq, commit_time, self.offset))
+        self.since_index = 0
+
+
+class PartitionWriter:
+    """Append lines to the hourly partition files of the firehose stream,
+    `<root>/YYYY-MM-DD/YYYY-MM-DDTHH.ndjson`, keeping a buffered handle open
+    per partition instead of reopening the file for every event.
+
+    A partition can also be the shard of a collection in an hour (see
+    `shard_partition`), written to `<root>/YYYY-MM-DD/<collection>/YYYY-MM-DDTHH.ndjson`.
+    At most `max_open_files` handles are kept open: the least recently written
+    one is synced and closed to open another. When a line of the next hour
+    arrives, all the files of the hour are closed, which happens once at each
+    hour boundary; the directory of a partition is created when it is opened.
+    Buffered lines are handed to the OS every `flush_interval_ms`
+    milliseconds, and `sync()` makes them durable.
+
+    With `compression`, the lines are compressed as they are written, to
+    `<partition>.ndjson.gz.part` (or `.zst.part`) while the hour is in
+    progress. Each `sync()` ends a gzip member (zstd frame), so the file is a
+    valid archive up to the last sync; when the hour is over or the writer
+    closed, the file is renamed to `<partition>.ndjson.gz` (`.zst`).
+    After a crash, `recover()` cuts the `.part` files back to their last
+    complete member and finalizes them, and the uncompressed files back to
+    their last complete line.
+
+    Every `index_every_bytes` bytes of lines, the seq, `commit_time` and
+    byte offset of a line are recorded in the sidecar index of the file,
+    `<partition file>.idx` (one `seq<TAB>commit_time<TAB>offset` line per
+    entry), written when the file is closed. In a compressed file, the
+    entries point to the start of a member, and a member is ended after
+    `index_every_bytes` bytes if no sync did it before, so that the file can
+    be decoded from any entry (see `sinitaivas_live.reader`).
+
+    The writer also keeps the highest seq whose events are written (see
+    `record_seq`), so that a message the relay sends again, e.g. after a
+    reconnect from a cursor checkpointed before the last events written, can
+    be dropped. It is only seeded from a durable cursor: after a crash, the
+    events on disk past the checkpoint may not include every event of their
+    message, whose other files, or other members, were not synced.
+
+    Parameters:
+        root (str | None): The output directory, by default `firehose_stream`
+            under the current working directory.
+        buffer_size (int): Size in bytes of the write buffer of each file.
+        flush_interval_ms (int): Maximum milliseconds a line stays buffered.
+        compression (Compression): "none", "gzip" or "zstd".
+        compression_level (int | None): The compression level, by default
+            the one of `utils.compression.DEFAULT_LEVELS`.
+        max_open_files (int): Maximum number of files open at once.
+        index_every_bytes (int): Bytes of lines between two index entries,
+            0 to write no index.
+        clock (Callable[[], float]): Monotonic clock in seconds.
+    """
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        buffer_size: int = const.WRITER_BUFFER_SIZE,
+        flush_interval_ms: int = const.WRITER_FLUSH_INTERVAL_MS,
+        compression: Compression = "none",
+        compression_level: Optional[int] = None,
+        max_open_files: int = const.WRITER_MAX_OPEN_FILES,
+        index_every_bytes: int = const.WRITER_INDEX_EVERY_BYTES,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._root = root or f"{fs.current_dir()}/firehose_stream"
+        self._buffer_size = buffer_size
+        self._extension = EXTENSIONS[compression]
+        self._compression = compression
+        self._compression_level = compression_level
+        # fails early if the compression is not available
+        self._compressed = get_compressor(compression, compression_level) is not None
+        self._max_open_files = max(1, max_open_files)
+        self._index_every = max(0, index_every_bytes)
+        self._flush_interval = max(0, flush_interval_ms) / 1000
+        self._clock = clock
+
+        # the date and hour of the open files, the files by partition from
+        # the least to the most recently written, and the paths opened in
+        # the hour, which are finalized when it is over
+        self._hour: Optional[str] = None
+        self._files: OrderedDict[str, _OpenFile] = OrderedDict()
+        self._opened: set[str] = set()
+        self._last_flush_at = clock()
+        self._last_seq: Optional[int] = None
+
+    @property
+    def root(self) -> str:
+        """The output directory."""
+        return self._root
+
+    @property
+    def last_seq(self) -> Optional[int]:
+        """The highest seq whose events are written."""
+        return self._last_seq
+
+    @property
+    def current_path(self) -> Optional[str]:
+        """The path of the file written last, if any is open."""
+        return next(reversed(self._files.values())).path if self._files else None
+
+    def partition_path(self, partition: str) -> str:
+        """Get the path of the file of an hourly partition.
+
+        Parameters:
+            partition (str): The date and hour of the partition (%Y-%m-%dT%H),
+                or a shard of it (`<partition>/<collection>`).
+
+        Returns:
+            path (str): The path of the partition file, once finalized.
+        """
+        hour, _, collection = partition.partition("/")
+        directory = f"{self._root}/{hour[:10]}"
+        if collection:
+            directory = f"{directory}/{collection}"
+        return f"{directory}/{hour}.ndjson{self._extension}"
+
+    def _open_path(self, partition: str) -> str:
+        path = self.partition_path(partition)
+        return path + PART_SUFFIX if self._compressed else path
+
+    def write(self, partition: str, line: bytes) -> None:
+        """Append one line to the file of the given partition, opening it
+        first if needed.
+
+        Parameters:
+            partition (str): The date and hour of the partition (%Y-%m-%dT%H),
+                or a shard of it.
+            line (bytes): The line to write, including the trailing newline.
+
+        Returns:
+            None
+        """
+        started_at = time.perf_counter()
+        open_file = self._files.get(partition)
+        if open_file is None:
+            open_file = self._open(partition)
+        elif len(self._files) > 1:
+            self._files.move_to_end(partition)
+        open_file.write(line, self._index_every)
+        if self._clock() - self._last_flush_at >= self._flush_interval:
+            self.flush()
+        metrics.WRITE_SECONDS.observe(time.perf_counter() - started_at)
+
+    def record_seq(self, seq: int) -> None:
+        """Record that all the events of the message `seq` are written.
+
+        Parameters:
+            seq (int): The seq of the message.
+
+        Returns:
+            None
+        """
+        if self._last_seq is None or seq > self._last_seq:
+            self._last_seq = seq
+
+    def is_written(self, seq: int) -> bool:
+        """Whether the events of a message are already written: its seq is at
+        or below the highest one recorded.
+
+        Parameters:
+            seq (int): The seq of the message.
+
+        Returns:
+            written (bool): True if the message is to be dropped.
+        """
+        return self._last_seq is not None and seq <= self._last_seq
+
+    def _open(self, partition: str) -> _OpenFile:
+        """Open the file of `partition`, after closing the files of the
+        previous hour, or the least recently written one if too many are open.
+
+        Parameters:
+            partition (str): The partition to open.
+
+        Returns:
+            open_file (_OpenFile): The open file.
+        """
+        hour = partition.partition("/")[0]
+        if hour != self._hour:
+            self.close()
+            self._hour = hour
+        elif len(self._files) >= self._max_open_files:
+            _, evicted = self._files.popitem(last=False)
+            self._close_file(evicted)
+
+        path = self._open_path(partition)
+        reopened = path in self._opened
+        fs.create_dir_if_not_exists(os.path.dirname(path))
+        if not reopened:
+            self._prepare(partition)
+        file = open(path, "ab", buffering=self._buffer_size)
+        open_file = _OpenFile(
+            path,
+            file,
+            get_compressor(self._compression, self._compression_level),
+            offset=file.tell(),
+        )
+        self._files[partition] = open_file
+        if not reopened:
+            self._opened.add(path)
+            logger.bind(file=path).info("Writing to new partition")
+        return open_file
+
+    def flush(self) -> None:
+        """Hand the buffered lines to the OS.
+
+        Returns:
+            None
+        """
+        self._last_flush_at = self._clock()
+        for open_file in self._files.values():
+            open_file.flush()
+
+    def sync(self) -> None:
+        """Flush the buffered lines and fsync the open partition files, so
+        that everything written so far is on stable storage. A compressed
+        file is a valid archive up to this point.
+
+        Returns:
+            None
+        """
+        self._last_flush_at = self._clock()
+        for open_file in self._files.values():
+            open_file.sync()
+
+    def close(self) -> None:
+        """Sync and close the open partition files, and finalize the
+        compressed files of the hour.
+
+        Returns:
+            None
+        """
+        try:
+            while self._files:
+                _, open_file = self._files.popitem(last=False)
+                self._close_file(open_file)
+        finally:
+            if self._compressed:
+                for path in sorted(self._opened):
+                    try:
+                        self._finalize(path)
+                    except Exception as e:
+                        logger.bind(file=path).error(
+                            f"Failed to finalize partition: {e}"
+                        )
+            self._opened = set()
+            self._hour = None
+
+    @staticmethod
+    def _close_file(open_file: _OpenFile) -> None:
+        try:
+            open_file.sync()
+        finally:
+            open_file.file.close()
+        # only once the lines it points to are on disk
+        try:
+            open_file.write_index()
+        except Exception as e:
+            logger.bind(file=open_file.path).error(f"Failed to write index: {e}")
+
+    def recover(self) -> None:
+        """Repair the partitions left in progress by a previous run: each
+        compressed `.part` file is cut back to its last complete member and
+        renamed to its final name, and each uncompressed file is cut back to
+        its last complete line. The events dropped this way were not
+        checkpointed, so a resumed stream receives them again.
+
+        Returns:
+            None
+        """
+        paths = []
+        for pattern in (f"*.ndjson.*{PART_SUFFIX}", "*.ndjson"):
+            paths += glob.glob(f"{self._root}/*/{pattern}")
+            paths += glob.glob(f"{self._root}/*/*/{pattern}")
+        for path in sorted(paths):
+            compression = compression_of(path)
+            try:
+                dropped = truncate_to_complete(path, compression)
+                if compression != "none":
+                    self._finalize(path)
+            except Exception as e:
+                logger.bind(file=path).error(f"Failed to recover partition: {e}")
+                continue
+            if compression != "none" or dropped:
+                logger.bind(file=path, dropped_bytes=dropped).warning(
+                    "Recovered partition left in progress"
+                )
+
+    def _prepare(self, partition: str) -> None:
+        """Prepare the file of a partition opened for the first time for
+        appending. A compressed partition already finalized (e.g. before a
+        restart in the same hour) is renamed back to its `.part` file, and
+        an incomplete member at the end of a file left in progress is cut
+        off; an uncompressed file is cut back to its last complete line, so
+        that the next line is not appended to a line cut by a crash.
+
+        Parameters:
+            partition (str): The partition.
+
+        Returns:
+            None
+        """
+        path = self._open_path(partition)
+        final_path = self.partition_path(partition)
+        if self._compressed and not os.path.exists(path):
+            if os.path.exists(final_path):
+                os.replace(final_path, path)
+        elif os.path.exists(path):
+            truncate_to_complete(path, self._compression)
+
+    @staticmethod
+    def _finalize(path: str) -> None:
+        """Rename a `.part` file to its final name, durably.
+
+        Parameters:
+            path (str): The path of the `.part` file, already fsynced.
+
+        Returns:
+            None
+        """
+        final_path = path.removesuffix(PART_SUFFIX)
+        os.replace(path, final_path)
+        fs.fsync_file(os.path.dirname(final_path))
+        logger.bind(file=final_path).info("Finalized partition")
@@ -0,0 +1,123 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+from atproto import models
+
+from sinitaivas_live.capture import (
+    CaptureWriter,
+    ReplayClient,
+    encode_message_frame,
+    read_capture,
+)
+from sinitaivas_live.streamer import MessageHandler, start
+from sinitaivas_live.writer import PartitionWriter
+from tests.support.synthetic import decode_frame, encode_frame, make_commit_frames
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _capture(path, frames):
+    capture = CaptureWriter(str(path))
+    handled = []
+    handler = capture.wrap(handled.append)
+    for frame in frames:
+        handler(decode_frame(frame))
+    capture.close()
+    return handled
+
+
+def test_encode_message_frame_gives_back_the_frame():
+    for frame in make_commit_frames(5, n_ops=3):
+        assert encode_message_frame(decode_frame(frame)) == frame
+
+
+def test_capture_appends_frames_with_their_seq(tmp_path):
+    path = tmp_path / "firehose.cap"
+    frames = make_commit_frames(3, first_seq=10)
+    identity = encode_frame("#identity", {"did": "did:plc:x", "time": "t"})
+
+    handled = _capture(path, frames[:2])
+    _capture(path, [frames[2], identity])
+
+    assert len(handled) == 2
+    captured = list(read_capture(str(path)))
+    assert [frame.seq for frame in captured] == [10, 11, 12, None]
+    assert [frame.frame for frame in captured] == [*frames, identity]
+    times = [frame.received_at_ns for frame in captured]
+    assert times == sorted(times)
+
+
+def test_incomplete_frame_is_ignored_and_overwritten(tmp_path):
+    path = tmp_path / "firehose.cap"
+    frames = make_commit_frames(3)
+    _capture(path, frames[:2])
+    with open(path, "r+b") as f:
+        f.truncate(path.stat().st_size - 5)
+
+    assert [frame.seq for frame in read_capture(str(path))] == [1]
+    _capture(path, frames[2:])
+    assert [frame.seq for frame in read_capture(str(path))] == [1, 3]
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("not a capture")
+    with pytest.raises(ValueError):
+        CaptureWriter(str(path))
+    with pytest.raises(ValueError):
+        list(read_capture(str(path)))
+
+
+def test_replay_skips_frames_up_to_the_cursor(tmp_path):
+    path = tmp_path / "firehose.cap"
+    _capture(path, make_commit_frames(5))
+    client = ReplayClient(str(path))
+    client.update_params(models.ComAtprotoSyncSubscribeRepos.Params(cursor=2))
+    messages = []
+
+    client.start(messages.append)
+
+    assert [message.body["seq"] for message in messages] == [3, 4, 5]
+
+
+def test_replay_follows_the_recorded_rate(tmp_path):
+    path = tmp_path / "firehose.cap"
+    # frames received 0, 1 and 3 seconds apart
+    received_at = iter([0, 1, 3])
+    with patch(
+        "sinitaivas_live.capture.time.time_ns",
+        side_effect=lambda: next(received_at) * 10**9,
+    ):
+        _capture(path, make_commit_frames(3))
+    clock = FakeClock()
+    sent_at = []
+    client = ReplayClient(str(path), speed=2.0, clock=clock, sleep=clock.sleep)
+
+    client.start(lambda message: sent_at.append(clock.now))
+
+    assert sent_at == [0.0, 0.5, 1.5]
+
+
+def test_replay_goes_through_the_message_handler(tmp_path):
+    path = tmp_path / "firehose.cap"
+    _capture(path, make_commit_frames(4, n_ops=2))
+    checkpoint = MagicMock()
+    writer = PartitionWriter(str(tmp_path / "out"))
+
+    start(ReplayClient(str(path)), MessageHandler(checkpoint, writer))
+    writer.close()
+
+    [partition] = (tmp_path / "out").glob("*/*.ndjson")
+    events = [json.loads(line) for line in partition.read_text().splitlines()]
+    assert [event["seq"] for event in events] == [1, 1, 2, 2, 3, 3, 4, 4]
+    assert [call.args[0] for call in checkpoint.advance.call_args_list] == [1, 2, 3, 4]
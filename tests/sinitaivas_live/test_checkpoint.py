@@ -0,0 +1,125 @@
+import json
+from unittest.mock import MagicMock, patch
+
+from sinitaivas_live.checkpoint import CheckpointManager
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_advance_does_not_write_before_checkpoint_is_due(tmp_path):
+    path = tmp_path / "cursors.json"
+    sync_output = MagicMock()
+    checkpoint = CheckpointManager(
+        None, sync_output, str(path), flush_every=3, clock=FakeClock()
+    )
+    checkpoint.advance(1)
+    checkpoint.advance(2)
+    assert not path.exists()
+    sync_output.assert_not_called()
+    assert checkpoint.pending_seq == 2
+    assert checkpoint.committed_seq is None
+
+
+def test_advance_flushes_every_n_messages(tmp_path):
+    path = tmp_path / "cursors.json"
+    sync_output = MagicMock()
+    checkpoint = CheckpointManager(
+        None, sync_output, str(path), flush_every=3, clock=FakeClock()
+    )
+    for seq in (10, 11, 12):
+        checkpoint.advance(seq)
+    sync_output.assert_called_once()
+    assert _read(path)["streamer"]["cursor"] == 12
+    assert checkpoint.committed_seq == 12
+
+
+def test_advance_flushes_after_interval(tmp_path):
+    path = tmp_path / "cursors.json"
+    clock = FakeClock()
+    checkpoint = CheckpointManager(
+        None,
+        MagicMock(),
+        str(path),
+        flush_every=1000,
+        flush_interval_ms=500,
+        clock=clock,
+    )
+    checkpoint.advance(1)
+    assert not path.exists()
+    clock.now = 0.6
+    checkpoint.advance(2)
+    assert _read(path)["streamer"]["cursor"] == 2
+
+
+def test_flush_keeps_other_keys_and_updates_client(tmp_path):
+    path = tmp_path / "cursors.json"
+    path.write_text(json.dumps({"other": {"cursor": 5}}))
+    client = MagicMock()
+    checkpoint = CheckpointManager(client, MagicMock(), str(path), clock=FakeClock())
+    checkpoint.advance(42)
+    checkpoint.flush()
+    content = _read(path)
+    assert content["other"] == {"cursor": 5}
+    assert content["streamer"]["cursor"] == 42
+    assert content["streamer"]["updated_at"].endswith("Z")
+    args, _ = client.update_params.call_args
+    assert args[0].cursor == 42
+    # no leftover temporary files
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["cursors.json"]
+
+
+def test_committed_seq_starts_from_the_cursor_file(tmp_path):
+    path = tmp_path / "cursors.json"
+    path.write_text(json.dumps({"streamer": {"cursor": 41}}))
+    sync_output = MagicMock()
+    checkpoint = CheckpointManager(None, sync_output, str(path), clock=FakeClock())
+    assert checkpoint.committed_seq == 41
+    assert checkpoint.pending_seq is None
+    checkpoint.flush()
+    sync_output.assert_not_called()
+
+
+def test_flush_without_new_seq_is_a_no_op(tmp_path):
+    path = tmp_path / "cursors.json"
+    sync_output = MagicMock()
+    checkpoint = CheckpointManager(None, sync_output, str(path), clock=FakeClock())
+    checkpoint.flush()
+    checkpoint.advance(1)
+    checkpoint.flush()
+    checkpoint.flush()
+    sync_output.assert_called_once()
+
+
+@patch("sinitaivas_live.checkpoint.logger")
+def test_flush_does_not_record_seq_if_sync_fails(mock_logger, tmp_path):
+    path = tmp_path / "cursors.json"
+    sync_output = MagicMock(side_effect=OSError("disk is gone"))
+    checkpoint = CheckpointManager(None, sync_output, str(path), clock=FakeClock())
+    checkpoint.advance(7)
+    checkpoint.flush()
+    assert not path.exists()
+    assert checkpoint.committed_seq is None
+    assert checkpoint.pending_seq == 7
+    mock_logger.bind.return_value.error.assert_called_once()
+
+
+@patch("sinitaivas_live.checkpoint.logger")
+def test_unreadable_cursor_file_starts_empty(mock_logger, tmp_path):
+    path = tmp_path / "cursors.json"
+    path.write_text("{not json")
+    checkpoint = CheckpointManager(None, MagicMock(), str(path), clock=FakeClock())
+    checkpoint.advance(3)
+    checkpoint.flush()
+    assert _read(path) == {"streamer": _read(path)["streamer"]}
+    mock_logger.bind.return_value.error.assert_called_once()
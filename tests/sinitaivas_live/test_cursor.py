@@ -1,11 +1,16 @@
+import json
 from unittest.mock import patch, MagicMock
 
+import pytest
+
 from sinitaivas_live.cursor import (
+    _iter_lines_backwards,
+    _iter_hourly_partitions,
     reset_cursor,
-    update_cursor,
     read_cursor,
     read_last_seq_from_file,
 )
+from sinitaivas_live.writer import PartitionWriter
 
 
 @patch("sinitaivas_live.cursor.read_cursor")
@@ -19,16 +24,6 @@ def test_reset_cursor(mock_logger, mock_read_cursor):
     mock_logger.error.assert_not_called()
 
 
-@patch("sinitaivas_live.cursor.read_cursor")
-@patch("sinitaivas_live.cursor.logger")
-def test_update_cursor(mock_logger, mock_read_cursor):
-    client = MagicMock()
-    mock_read_cursor.return_value = {}
-    update_cursor(client, 123)
-    client.update_params.assert_called_once()
-    mock_logger.error.assert_not_called()
-
-
 @patch("sinitaivas_live.cursor.json.load")
 @patch("sinitaivas_live.cursor.logger")
 def test_read_cursor(mock_logger, mock_json_load):
@@ -58,52 +53,113 @@ def test_read_cursor_file_error(mock_json_dump, mock_open):
     mock_json_dump.assert_not_called()
 
 
-@patch("sinitaivas_live.cursor.open")
-@patch("sinitaivas_live.cursor.json.dump")
-def test_update_cursor_file_error(mock_json_dump, mock_open):
-    """Test updating cursor file when an error occurs."""
-    mock_open.side_effect = Exception("Error writing file")
-    client = MagicMock()
-    update_cursor(client, 123)
-    client.update_params.assert_called_once()
-    mock_json_dump.assert_not_called()
-
-
-@patch("sinitaivas_live.cursor.open")
-@patch("sinitaivas_live.cursor.deque")
-@patch("sinitaivas_live.cursor._get_json_files")
-def test_read_last_seq_from_file(mock_get_json_files, mock_deque, mock_open):
-    """Test reading the last sequence from the latest ndjson file."""
-    mock_get_json_files.return_value = ["path/to/last_file.ndjson"]
-    mock_deque.return_value = ["""{"seq": 456}"""]
-    last_seq = read_last_seq_from_file()
-    assert last_seq == 456
-    mock_open.assert_called_once_with("path/to/last_file.ndjson", "r")
+def _write_partition(root, partition, lines, compression="none"):
+    writer = PartitionWriter(str(root), compression=compression)
+    for line in lines:
+        writer.write(partition, line)
+    writer.close()
+    return writer.partition_path(partition)
+
+
+def _events(*seqs):
+    return [json.dumps({"seq": seq, "text": "x" * 50}).encode() + b"\n" for seq in seqs]
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+def test_read_last_seq_from_file(tmp_path, compression):
+    """Test reading the last sequence from the latest partition file."""
+    _write_partition(tmp_path, "2025-06-01T09", _events(1, 2), compression)
+    _write_partition(tmp_path, "2025-06-01T10", _events(3, 4), compression)
+    assert read_last_seq_from_file(str(tmp_path)) == 4
+
+
+def test_read_last_seq_from_file_reads_backwards_in_blocks(tmp_path):
+    path = _write_partition(tmp_path, "2025-06-01T10", _events(*range(1, 500)))
+    with open(path, "rb") as file:
+        lines = list(_iter_lines_backwards(file, block_size=7))
+    assert [json.loads(line)["seq"] for line in lines] == list(range(499, 0, -1))
+
+
+def test_read_last_seq_from_file_skips_partial_line(tmp_path):
+    path = _write_partition(tmp_path, "2025-06-01T10", _events(1, 2))
+    with open(path, "ab") as file:
+        file.write(b'{"seq": 3, "te')
+    assert read_last_seq_from_file(str(tmp_path)) == 2
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_read_last_seq_from_file_skips_unfinished_member(tmp_path, compression):
+    writer = PartitionWriter(
+        str(tmp_path), flush_interval_ms=0, compression=compression
+    )
+    for seq in range(1, 200):
+        writer.write("2025-06-01T10", _events(seq)[0])
+        if seq % 50 == 0:
+            writer.sync()
+    # the process dies with the last member unfinished
+    writer.flush()
+    assert writer.current_path.endswith(".part")
+    assert read_last_seq_from_file(str(tmp_path)) == 150
+
+
+def test_read_last_seq_from_file_uses_previous_partition_if_empty(tmp_path):
+    _write_partition(tmp_path, "2025-06-01T23", _events(1, 2), "gzip")
+    (tmp_path / "2025-06-02").mkdir()
+    (tmp_path / "2025-06-02/2025-06-02T00.ndjson.gz.part").touch()
+    assert read_last_seq_from_file(str(tmp_path)) == 2
+
+
+def test_iter_hourly_partitions_newest_first(tmp_path):
+    for name in (
+        "2025-06-01/2025-06-01T22.ndjson.gz",
+        "2025-06-01/2025-06-01T23.ndjson.gz",
+        "2025-06-02/2025-06-02T00.ndjson",
+        "2025-06-02/app.bsky.feed.like/2025-06-02T00.ndjson.gz.part",
+        "2025-06-02/app.bsky.feed.post/2025-06-02T00.ndjson.gz.part",
+        "2025-06-02/app.bsky.feed.post/2025-06-02T01.ndjson.gz.part",
+        "2025-06-02/notes.txt",
+    ):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).touch()
+    (tmp_path / "backup").mkdir()
+
+    hours = [
+        [path[len(str(tmp_path)) + 1 :] for path in paths]
+        for paths in _iter_hourly_partitions(str(tmp_path))
+    ]
+    assert hours == [
+        ["2025-06-02/app.bsky.feed.post/2025-06-02T01.ndjson.gz.part"],
+        [
+            "2025-06-02/2025-06-02T00.ndjson",
+            "2025-06-02/app.bsky.feed.like/2025-06-02T00.ndjson.gz.part",
+            "2025-06-02/app.bsky.feed.post/2025-06-02T00.ndjson.gz.part",
+        ],
+        ["2025-06-01/2025-06-01T23.ndjson.gz"],
+        ["2025-06-01/2025-06-01T22.ndjson.gz"],
+    ]
+
+
+def test_read_last_seq_from_file_takes_the_max_of_the_shards(tmp_path):
+    writer = PartitionWriter(str(tmp_path), compression="gzip")
+    writer.write("2025-06-01T10/app.bsky.feed.post", _events(1)[0])
+    writer.write("2025-06-01T10/app.bsky.feed.like", _events(2)[0])
+    writer.write("2025-06-01T10/app.bsky.feed.post", _events(3)[0])
+    writer.write("2025-06-01T10/app.bsky.graph.follow", _events(4)[0])
+    writer.write("2025-06-01T10/app.bsky.feed.like", _events(5)[0])
+    writer.close()
+    assert read_last_seq_from_file(str(tmp_path)) == 5
 
 
 @patch("sinitaivas_live.cursor.open")
-@patch("sinitaivas_live.cursor._get_json_files")
-def test_read_last_seq_from_file_not_found(mock_get_json_files, mock_open):
-    """Test reading last sequence when the file does not exist."""
-    mock_get_json_files.return_value = ["non_existent_file.ndjson"]
-    mock_open.side_effect = FileNotFoundError
-    last_seq = read_last_seq_from_file()
-    assert last_seq == 0
-
-
-@patch("sinitaivas_live.cursor.open")
-@patch("sinitaivas_live.cursor._get_json_files")
-def test_read_last_seq_from_file_error(mock_get_json_files, mock_open):
+def test_read_last_seq_from_file_error(mock_open, tmp_path):
     """Test reading last sequence when an error occurs."""
-    mock_get_json_files.return_value = ["path/to/last_file.ndjson"]
+    _write_partition(tmp_path, "2025-06-01T10", _events(1))
     mock_open.side_effect = Exception("Error reading file")
-    last_seq = read_last_seq_from_file()
+    last_seq = read_last_seq_from_file(str(tmp_path))
     assert last_seq == 0
 
 
-@patch("sinitaivas_live.cursor._get_json_files")
-def test_read_last_seq_from_file_no_files(mock_get_json_files):
+def test_read_last_seq_from_file_no_files(tmp_path):
     """Test reading last sequence when no ndjson files are found."""
-    mock_get_json_files.return_value = []
-    last_seq = read_last_seq_from_file()
-    assert last_seq == 0
+    assert read_last_seq_from_file(str(tmp_path)) == 0
+    assert read_last_seq_from_file(str(tmp_path / "missing")) == 0
@@ -0,0 +1,283 @@
+import collections
+import functools
+import glob
+import gzip
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from atproto import parse_subscribe_repos_message
+
+import sinitaivas_live.constants as const
+import sinitaivas_live.metrics as metrics
+import tests
+from sinitaivas_live.checkpoint import CheckpointManager
+from sinitaivas_live.parser import ParseOptions
+from sinitaivas_live.reader import seek
+from sinitaivas_live.settings import StreamerSettings
+from sinitaivas_live.streamer import (
+    MessageHandler,
+    get_fresh_client,
+    resume_streamer,
+    streamer_main,
+)
+from sinitaivas_live.writer import PartitionWriter
+from tests.support.fake_relay import FakeRelay
+from tests.support.synthetic import decode_frame, encode_frame, make_commit_body
+
+
+def _collect_seqs(client, count):
+    """Run the client until it received `count` commits, return their seqs."""
+    seqs = []
+
+    def on_message(message):
+        seqs.append(parse_subscribe_repos_message(message).seq)
+        if len(seqs) == count:
+            client.stop()
+
+    client.start(on_message)
+    return seqs
+
+
+def test_client_receives_consecutive_commits_from_relay():
+    with FakeRelay(first_seq=100) as relay:
+        client = get_fresh_client(base_uri=relay.uri)
+        seqs = _collect_seqs(client, 50)
+
+    assert seqs == list(range(100, 150))
+    assert relay.cursors == [None]
+
+
+def test_relay_frames_are_the_same_for_a_seq():
+    relay = FakeRelay(seed=3)
+    assert relay.frame(7) == relay.frame(7)
+    assert relay.frame(7) != relay.frame(8)
+    assert relay.frame(7) != FakeRelay(seed=4).frame(7)
+
+
+@patch("sinitaivas_live.streamer.cursor.read_cursor")
+def test_resume_streamer_continues_after_cursor(mock_read_cursor):
+    mock_read_cursor.return_value = {"streamer": {"cursor": 41}}
+    with FakeRelay() as relay:
+        client = resume_streamer(base_uri=relay.uri)
+        seqs = _collect_seqs(client, 5)
+
+    assert seqs == [42, 43, 44, 45, 46]
+    assert relay.cursors == [41]
+
+
+def test_client_reconnects_from_checkpoint_after_drop(tmp_path):
+    with FakeRelay(drop_after=40) as relay:
+        client = get_fresh_client(base_uri=relay.uri)
+        checkpoint = CheckpointManager(
+            client, lambda: None, path=str(tmp_path / "cursors.json"), flush_every=1
+        )
+        seqs = []
+
+        def on_message(message):
+            seq = parse_subscribe_repos_message(message).seq
+            seqs.append(seq)
+            checkpoint.advance(seq)
+            if len(seqs) == 100:
+                client.stop()
+
+        with patch.object(client, "_get_reconnection_delay", return_value=0):
+            client.start(on_message)
+
+    # no gap and no duplicate across the dropped connections
+    assert seqs == list(range(1, 101))
+    assert relay.cursors == [None, 40, 80]
+
+
+def _run_streamer(mode, cursors_file, until_seq, settings):
+    """Run `streamer_main` until the cursor reaches `until_seq`, then stop it
+    like systemd does."""
+    metrics.CURSOR_SEQ.set(0)
+
+    def stop_streamer():
+        while metrics.CURSOR_SEQ.labels().value < until_seq:
+            time.sleep(0.01)
+        # the supervisor would reconnect after the relay closes the connection
+        signal.raise_signal(signal.SIGTERM)
+
+    stopper = threading.Thread(target=stop_streamer)
+    stopper.start()
+    with patch(
+        "sinitaivas_live.streamer.CheckpointManager",
+        functools.partial(CheckpointManager, path=cursors_file),
+    ):
+        streamer_main(mode, settings)
+    stopper.join()
+
+
+@pytest.mark.parametrize(
+    "engine, spill_memory_bytes", [("sync", 0), ("sync", 16 * 1024), ("async", 0)]
+)
+def test_streamer_main_writes_relay_stream(
+    tmp_path, monkeypatch, engine, spill_memory_bytes
+):
+    monkeypatch.chdir(tmp_path)
+    cursors_file = str(tmp_path / "cursors.json")
+    monkeypatch.setattr(const, "PATH_TO_CURSORS_FILE", cursors_file)
+    with FakeRelay(rate=2000) as relay:
+        _run_streamer(
+            "fresh",
+            cursors_file,
+            200,
+            StreamerSettings(
+                relay_uri=relay.uri,
+                engine=engine,
+                spill_memory_bytes=spill_memory_bytes,
+            ),
+        )
+
+    seqs = sorted(
+        {
+            json.loads(line)["seq"]
+            for path in tmp_path.glob("firehose_stream/*/*.ndjson")
+            for line in path.read_text().splitlines()
+        }
+    )
+    assert len(seqs) >= 200
+    assert seqs == list(range(1, len(seqs) + 1))
+    with open(cursors_file) as f:
+        assert json.load(f)["streamer"]["cursor"] == seqs[-1]
+    assert not (tmp_path / "firehose_spill.seg").exists()
+
+
+def test_streamer_resume_continues_after_the_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cursors_file = str(tmp_path / "cursors.json")
+    monkeypatch.setattr(const, "PATH_TO_CURSORS_FILE", cursors_file)
+    with FakeRelay(rate=2000) as relay:
+        settings = StreamerSettings(relay_uri=relay.uri, compression="gzip")
+        _run_streamer("fresh", cursors_file, 100, settings)
+        with open(cursors_file) as f:
+            checkpointed = json.load(f)["streamer"]["cursor"]
+        _run_streamer("resume", cursors_file, 200, settings)
+
+    events = [
+        (event["seq"], event["path"])
+        for path in tmp_path.glob("firehose_stream/*/*.ndjson.gz")
+        for event in map(json.loads, gzip.decompress(path.read_bytes()).splitlines())
+    ]
+    assert relay.cursors[1] == checkpointed
+    assert len(events) == len(set(events))
+    seqs = sorted({seq for seq, _ in events})
+    assert seqs == list(range(1, len(seqs) + 1))
+    assert seqs[-1] >= 200
+
+
+_CRASH_SEQS = 120
+
+
+def _frames(count):
+    """Commits of 1 to 4 ops, with #identity and #account messages between
+    them, the same for every call."""
+    rng = random.Random(0)
+    frames = []
+    for seq in range(1, count + 1):
+        if seq % 5 == 0:
+            body = {"seq": seq, "did": f"did:plc:{seq}", "time": "t"}
+            frames.append(encode_frame("#identity", body))
+        elif seq % 7 == 0:
+            body = {"seq": seq, "did": f"did:plc:{seq}", "time": "t", "active": True}
+            frames.append(encode_frame("#account", body))
+        else:
+            body = make_commit_body(seq, rng, n_ops=rng.randint(1, 4))
+            frames.append(encode_frame("#commit", body))
+    return frames
+
+
+def _handler(root, cursors_file, compression, shard):
+    """A handler writing like the streamer, with index cuts and LRU evictions
+    ending compressed members between checkpoints."""
+    writer = PartitionWriter(
+        root, compression=compression, index_every_bytes=300, max_open_files=2
+    )
+    checkpoint = CheckpointManager(None, writer.sync, cursors_file, flush_every=7)
+    options = ParseOptions(shard_by_collection=shard)
+    return writer, checkpoint, MessageHandler(checkpoint, writer, options)
+
+
+def _crash_after(root, cursors_file, compression, shard, seq):
+    """Handle the messages up to `seq`, then exit without closing anything,
+    in the middle of writing a line."""
+    writer, _, handler = _handler(root, cursors_file, compression, shard)
+    for frame in _frames(seq):
+        handler(decode_frame(frame))
+    writer.flush()
+    with open(writer.current_path, "ab") as f:
+        f.write(b'{"seq": 9')
+    os._exit(1)
+
+
+def _read_keys(root):
+    """The (seq, path or kind) of every event under `root`, as often as they
+    are written, failing on an invalid line or a partition ending early."""
+    with patch("sinitaivas_live.reader.logger") as logger:
+        keys = collections.Counter(
+            (event["seq"], event.get("path"), event.get("kind"))
+            for path in glob.glob(f"{root}/**/*.ndjson*", recursive=True)
+            if not path.endswith(".idx")
+            for event in seek(path)
+        )
+    logger.bind.assert_not_called()
+    return keys
+
+
+@pytest.mark.parametrize(
+    "compression, shard",
+    [("none", False), ("gzip", False), ("gzip", True), ("zstd", True)],
+)
+def test_resume_after_crash_loses_no_event(tmp_path, compression, shard):
+    root = str(tmp_path / "firehose_stream")
+    cursors_file = str(tmp_path / "cursors.json")
+    arguments = json.dumps([root, cursors_file, compression, shard, 90])
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import json, sys\n"
+            "from tests.sinitaivas_live.test_end_to_end import _crash_after\n"
+            "_crash_after(*json.loads(sys.argv[1]))",
+            arguments,
+        ],
+        cwd=os.path.dirname(tests.__path__[0]),
+        check=False,
+    )
+
+    # resume like streamer_main, the relay sending again a few seqs before
+    # the checkpoint
+    writer, checkpoint, handler = _handler(root, cursors_file, compression, shard)
+    writer.recover()
+    committed = checkpoint.committed_seq
+    assert committed is not None and committed < 90
+    writer.record_seq(committed)
+    for frame in _frames(_CRASH_SEQS)[committed - 5 :]:
+        handler(decode_frame(frame))
+    writer.close()
+    checkpoint.flush()
+
+    expected_root = str(tmp_path / "expected")
+    writer, checkpoint, handler = _handler(
+        expected_root, str(tmp_path / "expected.json"), compression, shard
+    )
+    for frame in _frames(_CRASH_SEQS):
+        handler(decode_frame(frame))
+    writer.close()
+    expected = _read_keys(expected_root)
+
+    written = _read_keys(root)
+    assert set(written) == set(expected)
+    # only the events after the checkpoint can be written twice
+    assert all(count == 1 for key, count in written.items() if key[0] <= committed)
+    assert max(written.values()) <= 2
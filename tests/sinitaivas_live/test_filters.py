@@ -0,0 +1,144 @@
+from unittest.mock import MagicMock, patch
+
+import sinitaivas_live.metrics as metrics
+from sinitaivas_live.filters import OpFilter
+from tests.support.synthetic import decode_frame, encode_frame, make_commit_frames
+
+
+def _message(ops, repo="did:plc:alice", message_type="#commit"):
+    message = MagicMock()
+    message.type = message_type
+    message.body = {"seq": 1, "repo": repo, "ops": ops}
+    return message
+
+
+def _op(path, action="create"):
+    return {"action": action, "path": path, "cid": None}
+
+
+def test_inactive_filter_keeps_everything():
+    op_filter = OpFilter()
+    message = _message([_op("app.bsky.feed.like/a"), _op("x.y.z/b", "delete")])
+
+    assert not op_filter.active
+    assert op_filter.apply(message)
+    assert len(message.body["ops"]) == 2
+
+
+def test_include_and_exclude_collections():
+    op_filter = OpFilter(
+        collections=["app.bsky.feed.*", "app.bsky.graph.follow"],
+        exclude_collections=["app.bsky.feed.like"],
+    )
+    message = _message(
+        [
+            _op("app.bsky.feed.post/a"),
+            _op("app.bsky.feed.like/b"),
+            _op("app.bsky.graph.follow/c"),
+            _op("app.bsky.graph.block/d"),
+            _op("app.bsky.feedgen/e"),
+        ]
+    )
+
+    assert op_filter.active
+    assert op_filter.apply(message)
+    assert [op["path"] for op in message.body["ops"]] == [
+        "app.bsky.feed.post/a",
+        "app.bsky.graph.follow/c",
+    ]
+    assert op_filter.dropped == {"author": 0, "action": 0, "collection": 3}
+
+
+def test_actions():
+    op_filter = OpFilter(exclude_actions=["delete"])
+    message = _message([_op("a.b.c/1", "delete"), _op("a.b.c/2", "update")])
+
+    assert op_filter.apply(message)
+    assert [op["action"] for op in message.body["ops"]] == ["update"]
+    assert op_filter.dropped["action"] == 1
+
+
+def test_authors_drop_the_whole_commit():
+    op_filter = OpFilter(authors=["did:plc:alice"])
+    message = _message([_op("a.b.c/1"), _op("a.b.c/2")], repo="did:plc:bob")
+
+    assert not op_filter.apply(message)
+    assert message.body["ops"] == []
+    assert op_filter.dropped["author"] == 2
+
+    assert op_filter.apply(_message([_op("a.b.c/3")], repo="did:plc:alice"))
+
+
+def test_dropped_ops_are_counted_in_the_metrics():
+    def counts():
+        return {
+            reason: metrics.OPS_DROPPED.labels(reason).value
+            for reason in ("author", "action", "collection")
+        }
+
+    before = counts()
+    op_filter = OpFilter(
+        authors=["did:plc:alice"],
+        exclude_actions=["delete"],
+        exclude_collections=["app.bsky.feed.like"],
+    )
+    op_filter.apply(_message([_op("a.b.c/1"), _op("a.b.c/2")], repo="did:plc:bob"))
+    op_filter.apply(
+        _message(
+            [
+                _op("a.b.c/3", "delete"),
+                _op("app.bsky.feed.like/4"),
+                _op("app.bsky.feed.post/5"),
+            ]
+        )
+    )
+
+    assert {reason: counts()[reason] - before[reason] for reason in before} == (
+        op_filter.dropped
+    )
+    assert op_filter.dropped == {"author": 2, "action": 1, "collection": 1}
+
+
+def test_other_messages_are_not_filtered():
+    op_filter = OpFilter(authors=["did:plc:alice"])
+    message = _message([], repo="did:plc:bob", message_type="#identity")
+
+    assert op_filter.apply(message)
+
+
+def test_apply_on_decoded_frames():
+    op_filter = OpFilter(collections=["app.bsky.graph.follow"])
+    messages = [
+        decode_frame(frame)
+        for frame in make_commit_frames(50, n_ops=2, collections=None)
+    ]
+    kept = [message for message in messages if op_filter.apply(message)]
+
+    assert kept
+    assert all(
+        op["path"].startswith("app.bsky.graph.follow/")
+        for message in kept
+        for op in message.body["ops"]
+    )
+    assert sum(op_filter.dropped.values()) == 100 - sum(
+        len(message.body["ops"]) for message in kept
+    )
+    identity = decode_frame(
+        encode_frame("#identity", {"seq": 7, "did": "did:plc:x", "time": "t"})
+    )
+    assert op_filter.apply(identity)
+
+
+@patch("sinitaivas_live.filters.logger")
+def test_dropped_ops_are_reported_periodically(mock_logger):
+    now = [0.0]
+    op_filter = OpFilter(
+        exclude_collections=["a.b.c"], report_interval_s=60, clock=lambda: now[0]
+    )
+    op_filter.apply(_message([_op("a.b.c/1")]))
+    mock_logger.bind.assert_not_called()
+
+    now[0] = 61.0
+    op_filter.apply(_message([_op("a.b.c/2")]))
+    mock_logger.bind.assert_called_once_with(author=0, action=0, collection=1)
+    mock_logger.bind.return_value.info.assert_called_once()
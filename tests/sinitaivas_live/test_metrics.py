@@ -0,0 +1,119 @@
+import math
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+
+import pytest
+
+import sinitaivas_live.metrics as metrics
+from sinitaivas_live.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsServer,
+    Registry,
+)
+
+
+def test_render_counters_and_gauges():
+    registry = Registry()
+    ops = Counter("ops_total", "Ops.", ("collection", "action"), registry=registry)
+    seq = Gauge("seq", "Seq.", registry=registry)
+
+    ops.labels("app.bsky.feed.like", "create").inc()
+    ops.labels("app.bsky.feed.like", "create").inc(2)
+    seq.set(42)
+
+    assert registry.render().splitlines() == [
+        "# HELP ops_total Ops.",
+        "# TYPE ops_total counter",
+        'ops_total{collection="app.bsky.feed.like",action="create"} 3',
+        "# HELP seq Seq.",
+        "# TYPE seq gauge",
+        "seq 42",
+    ]
+
+
+def test_render_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = Histogram(
+        "latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1.0), registry=registry
+    )
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.labels("write").observe(value)
+
+    lines = registry.render().splitlines()
+
+    assert lines[2:] == [
+        'latency_seconds_bucket{stage="write",le="0.1"} 2',
+        'latency_seconds_bucket{stage="write",le="1"} 3',
+        'latency_seconds_bucket{stage="write",le="+Inf"} 4',
+        'latency_seconds_sum{stage="write"} 3.65',
+        'latency_seconds_count{stage="write"} 4',
+    ]
+
+
+def test_histogram_state_moves_between_processes():
+    worker = Histogram("w", "W.", ("stage",), buckets=(1.0,), registry=Registry())
+    main = Histogram("m", "M.", ("stage",), buckets=(1.0,), registry=Registry())
+    value = worker.labels("parse")
+    value.observe(0.5)
+    value.observe(2.0)
+
+    main.merge(worker.pop_state())
+    value.observe(0.5)
+    main.merge(worker.pop_state())
+
+    assert main.labels("parse").counts == [2, 1]
+    assert main.labels("parse").sum == 3.0
+    assert worker.pop_state() == {}
+
+
+def test_label_sets_are_bounded():
+    counter = Counter("c", "C.", ("collection",), registry=Registry())
+    with patch("sinitaivas_live.metrics.const.METRICS_MAX_LABEL_SETS", 2):
+        for collection in ("a", "b", "c", "d"):
+            counter.labels(collection).inc()
+
+    assert counter.labels(metrics.OTHER_LABEL).value == 2
+    assert len(list(counter.samples())) == 3
+
+
+def test_metric_without_values_cannot_be_created():
+    class Incomplete(metrics._Metric):
+        type_name = "counter"
+
+    with pytest.raises(TypeError):
+        Incomplete("incomplete_total", "Incomplete.", registry=Registry())
+
+
+def test_gauge_function_and_commit_lag():
+    with patch("sinitaivas_live.metrics.time.time", return_value=1_700_000_010.0):
+        metrics.set_commit_time("2023-11-14T22:13:20.000Z")
+        [(_, _, lag)] = metrics.COMMIT_LAG_SECONDS.samples()
+    assert lag == pytest.approx(10.0)
+
+    metrics.set_commit_time(None)
+    [(_, _, lag)] = metrics.COMMIT_LAG_SECONDS.samples()
+    assert math.isnan(lag)
+
+    metrics.set_commit_time("not a time")
+    [(_, _, lag)] = metrics.COMMIT_LAG_SECONDS.samples()
+    assert math.isnan(lag)
+    metrics.set_commit_time(None)
+
+
+def test_server_serves_the_registry():
+    registry = Registry()
+    Counter("served_total", "Served.", registry=registry).inc()
+    server = MetricsServer(0, registry=registry)
+    server.start()
+    try:
+        url = f"http://127.0.0.1:{server.port}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert "served_total 1" in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+    finally:
+        server.close()
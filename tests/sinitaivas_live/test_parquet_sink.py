@@ -0,0 +1,122 @@
+import json
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pyarrow.parquet as pq
+import pytest
+
+import sinitaivas_live.parquet_sink as parquet_sink
+from sinitaivas_live.parquet_sink import ParquetSink
+from sinitaivas_live.parser import process_commit
+from sinitaivas_live.workers import EncodedMessage
+from tests.support.synthetic import make_commits
+
+
+def _read(root):
+    return pq.read_table(str(root), partitioning="hive").to_pylist()
+
+
+def test_sink_writes_the_events_by_hour_and_collection(tmp_path):
+    sink = ParquetSink(str(tmp_path))
+    collected = EncodedMessage()
+    with patch("sinitaivas_live.parser.logger"):
+        for commit in make_commits(40, n_ops=3):
+            process_commit(commit, collected, sink=collected)
+    for _, event in collected.events:
+        sink.write_event("2025-06-01T10", event)
+    sink.close()
+
+    files = sorted(p.relative_to(tmp_path) for p in tmp_path.rglob("*.parquet"))
+    assert files
+    assert all(str(f).startswith("date=2025-06-01/hour=10/collection=") for f in files)
+    assert not list(tmp_path.rglob(".*"))
+
+    rows = {(row["seq"], row["path"]): row for row in _read(tmp_path)}
+    assert len(rows) == len(collected.events)
+    for _, event in collected.events:
+        row = rows[(event["seq"], event["path"])]
+        assert row["collection"] == event["type"] == row["type"]
+        assert row["author"] == event["author"]
+        assert row["action"] == event["action"]
+        record = json.loads(row["record"]) if row["record"] else {}
+        assert {**event, **record} == event
+        if "createdAt" in event:
+            assert row["created_at"] is not None
+
+
+def test_sink_writes_row_groups_by_size_and_finalizes_on_close(tmp_path):
+    sink = ParquetSink(str(tmp_path), row_group_bytes=2000)
+    collected = EncodedMessage()
+    for commit in make_commits(30, collections=["app.bsky.feed.like"]):
+        process_commit(commit, collected, sink=collected)
+    for _, event in collected.events:
+        sink.write_event("2025-06-01T10", event)
+
+    directory = tmp_path / "date=2025-06-01/hour=10/collection=app.bsky.feed.like"
+    (part,) = directory.iterdir()
+    assert part.name == ".2025-06-01T10-1.parquet.part"
+    sink.close()
+
+    (path,) = directory.iterdir()
+    assert path.name == "2025-06-01T10-1.parquet"
+    metadata = pq.ParquetFile(path).metadata
+    assert metadata.num_rows == 30
+    assert metadata.num_row_groups > 1
+
+
+def test_sink_closes_the_files_of_the_previous_hour(tmp_path):
+    sink = ParquetSink(str(tmp_path))
+    sink.write_event("2025-06-01T23", {"seq": 1, "type": "app.bsky.feed.post"})
+    sink.write_event("2025-06-02T00", {"seq": 2, "type": "app.bsky.feed.post"})
+
+    assert (
+        tmp_path
+        / "date=2025-06-01/hour=23/collection=app.bsky.feed.post"
+        / "2025-06-01T23-1.parquet"
+    ).exists()
+    sink.close()
+    assert [row["seq"] for row in _read(tmp_path)] == [1, 2]
+
+
+def test_sink_parses_timestamps():
+    assert parquet_sink._parse_timestamp("2025-06-01T10:00:00.123Z").microsecond == (
+        123000
+    )
+    assert parquet_sink._parse_timestamp("2025-06-01T10:00:00").tzinfo is not None
+    assert parquet_sink._parse_timestamp("yesterday") is None
+    assert parquet_sink._parse_timestamp(None) is None
+
+
+def test_sink_writes_zulu_timestamps(tmp_path):
+    sink = ParquetSink(str(tmp_path))
+    sink.write_event(
+        "2024-05-01T12",
+        {
+            "seq": 1,
+            "type": "app.bsky.feed.post",
+            "createdAt": "2024-05-01T12:00:00.123Z",
+            "commit_time": "2024-05-01T12:00:01.456Z",
+        },
+    )
+    sink.close()
+
+    [row] = _read(tmp_path)
+    assert row["created_at"] == datetime(2024, 5, 1, 12, 0, 0, 123000, timezone.utc)
+    assert row["commit_time"] == datetime(2024, 5, 1, 12, 0, 1, 456000, timezone.utc)
+
+
+def test_recover_removes_unfinished_files(tmp_path):
+    directory = tmp_path / "date=2025-06-01/hour=10/collection=app.bsky.feed.post"
+    directory.mkdir(parents=True)
+    (directory / ".2025-06-01T10-1.parquet.part").write_bytes(b"PAR1")
+    (directory / "2025-06-01T10-0.parquet").write_bytes(b"PAR1")
+
+    ParquetSink(str(tmp_path)).recover()
+
+    assert [p.name for p in directory.iterdir()] == ["2025-06-01T10-0.parquet"]
+
+
+def test_sink_needs_pyarrow():
+    with patch.object(parquet_sink, "pa", None):
+        with pytest.raises(ValueError):
+            ParquetSink()
@@ -1,52 +1,114 @@
+import json
+from datetime import datetime, timezone
 from unittest.mock import patch, MagicMock, PropertyMock
 
+from atproto_client.models.utils import (
+    get_or_create,
+    get_model_as_dict,
+    get_model_as_json,
+)
+
+import utils.bytes_io as bytes_io
 from sinitaivas_live.parser import (
+    ParseOptions,
     process_commit,
     _process_op,
     _save_commit_event,
     _init_commit_event,
     _extract_record_from_blocks,
+    _extract_raw_record_from_blocks,
     _add_current_utc_time_to_commit_event,
     _update_commit_event_with_op,
     _update_commit_event_with_uri,
 )
+from sinitaivas_live.workers import EncodedMessage
+from sinitaivas_live.writer import PartitionWriter
+from utils.datetime_utils import UtcClock
+from utils.json_lines import encode_line_json, encode_line_orjson
+from tests.support.synthetic import make_commits
 
 
+@patch("sinitaivas_live.parser.CAR")
 @patch("sinitaivas_live.parser._process_op")
-def test_process_commit(mock_process_op):
+def test_process_commit(mock_process_op, mock_CAR):
     # setup commit with multiple ops
     commit = MagicMock()
     commit.ops = [MagicMock() for _ in range(5)]
-    process_commit(commit)
+    writer = MagicMock()
+    process_commit(commit, writer)
     assert mock_process_op.call_count == len(commit.ops)
+    # the blocks are decoded once per commit
+    mock_CAR.from_bytes.assert_called_once_with(commit.blocks)
+    # every op gets its own copy of the commit event
+    events = [call.args[2] for call in mock_process_op.call_args_list]
+    assert len({id(event) for event in events}) == len(commit.ops)
+    assert all(event["seq"] == commit.seq for event in events)
+    # and the same partition
+    partitions = {call.args[5] for call in mock_process_op.call_args_list}
+    assert len(partitions) == 1
+
+
+@patch("sinitaivas_live.parser.CAR")
+@patch("sinitaivas_live.parser._process_op")
+def test_process_commit_collected_at_and_partition(mock_process_op, mock_CAR):
+    moment = datetime(2025, 6, 1, 12, 5, 7, 123456, tzinfo=timezone.utc)
+    now_ns = int(moment.timestamp()) * 10**9 + 123456789
+    commit = MagicMock()
+    commit.ops = [MagicMock()]
+
+    with patch("sinitaivas_live.parser._clock", UtcClock(lambda: now_ns)):
+        process_commit(commit, MagicMock())
+
+    args = mock_process_op.call_args.args
+    assert args[2]["collected_at"] == "2025-06-01T12:05:07.123456Z"
+    assert args[5] == "2025-06-01T12"
+
+
+@patch("sinitaivas_live.parser.CAR")
+@patch("sinitaivas_live.parser._process_op")
+def test_process_commit_without_ops(mock_process_op, mock_CAR):
+    commit = MagicMock()
+    commit.ops = []
+    process_commit(commit, MagicMock())
+    mock_process_op.assert_not_called()
+    mock_CAR.from_bytes.assert_not_called()
+
+
+@patch("sinitaivas_live.parser.CAR")
+@patch("sinitaivas_live.parser._process_op")
+@patch("sinitaivas_live.parser._init_commit_event", return_value={})
+def test_process_commit_no_commit_event(
+    mock_init_commit_event, mock_process_op, mock_CAR
+):
+    commit = MagicMock()
+    commit.ops = [MagicMock()]
+
+    process_commit(commit, MagicMock())
+
+    # Should return early, so nothing else called
+    assert mock_init_commit_event.called
+    mock_process_op.assert_not_called()
+    mock_CAR.from_bytes.assert_not_called()
 
 
-@patch("sinitaivas_live.parser._init_commit_event")
 @patch("sinitaivas_live.parser._update_commit_event_with_op")
 @patch("sinitaivas_live.parser._update_commit_event_with_uri")
-@patch("sinitaivas_live.parser.CAR")
 @patch("sinitaivas_live.parser._extract_record_from_blocks")
 @patch("sinitaivas_live.parser._save_commit_event")
 @patch("sinitaivas_live.parser.AtUri")
-@patch("sinitaivas_live.parser.fs")
 def test_process_op_happy_path(
-    mock_fs,
     mock_AtUri,
     mock_save_commit_event,
     mock_extract_record_from_blocks,
-    mock_CAR,
     mock_update_commit_event_with_uri,
     mock_update_commit_event_with_op,
-    mock_init_commit_event,
 ):
     # Setup
     commit = MagicMock()
     op = MagicMock()
+    car = MagicMock()
     commit.repo = "repo"
     op.path = "some/path"
-    commit.blocks = b"bytes"
-    mock_fs.current_dir.return_value = "/tmp"
-    mock_init_commit_event.return_value = {"init": "event"}
     mock_update_commit_event_with_op.return_value = {
         "init": "event",
         "collected_at": "2023-01-01T00",
@@ -55,65 +117,56 @@ def test_process_op_happy_path(
     mock_uri = MagicMock()
     mock_AtUri.from_str.return_value = mock_uri
     mock_update_commit_event_with_uri.return_value = {"final": "event"}
-    mock_car = MagicMock()
-    mock_CAR.from_bytes.return_value = mock_car
     mock_extract_record_from_blocks.return_value = {"final": "event"}
 
+    writer = MagicMock()
+
     # Call
-    _process_op(commit, op)
+    _process_op(commit, op, {"init": "event"}, car, writer, "2023-01-01T00")
 
     # Assert
-    mock_fs.create_dir_if_not_exists.assert_called_once()
-    mock_save_commit_event.assert_called_once()
-    mock_CAR.from_bytes.assert_called_once_with(commit.blocks)
+    mock_update_commit_event_with_op.assert_called_once_with({"init": "event"}, op)
+    mock_extract_record_from_blocks.assert_called_once_with({"final": "event"}, car, op)
+    mock_save_commit_event.assert_called_once_with(
+        {"final": "event"}, writer, "2023-01-01T00", encode_line_json, None, False
+    )
     mock_AtUri.from_str.assert_called_once_with(f"at://{commit.repo}/{op.path}")
 
 
-@patch("sinitaivas_live.parser._init_commit_event", return_value=None)
 @patch("sinitaivas_live.parser.logger")
-def test_process_op_no_commit_event(mock_logger, mock_init_commit_event):
-    commit = MagicMock()
-    op = MagicMock()
-
-    _process_op(commit, op)
-
-    # Should return early, so nothing else called
-    assert mock_init_commit_event.called
+def test_save_commit_event(mock_logger):
+    commit_event = {"key": "value"}
+    writer = MagicMock()
+    _save_commit_event(commit_event, writer, "2023-01-01T00")
+    writer.write.assert_called_once_with("2023-01-01T00", b'{"key": "value"}\n')
+    mock_logger.bind.assert_not_called()
 
 
-@patch("sinitaivas_live.parser.json.dumps")
-@patch("sinitaivas_live.parser.logger")
-def test_save_commit_event(mock_logger, mock_json_dumps):
+def test_save_commit_event_with_encoder():
     commit_event = {"key": "value"}
-    output_filename = "test.ndjson"
-    mock_json_dumps.return_value = '{"key": "value"}'
-    _save_commit_event(commit_event, output_filename)
-    mock_json_dumps.assert_called_once_with(commit_event)
-    mock_logger.bind.assert_not_called()
+    writer = MagicMock()
+    encode_line = MagicMock(return_value=b"line\n")
+    _save_commit_event(commit_event, writer, "2023-01-01T00", encode_line)
+    encode_line.assert_called_once_with(commit_event)
+    writer.write.assert_called_once_with("2023-01-01T00", b"line\n")
 
 
 @patch("sinitaivas_live.parser.logger")
 def test_save_commit_event_fail(mock_logger):
     commit_event = {"key": "value"}
-    output_filename = "test.ndjson"
-
-    # Instead of patching open directly, use a proper context manager mock
-    with patch(
-        "sinitaivas_live.parser.open", side_effect=Exception("File write error")
-    ) as mock_open:
-
-        _save_commit_event(commit_event, output_filename)
+    writer = MagicMock()
+    writer.write.side_effect = Exception("File write error")
+    writer.partition_path.return_value = "2023-01-01/2023-01-01T00.ndjson"
 
-        # Check that open was called with the right arguments
-        mock_open.assert_called_once_with(output_filename, "a", encoding="utf-8")
+    _save_commit_event(commit_event, writer, "2023-01-01T00")
 
-        # Check that logger was called correctly
-        mock_logger.bind.assert_called_once_with(
-            file=output_filename, commit_event=commit_event
-        )
-        mock_logger.bind.return_value.error.assert_called_once_with(
-            "Failed to write to file: File write error"
-        )
+    # Check that logger was called correctly
+    mock_logger.bind.assert_called_once_with(
+        file="2023-01-01/2023-01-01T00.ndjson", commit_event=commit_event
+    )
+    mock_logger.bind.return_value.error.assert_called_once_with(
+        "Failed to write to file: File write error"
+    )
 
 
 def test_init_commit_event():
@@ -167,13 +220,13 @@ def test_add_current_utc_time_to_commit_event():
 
 
 @patch("sinitaivas_live.parser.get_or_create")
-@patch("sinitaivas_live.parser.get_model_as_json")
+@patch("sinitaivas_live.parser._get_model_as_json_dict")
 @patch("sinitaivas_live.parser.get_model_as_dict")
 @patch("sinitaivas_live.parser.logger")
 def test_extract_record_from_blocks_success(
     mock_logger,
     mock_get_model_as_dict,
-    mock_get_model_as_json,
+    mock_get_model_as_json_dict,
     mock_get_or_create,
 ):
     # Setup
@@ -185,7 +238,7 @@ def test_extract_record_from_blocks_success(
     car.blocks.get.return_value = model_data
     model_instance = MagicMock()
     mock_get_or_create.return_value = model_instance
-    mock_get_model_as_json.return_value = '{"new_key": "new_value"}'
+    mock_get_model_as_json_dict.return_value = {"new_key": "new_value"}
 
     # Call
     result = _extract_record_from_blocks(commit_event.copy(), car, op)
@@ -193,21 +246,22 @@ def test_extract_record_from_blocks_success(
     # Assert
     assert "new_key" in result
     assert result["new_key"] == "new_value"
-    mock_get_model_as_json.assert_called_once_with(model_instance)
+    mock_get_model_as_json_dict.assert_called_once_with(model_instance)
     mock_logger.bind.assert_not_called()
     mock_get_model_as_dict.assert_not_called()
 
 
 @patch("sinitaivas_live.parser.get_or_create")
-@patch("sinitaivas_live.parser.get_model_as_json", side_effect=Exception("bad json"))
+@patch(
+    "sinitaivas_live.parser._get_model_as_json_dict",
+    side_effect=Exception("bad json"),
+)
 @patch("sinitaivas_live.parser.get_model_as_dict")
 @patch("sinitaivas_live.parser.logger")
-@patch("sinitaivas_live.parser.bytes_io")
 def test_extract_record_from_blocks_json_fail_dict_success(
-    mock_bytes_io,
     mock_logger,
     mock_get_model_as_dict,
-    mock_get_model_as_json,
+    mock_get_model_as_json_dict,
     mock_get_or_create,
 ):
     commit_event = {"existing": "data"}
@@ -220,16 +274,37 @@ def test_extract_record_from_blocks_json_fail_dict_success(
 
     # make mock_get_model_as_dict return a dict with bytes
     mock_get_model_as_dict.return_value = {"dict_key": b"bytes_value"}
-    mock_bytes_io.convert_bytes_to_str.return_value = {"dict_key": "str_value"}
 
     result = _extract_record_from_blocks(commit_event.copy(), car, op)
 
-    assert "dict_key" in result
-    assert result["dict_key"] == "str_value"
+    assert result["dict_key"] == "Ynl0ZXNfdmFsdWU="
     mock_logger.bind.return_value.warning.assert_called_once()
     mock_logger.bind.return_value.error.assert_not_called()
 
 
+@patch("sinitaivas_live.parser.get_or_create")
+@patch(
+    "sinitaivas_live.parser._get_model_as_json_dict",
+    side_effect=Exception("bad json"),
+)
+@patch("sinitaivas_live.parser.get_model_as_dict")
+def test_extract_record_from_blocks_dict_with_bytes_keys_can_be_encoded(
+    mock_get_model_as_dict,
+    mock_get_model_as_json_dict,
+    mock_get_or_create,
+):
+    car = MagicMock()
+    car.blocks.get.return_value = {"foo": "bar"}
+    mock_get_or_create.return_value = MagicMock()
+    mock_get_model_as_dict.return_value = {"facets": {b"\xff key": [b"\xff"]}}
+
+    result = _extract_record_from_blocks({}, car, MagicMock())
+
+    assert result == {"facets": {"/yBrZXk=": ["/w=="]}}
+    for encode in (encode_line_json, encode_line_orjson):
+        assert json.loads(encode(result)) == result
+
+
 @patch("sinitaivas_live.parser.get_or_create")
 @patch("sinitaivas_live.parser.logger")
 def test_extract_record_from_blocks_no_model_instance(mock_logger, mock_get_or_create):
@@ -307,3 +382,122 @@ def test_update_commit_event_with_uri_exception(mock_logger):
     assert result == {"foo": "bar"}
     mock_logger.bind.assert_called_once_with(uri=uri)
     mock_logger.bind.return_value.error.assert_called_once()
+
+
+def test_process_commit_writes_one_line_per_op(tmp_path):
+    commit = make_commits(1, n_ops=6, collections=["app.bsky.feed.post"])[0]
+    writer = PartitionWriter(str(tmp_path))
+
+    process_commit(commit, writer)
+    writer.close()
+
+    (output_file,) = tmp_path.glob("*/*.ndjson")
+    events = [json.loads(line) for line in output_file.read_text().splitlines()]
+    assert [event["path"] for event in events] == [op.path for op in commit.ops]
+    assert all(event["seq"] == commit.seq for event in events)
+    assert all(
+        event["type"] == "app.bsky.feed.post" and "text" in event
+        for event in events
+        if event["action"] == "create"
+    )
+
+
+def _json_round_trip_record(commit_event, car, op):
+    # the reference: record serialized to a JSON string and loaded back
+    model_instance = get_or_create(car.blocks.get(op.cid), strict=False)
+    if model_instance:
+        try:
+            commit_event.update(json.loads(get_model_as_json(model_instance)))
+        except Exception:
+            commit_event.update(
+                bytes_io.convert_bytes_to_str(get_model_as_dict(model_instance))
+            )
+    return commit_event
+
+
+def _parity_lines(options=ParseOptions()):
+    commits = make_commits(80, n_ops=3, seed=6) + make_commits(
+        40,
+        n_ops=2,
+        seed=7,
+        first_seq=81,
+        collections=["app.bsky.feed.post", "app.bsky.actor.profile"],
+    )
+    collected = EncodedMessage()
+    noon = int(datetime(2025, 6, 1, 12, tzinfo=timezone.utc).timestamp() * 1e9)
+    with patch("sinitaivas_live.parser._clock", UtcClock(lambda: noon)):
+        for commit in commits:
+            process_commit(commit, collected, options)
+    return [line for _, line in collected.lines]
+
+
+def test_process_commit_output_is_identical_to_json_round_trip():
+    with patch(
+        "sinitaivas_live.parser._extract_record_from_blocks",
+        _json_round_trip_record,
+    ):
+        expected = _parity_lines()
+    lines = _parity_lines()
+
+    assert len(lines) == 320
+    # the corpus covers blob links, extended records and invalid utf-8 bytes
+    assert any(b"$link" in line for line in lines)
+    assert any(b'"via"' in line for line in lines)
+    assert any(b'"tag"' in line for line in lines)
+    assert lines == expected
+
+
+def test_process_commit_orjson_output_decodes_to_the_same_events():
+    lines = _parity_lines(ParseOptions(encode_line=encode_line_orjson))
+    expected = _parity_lines()
+    assert [json.loads(line) for line in lines] == [
+        json.loads(line) for line in expected
+    ]
+
+
+@patch("sinitaivas_live.parser.get_or_create")
+def test_extract_raw_record_from_blocks(mock_get_or_create):
+    car = MagicMock()
+    op = MagicMock()
+    car.blocks.get.return_value = {"$type": "com.example.record", "data": b"abc"}
+
+    result = _extract_raw_record_from_blocks({"existing": "data"}, car, op)
+
+    assert result == {
+        "existing": "data",
+        "$type": "com.example.record",
+        "data": "YWJj",
+    }
+    car.blocks.get.assert_called_once_with(op.cid)
+    mock_get_or_create.assert_not_called()
+
+
+@patch("sinitaivas_live.parser.logger")
+def test_extract_raw_record_from_blocks_no_data(mock_logger):
+    car = MagicMock()
+    car.blocks.get.return_value = None
+
+    result = _extract_raw_record_from_blocks({"existing": "data"}, car, MagicMock())
+
+    assert result == {"existing": "data"}
+    mock_logger.bind.return_value.warning.assert_called_once_with("No record data")
+
+
+def test_process_commit_raw_mode_emits_every_collection():
+    model_lines = _parity_lines()
+    raw_lines = _parity_lines(ParseOptions(record_mode="raw"))
+
+    assert len(raw_lines) == len(model_lines)
+    for raw_line, model_line in zip(raw_lines, model_lines):
+        raw, model = json.loads(raw_line), json.loads(model_line)
+        # same event fields, and the record content when it has a lexicon
+        assert raw["seq"] == model["seq"] and raw["path"] == model["path"]
+        if raw["action"] != "delete":
+            assert raw["$type"] == raw["type"]
+            assert raw.get("text") == model.get("text")
+    # the records without a lexicon model are emitted too
+    assert any(
+        json.loads(line)["type"] == "com.example.unknown.record"
+        and "note" in json.loads(line)
+        for line in raw_lines
+    )
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+from sinitaivas_live.pipeline import AsyncPipeline
+
+
+class FakeAsyncClient:
+    """Delivers the given frames to the callback, then returns like a closed
+    subscription, or idles until stopped."""
+
+    def __init__(self, frames, idle=False):
+        self.frames = frames
+        self.idle = idle
+        self.stopped = asyncio.Event()
+
+    async def start(self, on_message_callback, on_callback_error_callback=None):
+        for frame in self.frames:
+            await on_message_callback(frame)
+        if self.idle:
+            await self.stopped.wait()
+
+    async def stop(self):
+        self.stopped.set()
+
+
+def test_run_processes_all_frames_in_order_off_the_loop():
+    handled = []
+    threads = set()
+
+    def handle_message(message):
+        handled.append(message)
+        threads.add(threading.current_thread().name)
+
+    async def run():
+        pipeline = AsyncPipeline(FakeAsyncClient(list(range(1000))), handle_message)
+        await pipeline.run()
+        return pipeline
+
+    pipeline = asyncio.run(run())
+    assert handled == list(range(1000))
+    assert threads and all(name.startswith("sinitaivas-consumer") for name in threads)
+    assert pipeline.queue_depth == 0
+
+
+def test_queue_is_bounded_and_high_watermark_is_tracked():
+    release = threading.Event()
+
+    def handle_message(message):
+        # a stalled disk: the consumer is blocked until the receiver is done
+        release.wait(timeout=5)
+
+    async def run():
+        client = FakeAsyncClient(list(range(20)))
+        pipeline = AsyncPipeline(client, handle_message, queue_size=5, batch_size=1)
+        task = asyncio.create_task(pipeline.run())
+        await asyncio.sleep(0.1)
+        # the receiver waits on the full queue instead of growing it
+        depth = pipeline.queue_depth
+        release.set()
+        await task
+        return pipeline, depth
+
+    pipeline, depth = asyncio.run(run())
+    assert depth == 5
+    assert pipeline.high_watermark == 5
+
+
+@patch("sinitaivas_live.pipeline.logger")
+def test_errors_only_drop_their_frame(mock_logger):
+    handled = []
+
+    def handle_message(message):
+        if message == 3:
+            raise ValueError("bad frame")
+        handled.append(message)
+
+    async def run():
+        await AsyncPipeline(FakeAsyncClient(list(range(6))), handle_message).run()
+
+    asyncio.run(run())
+    assert handled == [0, 1, 2, 4, 5]
+    mock_logger.error.assert_called_once()
+
+
+def test_stop_ends_the_subscription_and_drains_the_queue():
+    handled = []
+
+    async def run():
+        client = FakeAsyncClient(list(range(10)), idle=True)
+        pipeline = AsyncPipeline(client, handled.append)
+        task = asyncio.create_task(pipeline.run())
+        await asyncio.sleep(0.05)
+        pipeline.stop()
+        await asyncio.wait_for(task, timeout=5)
+        return client
+
+    client = asyncio.run(run())
+    assert client.stopped.is_set()
+    assert handled == list(range(10))
@@ -0,0 +1,76 @@
+import pstats
+from unittest.mock import patch
+
+import sinitaivas_live.metrics as metrics
+from sinitaivas_live.profiler import MESSAGE_STAGE, StageProfiler, percentile
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _reported(mock_logger):
+    return {
+        call.kwargs["stage"]: call.kwargs for call in mock_logger.bind.call_args_list
+    }
+
+
+def test_percentile():
+    samples = list(range(1, 101))
+    assert percentile(samples, 0.5) == 51
+    assert percentile(samples, 0.99) == 100
+    assert percentile([], 0.5) == 0
+
+
+@patch("sinitaivas_live.profiler.logger")
+def test_samples_one_stage_timing_out_of_n(mock_logger):
+    profiler = StageProfiler(sample_every=2)
+    profiler.install()
+    try:
+        for us in range(1, 11):
+            metrics.SERIALIZE_SECONDS.observe(us / 1e6)
+    finally:
+        profiler.close()
+
+    report = _reported(mock_logger)["serialize"]
+    assert report["samples"] == 5
+    assert report["p50_us"] == 6.0
+    assert report["p99_us"] == 10.0
+    assert metrics.SERIALIZE_SECONDS.listener is None
+
+
+@patch("sinitaivas_live.profiler.logger")
+def test_wrapped_handler_times_messages_and_reports_periodically(mock_logger):
+    clock = FakeClock()
+    profiler = StageProfiler(sample_every=1, report_interval_s=60, clock=clock)
+    handled = []
+    handler = profiler.wrap(handled.append)
+
+    handler("a")
+    mock_logger.bind.assert_not_called()
+    clock.now = 60
+    handler("b")
+
+    assert handled == ["a", "b"]
+    assert _reported(mock_logger)[MESSAGE_STAGE]["samples"] == 2
+
+
+@patch("sinitaivas_live.profiler.logger")
+def test_cprofile_dump_covers_the_window(mock_logger, tmp_path):
+    clock = FakeClock()
+    profiler = StageProfiler(dump="cprofile", window_s=10, clock=clock)
+    handler = profiler.wrap(lambda message: sorted(message))
+
+    with patch("sinitaivas_live.profiler.fs.current_dir", return_value=str(tmp_path)):
+        handler([3, 1, 2])
+        clock.now = 10
+        handler([2, 1])
+        handler([1])
+
+    [path] = tmp_path.glob("profile-*.prof")
+    functions = {name for _, _, name in pstats.Stats(str(path)).stats}
+    assert "<built-in method builtins.sorted>" in functions
@@ -0,0 +1,94 @@
+import pytest
+
+from sinitaivas_live.reader import _iter_events, read_index, seek
+from sinitaivas_live.writer import PartitionWriter
+
+
+def _write_partition(root, compression, index_every_bytes=200):
+    writer = PartitionWriter(
+        str(root), compression=compression, index_every_bytes=index_every_bytes
+    )
+    for seq in range(1, 31):
+        writer.write(
+            "2025-06-01T10",
+            b'{"seq": %d, "commit_time": "2025-06-01T10:%02d:00"}\n' % (seq, seq),
+        )
+    writer.close()
+    return writer.partition_path("2025-06-01T10")
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+def test_seek_by_seq(tmp_path, compression):
+    path = _write_partition(tmp_path, compression)
+
+    assert len(read_index(path)) > 2
+    assert [event["seq"] for event in seek(path, seq=17)] == list(range(17, 31))
+    assert [event["seq"] for event in seek(path)] == list(range(1, 31))
+
+
+@pytest.mark.parametrize("compression", ["none", "zstd"])
+def test_seek_by_commit_time(tmp_path, compression):
+    path = _write_partition(tmp_path, compression)
+
+    events = list(seek(path, commit_time="2025-06-01T10:25:00"))
+
+    assert [event["seq"] for event in events] == list(range(25, 31))
+
+
+def test_seek_starts_from_the_last_entry_before_the_seq(tmp_path):
+    path = _write_partition(tmp_path, "gzip")
+    entries = read_index(path)
+    target = entries[-1].seq + 1
+
+    with open(path, "r+b") as f:
+        # corrupt the first member: it must not be read
+        f.write(b"\0" * 4)
+
+    assert [event["seq"] for event in seek(path, seq=target)] == list(range(target, 31))
+
+
+def test_seek_without_index_reads_the_whole_file(tmp_path):
+    path = _write_partition(tmp_path, "none", index_every_bytes=0)
+
+    assert read_index(path) == []
+    assert [event["seq"] for event in seek(path, seq=29)] == [29, 30]
+
+
+def test_read_index_drops_entries_beyond_the_file(tmp_path):
+    path = _write_partition(tmp_path, "none")
+    size = len(open(path, "rb").read())
+    with open(f"{path}.idx", "a") as f:
+        f.write(f"99\t2025-06-01T11:00:00\t{size}\nnot an entry\n")
+
+    assert all(entry.offset < size for entry in read_index(path))
+    assert read_index(path)[-1].seq < 99
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+def test_seek_returns_the_whole_commit_when_an_entry_cuts_it(tmp_path, compression):
+    writer = PartitionWriter(
+        str(tmp_path), compression=compression, index_every_bytes=100
+    )
+    for seq in range(1, 21):
+        for op in range(3):
+            writer.write(
+                "2025-06-01T10",
+                b'{"seq": %d, "op": %d, "commit_time": "2025-06-01T10:%02d:00"}\n'
+                % (seq, op, seq),
+            )
+    writer.close()
+    path = writer.partition_path("2025-06-01T10")
+    # some entries point in the middle of a commit
+    assert any(
+        next(_iter_events(path, entry.offset))["op"] > 0 for entry in read_index(path)
+    )
+
+    for target in range(1, 21):
+        events = list(seek(path, seq=target))
+        assert [(event["seq"], event["op"]) for event in events[:3]] == [
+            (target, 0),
+            (target, 1),
+            (target, 2),
+        ]
+        by_time = list(seek(path, commit_time="2025-06-01T10:%02d:00" % target))
+        assert by_time == events
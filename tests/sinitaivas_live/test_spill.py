@@ -0,0 +1,147 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import sinitaivas_live.metrics as metrics
+from sinitaivas_live.spill import BufferedConsumer, SpillBuffer
+from sinitaivas_live.streamer import MessageHandler
+from sinitaivas_live.writer import PartitionWriter
+from tests.support.synthetic import decode_frame, make_commit_frames
+
+
+def _frames(count, first_seq=1):
+    return [
+        decode_frame(frame) for frame in make_commit_frames(count, first_seq=first_seq)
+    ]
+
+
+def _drain(buffer):
+    buffer.close()
+    messages = []
+    while (message := buffer.get()) is not None:
+        messages.append(message)
+    return messages
+
+
+def test_spill_buffer_keeps_frames_in_memory_within_budget(tmp_path):
+    path = tmp_path / "spill.seg"
+    buffer = SpillBuffer(str(path), memory_bytes=10 * 1024 * 1024)
+    frames = _frames(5)
+
+    for frame in frames:
+        buffer.put(frame)
+
+    assert buffer.depth == 5 and buffer.spilled == 0
+    assert not path.exists()
+    assert _drain(buffer) == frames
+
+
+def test_spill_buffer_spills_beyond_budget_and_drains_in_order(tmp_path):
+    path = tmp_path / "spill.seg"
+    spilled_before = metrics.SPILLED_FRAMES.labels().value
+    # room for about two frames
+    buffer = SpillBuffer(str(path), memory_bytes=2 * 1024 + 2000)
+    frames = _frames(8)
+
+    for frame in frames[:6]:
+        buffer.put(frame)
+    assert buffer.spilled >= 3
+    spilled = buffer.spilled
+    # in order across memory and disk, while more frames arrive
+    received = [buffer.get() for _ in range(3)]
+    for frame in frames[6:]:
+        buffer.put(frame)
+    received += _drain(buffer)
+
+    assert [message.body for message in received] == [frame.body for frame in frames]
+    assert metrics.SPILLED_FRAMES.labels().value == spilled_before + spilled + 2
+    # the drained segment is emptied, then removed
+    assert path.stat().st_size == 0
+    buffer.remove()
+    assert not path.exists()
+
+
+def test_spill_buffer_goes_back_to_memory_once_drained(tmp_path):
+    frames = _frames(3)
+    size = max(1024 + len(frame.body["blocks"]) for frame in frames)
+    # room for one frame
+    buffer = SpillBuffer(str(tmp_path / "spill.seg"), memory_bytes=size * 3 // 2)
+
+    buffer.put(frames[0])
+    buffer.put(frames[1])
+    assert buffer.spilled == 1
+    assert buffer.get() is frames[0]
+    assert buffer.get().body == frames[1].body
+
+    buffer.put(frames[2])
+    assert buffer.spilled == 0
+    assert buffer.get() is frames[2]
+
+
+def test_spill_buffer_keeps_frames_received_again_in_order(tmp_path):
+    buffer = SpillBuffer(str(tmp_path / "spill.seg"), memory_bytes=4096)
+    frames = _frames(4)
+
+    for frame in frames[:3]:
+        buffer.put(frame)
+    # a relay resuming from an older cursor, the handler drops them
+    for frame in _frames(4)[1:]:
+        buffer.put(frame)
+
+    seqs = [message.body["seq"] for message in _drain(buffer)]
+    assert seqs == [1, 2, 3, 2, 3, 4]
+
+
+def test_buffered_consumer_keeps_receiving_while_processing_is_stalled(tmp_path):
+    path = tmp_path / "spill.seg"
+    release = threading.Event()
+    handled = []
+
+    def handler(message):
+        # a stalled disk
+        release.wait(timeout=5)
+        handled.append(message.body["seq"])
+
+    consumer = BufferedConsumer(handler, SpillBuffer(str(path), memory_bytes=4096))
+    started_at = time.monotonic()
+    for frame in _frames(50):
+        consumer(frame)
+    received_in = time.monotonic() - started_at
+
+    assert received_in < 2
+    assert path.stat().st_size > 0
+    release.set()
+    consumer.close()
+
+    assert handled == list(range(1, 51))
+    assert not path.exists()
+
+
+def test_buffered_consumer_drops_frames_received_again_on_its_thread(
+    tmp_path, monkeypatch
+):
+    duplicates = metrics.DROPPED_MESSAGES.labels("#commit", "duplicate")
+    duplicates_before = duplicates.value
+    labels = metrics.DROPPED_MESSAGES.labels
+    counted_on = set()
+
+    def record_thread(*values):
+        counted_on.add(threading.current_thread().name)
+        return labels(*values)
+
+    monkeypatch.setattr(metrics.DROPPED_MESSAGES, "labels", record_thread)
+    writer = PartitionWriter(str(tmp_path / "firehose_stream"))
+    handler = MessageHandler(MagicMock(), writer)
+    consumer = BufferedConsumer(handler, SpillBuffer(str(tmp_path / "spill.seg")))
+
+    # a reconnect from an older cursor sends 3 to 5 again
+    for frame in _frames(5) + _frames(4, first_seq=3):
+        consumer(frame)
+    consumer.close()
+    writer.close()
+
+    assert writer.last_seq == 6
+    assert duplicates.value == duplicates_before + 3
+    # counted by the thread processing the messages only
+    assert len(counted_on) == 1
+    assert threading.current_thread().name not in counted_on
@@ -1,12 +1,34 @@
-from unittest.mock import patch, MagicMock
-from atproto import models, FirehoseSubscribeReposClient
+import json
+from unittest.mock import patch, MagicMock, AsyncMock
+from atproto import (
+    models,
+    AsyncFirehoseSubscribeReposClient,
+    FirehoseSubscribeReposClient,
+)
 
+import sinitaivas_live.metrics as metrics
+from sinitaivas_live.filters import OpFilter
 from sinitaivas_live.streamer import (
+    MessageHandler,
+    _install_signal_handlers,
     get_fresh_client,
     resume_streamer,
     start,
+    start_async,
     streamer_main,
 )
+from sinitaivas_live.settings import StreamerSettings
+from sinitaivas_live.supervisor import AsyncConnectionSupervisor
+from sinitaivas_live.parser import DEFAULT_OPTIONS, ParseOptions
+from sinitaivas_live.writer import PartitionWriter
+from utils.json_lines import encode_line_orjson
+
+
+def _mock_writer():
+    """A writer that has not written any message yet."""
+    writer = MagicMock()
+    writer.is_written.return_value = False
+    return writer
 
 
 def test_get_fresh_client():
@@ -15,6 +37,11 @@ def test_get_fresh_client():
     assert isinstance(client, FirehoseSubscribeReposClient)
 
 
+def test_get_fresh_client_async():
+    client = get_fresh_client("async")
+    assert isinstance(client, AsyncFirehoseSubscribeReposClient)
+
+
 @patch("sinitaivas_live.streamer.logger")
 @patch("sinitaivas_live.streamer.cursor.read_last_seq_from_file")
 @patch("sinitaivas_live.streamer.cursor.read_cursor")
@@ -98,18 +125,18 @@ def test_resume_streamer_handles_missing_streamer_key(
     assert result == mock_client
 
 
-@patch("sinitaivas_live.streamer.cursor.update_cursor")
-@patch("sinitaivas_live.streamer.parser.process_commit")
-@patch("sinitaivas_live.streamer.logger")
-@patch("sinitaivas_live.streamer.parse_subscribe_repos_message")
+@patch("sinitaivas_live.parser.process_commit")
+@patch("sinitaivas_live.parser.logger")
+@patch("sinitaivas_live.parser.parse_subscribe_repos_message")
 def test_start_processes_valid_commit(
     mock_parse_subscribe_repos_message,
     mock_logger,
     mock_process_commit,
-    mock_update_cursor,
 ):
     # Arrange
     mock_client = MagicMock()
+    mock_checkpoint = MagicMock()
+    mock_writer = _mock_writer()
     mock_commit = MagicMock(spec=models.ComAtprotoSyncSubscribeRepos.Commit)
     mock_commit.blocks = True
     mock_commit.seq = 123
@@ -118,51 +145,98 @@ def test_start_processes_valid_commit(
     mock_parse_subscribe_repos_message.return_value = mock_commit
 
     # Get the on_message_callback by calling start
-    start(mock_client)
+    start(mock_client, MessageHandler(mock_checkpoint, mock_writer))
     # Extract the callback passed to client.start
     on_message_callback = mock_client.start.call_args[0][0]
 
     # Act
-    on_message_callback("fake_message")
+    message = MagicMock(type="#commit", body={"seq": 123, "ops": []})
+    on_message_callback(message)
 
     # Assert
-    mock_parse_subscribe_repos_message.assert_called_once_with("fake_message")
-    mock_process_commit.assert_called_once_with(mock_commit)
-    mock_update_cursor.assert_called_once_with(mock_client, 123)
+    mock_parse_subscribe_repos_message.assert_called_once_with(message)
+    mock_process_commit.assert_called_once_with(
+        mock_commit, mock_writer, DEFAULT_OPTIONS, None
+    )
+    mock_checkpoint.advance.assert_called_once_with(123)
     mock_logger.bind.assert_not_called()  # Should not log warning for valid commit
 
 
-@patch("sinitaivas_live.streamer.cursor.update_cursor")
-@patch("sinitaivas_live.streamer.parser.process_commit")
-@patch("sinitaivas_live.streamer.logger")
-@patch("sinitaivas_live.streamer.parse_subscribe_repos_message")
-def test_start_invalid_commit_logs_warning(
+@patch("sinitaivas_live.parser.process_commit")
+@patch("sinitaivas_live.parser.logger")
+@patch("sinitaivas_live.parser.parse_subscribe_repos_message")
+def test_start_invalid_commit_is_counted_not_logged(
     mock_parse_subscribe_repos_message,
     mock_logger,
     mock_process_commit,
-    mock_update_cursor,
 ):
     # Arrange
     mock_client = MagicMock()
+    mock_checkpoint = MagicMock()
     # Simulate an invalid commit (not instance of Commit or no blocks)
     mock_parse_subscribe_repos_message.return_value = "not_a_commit"
+    dropped = metrics.DROPPED_MESSAGES.labels("#commit", "invalid_commit")
+    dropped_before = dropped.value
 
-    start(mock_client)
+    start(mock_client, MessageHandler(mock_checkpoint, _mock_writer()))
     on_message_callback = mock_client.start.call_args[0][0]
 
     # Act
-    on_message_callback("fake_message")
+    on_message_callback(MagicMock(type="#commit", body={"seq": 5, "ops": []}))
 
     # Assert
-    mock_logger.bind.return_value.warning.assert_called_once()
+    assert dropped.value == dropped_before + 1
+    mock_logger.bind.assert_not_called()
     mock_process_commit.assert_not_called()
-    mock_update_cursor.assert_not_called()
+    mock_checkpoint.advance.assert_not_called()
+
+
+@patch("sinitaivas_live.parser.parse_subscribe_repos_message")
+def test_message_handler_saves_other_messages_without_model(
+    mock_parse_subscribe_repos_message, tmp_path
+):
+    checkpoint = MagicMock()
+    writer = PartitionWriter(str(tmp_path))
+    handler = MessageHandler(checkpoint, writer)
+    dropped = metrics.DROPPED_MESSAGES.labels("#account", "no_seq")
+    dropped_before = dropped.value
+
+    handler(
+        MagicMock(
+            type="#identity",
+            body={"seq": 7, "did": "did:plc:a", "time": "t", "handle": "a.bsky"},
+        )
+    )
+    handler(
+        MagicMock(type="#sync", body={"seq": 8, "did": "did:plc:a", "blocks": b"\x01"})
+    )
+    handler(MagicMock(type="#account", body={"did": "did:plc:a", "active": True}))
+    handler(MagicMock(type="#info", body={"name": "OutdatedCursor"}))
+    writer.close()
+
+    mock_parse_subscribe_repos_message.assert_not_called()
+    assert [c.args[0] for c in checkpoint.advance.call_args_list] == [7, 8]
+    assert dropped.value == dropped_before + 1
+    (identity_path,) = tmp_path.glob("*/_identity/*.ndjson")
+    identity = json.loads(identity_path.read_text())
+    assert identity == {
+        "kind": "identity",
+        "author": "did:plc:a",
+        "seq": 7,
+        "commit_time": "t",
+        "collected_at": identity["collected_at"],
+        "handle": "a.bsky",
+    }
+    (sync_path,) = tmp_path.glob("*/_sync/*.ndjson")
+    assert json.loads(sync_path.read_text())["blocks"] == "AQ=="
+    # the commit partitions stay commit events only
+    assert list(tmp_path.glob("*/*.ndjson")) == []
 
 
 @patch("sinitaivas_live.streamer.logger")
 def test_start_on_callback_error_callback_logs_error(mock_logger):
     mock_client = MagicMock()
-    start(mock_client)
+    start(mock_client, MagicMock())
     # Extract the error callback
     on_callback_error_callback = mock_client.start.call_args[0][1]
     error = Exception("test error")
@@ -170,7 +244,9 @@ def test_start_on_callback_error_callback_logs_error(mock_logger):
     mock_logger.error.assert_called_with(error)
 
 
-@patch("sinitaivas_live.streamer.start_with_retry")
+@patch("sinitaivas_live.streamer.PartitionWriter")
+@patch("sinitaivas_live.streamer.CheckpointManager")
+@patch("sinitaivas_live.streamer.ConnectionSupervisor")
 @patch("sinitaivas_live.streamer.cursor.reset_cursor")
 @patch("sinitaivas_live.streamer.get_fresh_client")
 @patch("sinitaivas_live.streamer.resume_streamer")
@@ -178,27 +254,301 @@ def test_streamer_main_fresh(
     mock_resume_streamer,
     mock_get_fresh_client,
     mock_reset_cursor,
-    mock_start_with_retry,
+    mock_supervisor,
+    mock_checkpoint_manager,
+    mock_partition_writer,
 ):
     mock_get_fresh_client.return_value = MagicMock()
     streamer_main("fresh")
     mock_get_fresh_client.assert_called_once()
     mock_reset_cursor.assert_called_once()
-    mock_start_with_retry.assert_called_once()
+    mock_supervisor.return_value.start.assert_called_once()
+    mock_partition_writer.return_value.record_seq.assert_not_called()
+    # the checkpoint syncs the writer before recording a seq
+    args, _ = mock_checkpoint_manager.call_args
+    assert args[1] == mock_partition_writer.return_value.sync
+    # the last checkpoint is written and the writer closed on shutdown
+    mock_checkpoint_manager.return_value.flush.assert_called_once()
+    mock_partition_writer.return_value.close.assert_called_once()
+
+
+@patch("sinitaivas_live.streamer.PartitionWriter")
+@patch("sinitaivas_live.streamer.CheckpointManager")
+@patch("sinitaivas_live.streamer.ConnectionSupervisor")
+@patch("sinitaivas_live.streamer.resume_streamer")
+def test_streamer_main_writes_to_output_dir(
+    mock_resume_streamer,
+    mock_supervisor,
+    mock_checkpoint_manager,
+    mock_partition_writer,
+    tmp_path,
+):
+    streamer_main("resume", StreamerSettings(output_dir=str(tmp_path)))
+
+    assert mock_partition_writer.call_args.args[0] == f"{tmp_path}/firehose_stream"
+    # a resume without cursor reads the last seq from the same directory
+    assert mock_resume_streamer.call_args.args[-1] == str(tmp_path)
 
 
-@patch("sinitaivas_live.streamer.start_with_retry")
+@patch("sinitaivas_live.streamer.cursor.read_last_seq_from_file")
+@patch("sinitaivas_live.streamer.cursor.read_cursor")
+@patch("sinitaivas_live.streamer.get_fresh_client")
+def test_resume_streamer_reads_last_seq_from_output_dir(
+    mock_get_fresh_client, mock_read_cursor, mock_read_last_seq_from_file
+):
+    mock_read_cursor.return_value = {}
+    mock_read_last_seq_from_file.return_value = 7
+    resume_streamer(output_dir="/data")
+    mock_read_last_seq_from_file.assert_called_once_with("/data/firehose_stream")
+
+
+@patch("sinitaivas_live.streamer.PartitionWriter")
+@patch("sinitaivas_live.streamer.CheckpointManager")
+@patch("sinitaivas_live.streamer.ConnectionSupervisor")
 @patch("sinitaivas_live.streamer.cursor.reset_cursor")
 @patch("sinitaivas_live.streamer.get_fresh_client")
+@patch("sinitaivas_live.streamer.read_resume_cursor", return_value=41)
 @patch("sinitaivas_live.streamer.resume_streamer")
 def test_streamer_main_resume(
     mock_resume_streamer,
+    mock_read_resume_cursor,
     mock_get_fresh_client,
     mock_reset_cursor,
-    mock_start_with_retry,
+    mock_supervisor,
+    mock_checkpoint_manager,
+    mock_partition_writer,
 ):
-    streamer_main("resume")
+    streamer_main("resume", StreamerSettings(stall_timeout_s=30))
     mock_get_fresh_client.assert_not_called()
     mock_reset_cursor.assert_not_called()
     mock_resume_streamer.assert_called_once()
-    mock_start_with_retry.assert_called_once()
+    assert mock_resume_streamer.call_args.kwargs["cursor_position"] == 41
+    # the supervisor reconnects from the same cursor until a frame arrives
+    args, kwargs = mock_supervisor.call_args
+    assert args[0] == mock_resume_streamer.return_value
+    assert args[2] == mock_checkpoint_manager.return_value
+    assert kwargs == {"cursor": 41, "stall_timeout_s": 30}
+    mock_supervisor.return_value.start.assert_called_once()
+    # the messages up to the checkpoint of the previous run are dropped
+    mock_partition_writer.return_value.record_seq.assert_called_once_with(
+        mock_checkpoint_manager.return_value.committed_seq
+    )
+
+
+@patch("sinitaivas_live.streamer.PartitionWriter")
+@patch("sinitaivas_live.streamer.CheckpointManager")
+@patch("sinitaivas_live.streamer.ConnectionSupervisor")
+@patch("sinitaivas_live.streamer.resume_streamer")
+def test_streamer_main_flushes_checkpoint_on_failure(
+    mock_resume_streamer,
+    mock_supervisor,
+    mock_checkpoint_manager,
+    mock_partition_writer,
+):
+    mock_supervisor.return_value.start.side_effect = Exception("relay is gone")
+    streamer_main("resume")
+    mock_checkpoint_manager.return_value.flush.assert_called_once()
+    mock_partition_writer.return_value.close.assert_called_once()
+
+
+def test_install_signal_handlers_stops_client():
+    import signal
+
+    mock_client = MagicMock()
+    previous = _install_signal_handlers(mock_client)
+    try:
+        handler = signal.getsignal(signal.SIGTERM)
+        handler(signal.SIGTERM, None)
+    finally:
+        for signum, previous_handler in previous.items():
+            signal.signal(signum, previous_handler)
+    mock_client.stop.assert_called_once()
+
+
+@patch("sinitaivas_live.streamer.PartitionWriter")
+@patch("sinitaivas_live.streamer.CheckpointManager")
+@patch("sinitaivas_live.streamer.ConnectionSupervisor")
+@patch("sinitaivas_live.streamer.start_async", new_callable=AsyncMock)
+@patch("sinitaivas_live.streamer.cursor.reset_cursor")
+def test_streamer_main_async_engine(
+    mock_reset_cursor,
+    mock_start_async,
+    mock_supervisor,
+    mock_checkpoint_manager,
+    mock_partition_writer,
+):
+    streamer_main("fresh", StreamerSettings(engine="async", queue_size=10))
+    mock_supervisor.assert_not_called()
+    mock_start_async.assert_awaited_once()
+    args, _ = mock_start_async.call_args
+    # the async engine is supervised too
+    assert isinstance(args[0], AsyncConnectionSupervisor)
+    assert isinstance(args[1], MessageHandler)
+    assert args[2] == 10
+    mock_checkpoint_manager.return_value.flush.assert_called_once()
+    mock_partition_writer.return_value.close.assert_called_once()
+
+
+@patch("sinitaivas_live.streamer.AsyncPipeline")
+def test_start_async_runs_pipeline(mock_pipeline):
+    import asyncio
+
+    mock_pipeline.return_value.run = AsyncMock()
+    client = MagicMock()
+    handler = MagicMock()
+    asyncio.run(start_async(client, handler, 10))
+    args, kwargs = mock_pipeline.call_args
+    assert args == (client, handler)
+    assert kwargs["queue_size"] == 10
+    mock_pipeline.return_value.install_signal_handlers.assert_called_once()
+    mock_pipeline.return_value.run.assert_awaited_once()
+
+
+@patch("sinitaivas_live.streamer.MessageHandler")
+@patch("sinitaivas_live.streamer.DecodeWorkers")
+@patch("sinitaivas_live.streamer.PartitionWriter")
+@patch("sinitaivas_live.streamer.CheckpointManager")
+@patch("sinitaivas_live.streamer.ConnectionSupervisor")
+@patch("sinitaivas_live.streamer.cursor.reset_cursor")
+def test_streamer_main_with_workers(
+    mock_reset_cursor,
+    mock_supervisor,
+    mock_checkpoint_manager,
+    mock_partition_writer,
+    mock_decode_workers,
+    mock_message_handler,
+):
+    streamer_main("fresh", StreamerSettings(workers=3))
+    mock_decode_workers.assert_called_once_with(
+        3,
+        mock_checkpoint_manager.return_value,
+        mock_partition_writer.return_value,
+        options=ParseOptions(),
+        sink=None,
+    )
+    mock_message_handler.assert_called_once_with(
+        mock_checkpoint_manager.return_value,
+        mock_partition_writer.return_value,
+        ParseOptions(),
+        mock_decode_workers.return_value,
+        None,
+        None,
+    )
+    mock_supervisor.return_value.start.assert_called_once()
+    # the messages left in the workers are written before the last checkpoint
+    mock_message_handler.return_value.close.assert_called_once()
+    mock_checkpoint_manager.return_value.flush.assert_called_once()
+
+
+@patch("sinitaivas_live.streamer.MessageHandler")
+@patch("sinitaivas_live.streamer.PartitionWriter")
+@patch("sinitaivas_live.streamer.CheckpointManager")
+@patch("sinitaivas_live.streamer.ConnectionSupervisor")
+@patch("sinitaivas_live.streamer.cursor.reset_cursor")
+def test_streamer_main_parse_options_and_filters(
+    mock_reset_cursor,
+    mock_supervisor,
+    mock_checkpoint_manager,
+    mock_partition_writer,
+    mock_message_handler,
+):
+    streamer_main(
+        "fresh",
+        StreamerSettings(
+            json_backend="orjson",
+            record_mode="raw",
+            collections=("app.bsky.feed.post",),
+        ),
+    )
+    args, _ = mock_message_handler.call_args
+    assert args[2] == ParseOptions(record_mode="raw", encode_line=encode_line_orjson)
+    assert isinstance(args[4], OpFilter) and args[4].active
+
+
+def _commit_frame(seq, paths, repo="did:plc:alice"):
+    message = MagicMock()
+    message.type = "#commit"
+    message.body = {
+        "seq": seq,
+        "repo": repo,
+        "ops": [{"action": "create", "path": path} for path in paths],
+    }
+    return message
+
+
+@patch("sinitaivas_live.streamer.handle_message")
+def test_message_handler_skips_filtered_commits(mock_handle_message):
+    checkpoint = MagicMock()
+    handler = MessageHandler(
+        checkpoint,
+        _mock_writer(),
+        op_filter=OpFilter(collections=["app.bsky.feed.post"]),
+    )
+
+    kept = _commit_frame(1, ["app.bsky.feed.post/a", "app.bsky.feed.like/b"])
+    handler(kept)
+    handler(_commit_frame(2, ["app.bsky.feed.like/c"]))
+
+    mock_handle_message.assert_called_once()
+    assert mock_handle_message.call_args.args[0] is kept
+    assert kept.body["ops"] == [{"action": "create", "path": "app.bsky.feed.post/a"}]
+    # the filtered-out commit only moves the cursor
+    checkpoint.advance.assert_called_once_with(2)
+
+
+def test_message_handler_with_workers():
+    workers = MagicMock()
+    handler = MessageHandler(
+        MagicMock(),
+        _mock_writer(),
+        workers=workers,
+        op_filter=OpFilter(exclude_authors=["did:plc:spam"]),
+    )
+    message = _commit_frame(1, ["app.bsky.feed.post/a"])
+
+    handler(message)
+    handler(_commit_frame(2, ["app.bsky.feed.post/b"], repo="did:plc:spam"))
+    handler.close()
+
+    workers.submit.assert_called_once_with(message)
+    # in order with the messages in the workers
+    workers.skip.assert_called_once_with(2)
+    workers.close.assert_called_once()
+
+
+@patch("sinitaivas_live.streamer.handle_message")
+def test_message_handler_counts_messages_and_ops(mock_handle_message):
+    ops = metrics.OPS.labels("app.bsky.feed.post", "create")
+    messages = metrics.MESSAGES.labels("#commit")
+    ops_before, messages_before = ops.value, messages.value
+    message = MagicMock(
+        type="#commit",
+        body={
+            "seq": 5,
+            "time": "2025-06-01T10:00:00Z",
+            "ops": [
+                {"action": "create", "path": "app.bsky.feed.post/1"},
+                {"action": "create", "path": "app.bsky.feed.post/2"},
+            ],
+        },
+    )
+
+    MessageHandler(MagicMock(), _mock_writer())(message)
+
+    assert messages.value == messages_before + 1
+    assert ops.value == ops_before + 2
+
+
+@patch("sinitaivas_live.streamer.handle_message")
+def test_message_handler_drops_messages_already_written(mock_handle_message, tmp_path):
+    writer = PartitionWriter(str(tmp_path))
+    writer.record_seq(5)
+    duplicates = metrics.DROPPED_MESSAGES.labels("#commit", "duplicate")
+    duplicates_before = duplicates.value
+    handler = MessageHandler(MagicMock(), writer)
+
+    for seq in (4, 5, 6):
+        handler(_commit_frame(seq, ["app.bsky.feed.post/a"]))
+
+    assert [c.args[0].body["seq"] for c in mock_handle_message.call_args_list] == [6]
+    assert duplicates.value == duplicates_before + 2
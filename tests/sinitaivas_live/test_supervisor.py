@@ -0,0 +1,230 @@
+import asyncio
+import functools
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from atproto import parse_subscribe_repos_message
+
+import sinitaivas_live.metrics as metrics
+from sinitaivas_live.streamer import (
+    connect_async_client,
+    connect_client,
+    get_fresh_client,
+)
+from sinitaivas_live.supervisor import AsyncConnectionSupervisor, ConnectionSupervisor
+from tests.support.fake_relay import FakeRelay
+
+
+class FakeClient:
+    """Sends #commit frames with the given seqs, then returns or raises."""
+
+    def __init__(self, seqs, error=None):
+        self.seqs = seqs
+        self.error = error
+        self.stopped = False
+
+    def start(self, on_message, on_callback_error=None):
+        for seq in self.seqs:
+            if self.stopped:
+                return
+            on_message(SimpleNamespace(type="#commit", body={"seq": seq}))
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        self.stopped = True
+
+
+class FakeAsyncClient(FakeClient):
+    async def start(self, on_message, on_callback_error=None):
+        for seq in self.seqs:
+            if self.stopped:
+                return
+            await on_message(SimpleNamespace(type="#commit", body={"seq": seq}))
+        if self.error is not None:
+            raise self.error
+
+    async def stop(self):
+        self.stopped = True
+
+
+def _histogram_count(histogram):
+    return sum(histogram.labels().counts)
+
+
+def test_supervisor_reconnects_from_checkpointed_cursor():
+    clients = [
+        FakeClient(range(4, 9), error=Exception("ConsumerTooSlow")),
+        FakeClient(range(7, 20)),
+    ]
+    cursors = []
+
+    def connect(cursor):
+        cursors.append(cursor)
+        return clients.pop(0)
+
+    handled = []
+    checkpoint = MagicMock(committed_seq=None)
+
+    def on_message(message):
+        handled.append(message.body["seq"])
+        # the checkpoint lags behind the frames processed
+        checkpoint.committed_seq = message.body["seq"] - 2
+        if message.body["seq"] == 10:
+            supervisor.stop()
+
+    reconnects = metrics.RECONNECTS.labels().value
+    duplicates = metrics.DROPPED_MESSAGES.labels("#commit", "duplicate").value
+    gaps = _histogram_count(metrics.GAP_SECONDS)
+    # the relay closes the first connection after seq 5
+    supervisor = ConnectionSupervisor(
+        FakeClient(range(1, 6)),
+        connect,
+        checkpoint,
+        stall_timeout_s=0,
+        min_delay_s=0.001,
+    )
+    supervisor.start(on_message)
+
+    # the frames sent again are left to the handler, whose writer drops them
+    assert handled == [1, 2, 3, 4, 5, 4, 5, 6, 7, 8, 7, 8, 9, 10]
+    assert cursors == [3, 6]
+    assert checkpoint.attach.call_count == 3
+    assert metrics.RECONNECTS.labels().value == reconnects + 2
+    assert metrics.DROPPED_MESSAGES.labels("#commit", "duplicate").value == duplicates
+    assert _histogram_count(metrics.GAP_SECONDS) == gaps + 2
+
+
+def test_supervisor_resumes_from_initial_cursor_until_a_checkpoint():
+    cursors = []
+
+    def connect(cursor):
+        cursors.append(cursor)
+        if len(cursors) == 3:
+            supervisor.stop()
+        return FakeClient([], error=Exception("connection refused"))
+
+    supervisor = ConnectionSupervisor(
+        FakeClient([]),
+        connect,
+        MagicMock(committed_seq=None),
+        cursor=41,
+        stall_timeout_s=0,
+        min_delay_s=0.001,
+    )
+    supervisor.start(MagicMock())
+
+    assert cursors == [41, 41, 41]
+
+
+def test_supervisor_delay_is_jittered_and_bounded():
+    supervisor = ConnectionSupervisor(
+        MagicMock(), MagicMock(), MagicMock(), min_delay_s=1.0
+    )
+
+    delays = [supervisor._delay(1) for _ in range(20)]
+    assert all(0.5 <= delay <= 1.0 for delay in delays)
+    assert len(set(delays)) > 1
+    assert all(30.0 <= supervisor._delay(20) <= 60.0 for _ in range(20))
+
+
+def test_supervisor_replaces_stalled_connection():
+    stalls = metrics.STALLS.labels().value
+    checkpoint = MagicMock(committed_seq=None)
+    with FakeRelay(stall_after=20) as relay:
+        seqs = []
+
+        def on_message(message):
+            seqs.append(parse_subscribe_repos_message(message).seq)
+            checkpoint.committed_seq = seqs[-1]
+            if len(seqs) == 50:
+                supervisor.stop()
+
+        supervisor = ConnectionSupervisor(
+            get_fresh_client(base_uri=relay.uri),
+            functools.partial(connect_client, relay.uri),
+            checkpoint,
+            stall_timeout_s=0.3,
+            min_delay_s=0.01,
+        )
+        supervisor.start(on_message)
+
+    # no gap and no duplicate across the stalled connections
+    assert seqs == list(range(1, 51))
+    assert relay.cursors == [None, 20, 40]
+    assert metrics.STALLS.labels().value == stalls + 2
+
+
+def test_supervisor_does_not_replace_connection_while_processing():
+    stalls = metrics.STALLS.labels().value
+
+    def on_message(message):
+        # a slow disk
+        time.sleep(0.5)
+        supervisor.stop()
+
+    supervisor = ConnectionSupervisor(
+        FakeClient([1]), MagicMock(), MagicMock(), stall_timeout_s=0.1
+    )
+    supervisor.start(on_message)
+
+    assert metrics.STALLS.labels().value == stalls
+
+
+def test_async_supervisor_reconnects_from_checkpointed_cursor():
+    clients = [FakeAsyncClient(range(4, 20))]
+    cursors = []
+
+    def connect(cursor):
+        cursors.append(cursor)
+        return clients.pop(0)
+
+    handled = []
+    checkpoint = MagicMock(committed_seq=None)
+
+    async def on_message(message):
+        handled.append(message.body["seq"])
+        checkpoint.committed_seq = message.body["seq"] - 2
+        if message.body["seq"] == 8:
+            await supervisor.stop()
+
+    reconnects = metrics.RECONNECTS.labels().value
+    supervisor = AsyncConnectionSupervisor(
+        FakeAsyncClient(range(1, 6), error=Exception("ConsumerTooSlow")),
+        connect,
+        checkpoint,
+        stall_timeout_s=0,
+        min_delay_s=0.001,
+    )
+    asyncio.run(supervisor.start(on_message))
+
+    assert handled == [1, 2, 3, 4, 5, 4, 5, 6, 7, 8]
+    assert cursors == [3]
+    assert metrics.RECONNECTS.labels().value == reconnects + 1
+
+
+def test_async_supervisor_replaces_stalled_connection():
+    stalls = metrics.STALLS.labels().value
+    checkpoint = MagicMock(committed_seq=None)
+    with FakeRelay(stall_after=20) as relay:
+        seqs = []
+
+        async def on_message(message):
+            seqs.append(parse_subscribe_repos_message(message).seq)
+            checkpoint.committed_seq = seqs[-1]
+            if len(seqs) == 50:
+                await supervisor.stop()
+
+        supervisor = AsyncConnectionSupervisor(
+            get_fresh_client("async", base_uri=relay.uri),
+            functools.partial(connect_async_client, relay.uri),
+            checkpoint,
+            stall_timeout_s=0.3,
+            min_delay_s=0.01,
+        )
+        asyncio.run(supervisor.start(on_message))
+
+    assert seqs == list(range(1, 51))
+    assert relay.cursors == [None, 20, 40]
+    assert metrics.STALLS.labels().value == stalls + 2
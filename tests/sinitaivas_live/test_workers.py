@@ -0,0 +1,194 @@
+import json
+import random
+from unittest.mock import MagicMock
+
+import sinitaivas_live.metrics as metrics
+from sinitaivas_live.parser import process_commit
+from sinitaivas_live.workers import DecodeWorkers, EncodedMessage, encode_chunk
+from sinitaivas_live.writer import PartitionWriter
+from tests.support.synthetic import (
+    decode_frame,
+    encode_frame,
+    make_commit_body,
+    make_commit_frames,
+    make_commits,
+)
+
+
+def _read_events(root):
+    return [
+        json.loads(line)
+        for path in sorted(root.glob("*/*.ndjson"))
+        for line in path.read_text().splitlines()
+    ]
+
+
+def test_encode_chunk_matches_process_commit():
+    frames = make_commit_frames(5, n_ops=3)
+    collected = EncodedMessage()
+    for commit in make_commits(5, n_ops=3):
+        process_commit(commit, collected)
+
+    encoded = encode_chunk([decode_frame(frame) for frame in frames])
+
+    assert [message.seq for message in encoded] == [1, 2, 3, 4, 5]
+    lines = [line for message in encoded for line in message.lines]
+    events = [{**json.loads(line), "collected_at": None} for _, line in lines]
+    expected = [
+        {**json.loads(line), "collected_at": None} for _, line in collected.lines
+    ]
+    assert events == expected
+
+
+def test_encode_chunk_saves_other_messages_and_drops_invalid_ones():
+    identity = decode_frame(
+        encode_frame("#identity", {"seq": 7, "did": "did:plc:x", "time": "t"})
+    )
+    empty = decode_frame(
+        encode_frame(
+            "#commit", {**make_commit_body(8, random.Random(0)), "blocks": b""}
+        )
+    )
+    broken = decode_frame(encode_frame("#commit", {"seq": 9}))
+
+    encoded = encode_chunk([identity, empty, broken])
+
+    assert [message.seq for message in encoded] == [7, None, None]
+    ((partition, line),) = encoded[0].lines
+    assert partition.endswith("/_identity")
+    assert json.loads(line)["kind"] == "identity"
+    assert encoded[1].lines == [] and encoded[1].dropped == (
+        "#commit",
+        "invalid_commit",
+    )
+    # a message that fails to parse is only logged
+    assert encoded[2].lines == [] and encoded[2].dropped is None
+
+
+def test_decode_workers_write_in_seq_order(tmp_path):
+    rng = random.Random(1)
+    frames = [
+        decode_frame(frame)
+        for n in range(40)
+        for frame in make_commit_frames(
+            1, n_ops=rng.randint(1, 6), seed=n, first_seq=n + 1
+        )
+    ]
+    checkpoint = MagicMock()
+    writer = PartitionWriter(str(tmp_path))
+    workers = DecodeWorkers(2, checkpoint, writer, chunk_size=3, max_in_flight=2)
+
+    for frame in frames:
+        workers.submit(frame)
+        assert workers.in_flight <= 2
+    workers.close()
+    writer.close()
+
+    seqs = [event["seq"] for event in _read_events(tmp_path)]
+    assert seqs == sorted(seqs)
+    assert set(seqs) == set(range(1, 41))
+    advanced = [call.args[0] for call in checkpoint.advance.call_args_list]
+    assert advanced == list(range(1, 41))
+
+
+def test_decode_workers_skip_advances_in_order(tmp_path):
+    frames = [decode_frame(frame) for frame in make_commit_frames(4, first_seq=1)]
+    checkpoint = MagicMock()
+    writer = PartitionWriter(str(tmp_path))
+    workers = DecodeWorkers(1, checkpoint, writer, chunk_size=2)
+
+    workers.submit(frames[0])
+    workers.skip(2)
+    workers.submit(frames[2])
+    workers.skip(4)
+    workers.close()
+    writer.close()
+
+    advanced = [call.args[0] for call in checkpoint.advance.call_args_list]
+    assert advanced == [1, 2, 3, 4]
+    assert [event["seq"] for event in _read_events(tmp_path)] == [1, 3]
+
+
+def test_decode_workers_write_other_messages_and_count_drops(tmp_path):
+    commits = [
+        decode_frame(frame)
+        for frame in make_commit_frames(1) + make_commit_frames(1, first_seq=4)
+    ]
+    identity = decode_frame(
+        encode_frame("#identity", {"seq": 2, "did": "did:plc:x", "time": "t"})
+    )
+    empty = decode_frame(
+        encode_frame(
+            "#commit", {**make_commit_body(3, random.Random(0)), "blocks": b""}
+        )
+    )
+    dropped = metrics.DROPPED_MESSAGES.labels("#commit", "invalid_commit")
+    dropped_before = dropped.value
+    checkpoint = MagicMock()
+    writer = PartitionWriter(str(tmp_path))
+    workers = DecodeWorkers(1, checkpoint, writer, chunk_size=2)
+
+    for frame in [commits[0], identity, empty, commits[1]]:
+        workers.submit(frame)
+    workers.close()
+    writer.close()
+
+    advanced = [call.args[0] for call in checkpoint.advance.call_args_list]
+    assert advanced == [1, 2, 4]
+    assert dropped.value == dropped_before + 1
+    assert [event["seq"] for event in _read_events(tmp_path)] == [1, 4]
+    (identity_path,) = tmp_path.glob("*/_identity/*.ndjson")
+    assert json.loads(identity_path.read_text())["seq"] == 2
+
+
+def test_decode_workers_hand_the_events_to_the_sink(tmp_path):
+    frames = [decode_frame(frame) for frame in make_commit_frames(6, n_ops=2)]
+    sink = MagicMock()
+    writer = PartitionWriter(str(tmp_path))
+    workers = DecodeWorkers(2, MagicMock(), writer, chunk_size=2, sink=sink)
+
+    for frame in frames:
+        workers.submit(frame)
+    workers.close()
+    writer.close()
+
+    events = [call.args[1] for call in sink.write_event.call_args_list]
+    assert [event["seq"] for event in events] == [
+        event["seq"] for event in _read_events(tmp_path)
+    ]
+    assert {event["seq"] for event in events} == set(range(1, 7))
+
+
+def test_decode_workers_send_back_the_stage_timings(tmp_path):
+    frames = [decode_frame(frame) for frame in make_commit_frames(5, n_ops=2)]
+    parse = metrics.PARSE_SECONDS
+    parsed_before = sum(parse.counts)
+    writer = PartitionWriter(str(tmp_path))
+    workers = DecodeWorkers(1, MagicMock(), writer, chunk_size=2)
+
+    for frame in frames:
+        workers.submit(frame)
+    workers.close()
+    writer.close()
+
+    assert sum(parse.counts) == parsed_before + 5
+
+
+def test_decode_workers_drop_messages_sent_again_while_in_flight(tmp_path):
+    frames = [decode_frame(frame) for frame in make_commit_frames(6, first_seq=1)]
+    duplicates = metrics.DROPPED_MESSAGES.labels("#commit", "duplicate")
+    duplicates_before = duplicates.value
+    checkpoint = MagicMock()
+    writer = PartitionWriter(str(tmp_path))
+    workers = DecodeWorkers(1, checkpoint, writer, chunk_size=4, max_in_flight=4)
+
+    # a reconnect sends 3 to 6 again before the first ones are written
+    for frame in frames + frames[2:]:
+        workers.submit(frame)
+    workers.close()
+    writer.close()
+
+    assert [event["seq"] for event in _read_events(tmp_path)] == list(range(1, 7))
+    assert duplicates.value == duplicates_before + 4
+    advanced = [call.args[0] for call in checkpoint.advance.call_args_list]
+    assert advanced == list(range(1, 7))
@@ -0,0 +1,258 @@
+import gzip
+import os
+from unittest.mock import patch
+
+import zstandard
+
+from sinitaivas_live.writer import PartitionWriter, shard_partition
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_write_appends_lines_to_partition_file(tmp_path):
+    writer = PartitionWriter(str(tmp_path))
+    writer.write("2025-06-01T10", b'{"seq": 1}\n')
+    writer.write("2025-06-01T10", b'{"seq": 2}\n')
+    assert writer.current_path == str(tmp_path / "2025-06-01/2025-06-01T10.ndjson")
+    writer.close()
+    content = (tmp_path / "2025-06-01" / "2025-06-01T10.ndjson").read_bytes()
+    assert content == b'{"seq": 1}\n{"seq": 2}\n'
+    assert writer.current_path is None
+
+
+def test_write_rotates_once_per_partition(tmp_path):
+    writer = PartitionWriter(str(tmp_path))
+    with patch("sinitaivas_live.writer.fs.create_dir_if_not_exists") as mock_mkdir:
+        mock_mkdir.side_effect = lambda prefix: os.makedirs(prefix, exist_ok=True)
+        for _ in range(5):
+            writer.write("2025-06-01T23", b"a\n")
+        for _ in range(5):
+            writer.write("2025-06-02T00", b"b\n")
+    writer.close()
+    assert mock_mkdir.call_count == 2
+    assert (tmp_path / "2025-06-01/2025-06-01T23.ndjson").read_bytes() == b"a\n" * 5
+    assert (tmp_path / "2025-06-02/2025-06-02T00.ndjson").read_bytes() == b"b\n" * 5
+
+
+def test_write_buffers_until_flush_interval(tmp_path):
+    clock = FakeClock()
+    writer = PartitionWriter(str(tmp_path), flush_interval_ms=1000, clock=clock)
+    path = tmp_path / "2025-06-01" / "2025-06-01T10.ndjson"
+    writer.write("2025-06-01T10", b"first\n")
+    assert path.read_bytes() == b""
+    clock.now = 1.5
+    writer.write("2025-06-01T10", b"second\n")
+    assert path.read_bytes() == b"first\nsecond\n"
+    writer.close()
+
+
+def test_sync_flushes_and_fsyncs(tmp_path):
+    writer = PartitionWriter(str(tmp_path), clock=FakeClock())
+    writer.write("2025-06-01T10", b"line\n")
+    with patch("sinitaivas_live.writer.os.fsync") as mock_fsync:
+        writer.sync()
+    mock_fsync.assert_called_once()
+    assert (tmp_path / "2025-06-01/2025-06-01T10.ndjson").read_bytes() == b"line\n"
+    writer.close()
+
+
+def test_sync_and_close_without_partition_are_no_ops(tmp_path):
+    writer = PartitionWriter(str(tmp_path))
+    writer.sync()
+    writer.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_reopening_appends_to_existing_partition(tmp_path):
+    for line in (b"before restart\n", b"after restart\n"):
+        writer = PartitionWriter(str(tmp_path))
+        writer.write("2025-06-01T10", line)
+        writer.close()
+    content = (tmp_path / "2025-06-01/2025-06-01T10.ndjson").read_bytes()
+    assert content == b"before restart\nafter restart\n"
+
+
+def _read_gzip(path):
+    return gzip.decompress(path.read_bytes())
+
+
+def test_compressed_partition_is_finalized_at_rotation(tmp_path):
+    writer = PartitionWriter(str(tmp_path), compression="gzip")
+    writer.write("2025-06-01T10", b"a\n")
+    part = tmp_path / "2025-06-01/2025-06-01T10.ndjson.gz.part"
+    assert writer.current_path == str(part)
+    writer.write("2025-06-01T11", b"b\n")
+    writer.close()
+
+    assert not list(tmp_path.glob("*/*.part"))
+    assert _read_gzip(tmp_path / "2025-06-01/2025-06-01T10.ndjson.gz") == b"a\n"
+    assert _read_gzip(tmp_path / "2025-06-01/2025-06-01T11.ndjson.gz") == b"b\n"
+
+
+def test_compressed_partition_is_readable_up_to_each_sync(tmp_path):
+    writer = PartitionWriter(str(tmp_path), compression="zstd", clock=FakeClock())
+    writer.write("2025-06-01T10", b"one\n")
+    writer.sync()
+    writer.write("2025-06-01T10", b"two\n")
+    writer.sync()
+    part = tmp_path / "2025-06-01/2025-06-01T10.ndjson.zst.part"
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        part.read_bytes(), read_across_frames=True
+    )
+    assert reader.read() == b"one\ntwo\n"
+    writer.close()
+
+
+def test_reopening_appends_to_finalized_compressed_partition(tmp_path):
+    for line in (b"before restart\n", b"after restart\n"):
+        writer = PartitionWriter(str(tmp_path), compression="gzip")
+        writer.write("2025-06-01T10", line)
+        writer.close()
+    content = _read_gzip(tmp_path / "2025-06-01/2025-06-01T10.ndjson.gz")
+    assert content == b"before restart\nafter restart\n"
+
+
+def test_recover_cuts_and_finalizes_partitions_left_in_progress(tmp_path):
+    clock = FakeClock()
+    writer = PartitionWriter(
+        str(tmp_path), flush_interval_ms=0, compression="gzip", clock=clock
+    )
+    writer.write("2025-06-01T10", b"synced\n")
+    writer.sync()
+    writer.write("2025-06-01T10", b"not synced\n")
+    # the process dies here: the file is left with an unfinished member
+    part = tmp_path / "2025-06-01/2025-06-01T10.ndjson.gz.part"
+    assert part.stat().st_size > 0
+
+    PartitionWriter(str(tmp_path), compression="gzip").recover()
+
+    assert not part.exists()
+    assert _read_gzip(tmp_path / "2025-06-01/2025-06-01T10.ndjson.gz") == b"synced\n"
+
+
+def test_partial_line_is_cut_before_appending(tmp_path):
+    path = tmp_path / "2025-06-01/2025-06-01T10.ndjson"
+    path.parent.mkdir()
+    # a crash in the middle of a flush
+    path.write_bytes(b'{"seq": 1}\n{"seq": 2, "au')
+
+    writer = PartitionWriter(str(tmp_path))
+    writer.write("2025-06-01T10", b'{"seq": 3}\n')
+    writer.close()
+
+    assert path.read_bytes() == b'{"seq": 1}\n{"seq": 3}\n'
+
+
+def test_recover_cuts_uncompressed_partitions_to_the_last_line(tmp_path):
+    path = tmp_path / "2025-06-01/app.bsky.feed.like/2025-06-01T10.ndjson"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b'{"seq": 1}\n{"seq": 2, "au')
+
+    PartitionWriter(str(tmp_path)).recover()
+
+    assert path.read_bytes() == b'{"seq": 1}\n'
+
+
+def test_shard_partition():
+    assert shard_partition("2025-06-01T10", "app.bsky.feed.post") == (
+        "2025-06-01T10/app.bsky.feed.post"
+    )
+    assert shard_partition("2025-06-01T10", "../../etc") == "2025-06-01T10/_other"
+    assert shard_partition("2025-06-01T10", None) == "2025-06-01T10/_other"
+
+
+def test_shards_are_written_to_collection_directories(tmp_path):
+    writer = PartitionWriter(str(tmp_path), max_open_files=2)
+    for n in range(3):
+        for collection in ("app.bsky.feed.post", "app.bsky.feed.like", "x.y.z"):
+            writer.write(f"2025-06-01T10/{collection}", b"%s %d\n" % (b"e", n))
+    # the least recently written shard was closed to open another
+    assert len(writer._files) == 2
+    writer.write("2025-06-01T11/app.bsky.feed.post", b"next hour\n")
+    assert len(writer._files) == 1
+    writer.close()
+
+    for collection in ("app.bsky.feed.post", "app.bsky.feed.like", "x.y.z"):
+        path = tmp_path / "2025-06-01" / collection / "2025-06-01T10.ndjson"
+        assert path.read_bytes() == b"e 0\ne 1\ne 2\n"
+    post = tmp_path / "2025-06-01/app.bsky.feed.post/2025-06-01T11.ndjson"
+    assert post.read_bytes() == b"next hour\n"
+
+
+def test_compressed_shards_are_finalized_at_the_end_of_the_hour(tmp_path):
+    writer = PartitionWriter(str(tmp_path), compression="gzip", max_open_files=1)
+    for line in (b"a\n", b"b\n", b"c\n"):
+        writer.write("2025-06-01T10/app.bsky.feed.post", line)
+        writer.write("2025-06-01T10/app.bsky.feed.like", line)
+    # evicted shards stay in progress until the hour is over
+    assert len(list(tmp_path.glob("*/*/*.part"))) == 2
+    writer.write("2025-06-01T11/app.bsky.feed.post", b"d\n")
+
+    assert len(list(tmp_path.glob("*/*/*.part"))) == 1
+    for collection in ("app.bsky.feed.post", "app.bsky.feed.like"):
+        path = tmp_path / "2025-06-01" / collection / "2025-06-01T10.ndjson.gz"
+        assert _read_gzip(path) == b"a\nb\nc\n"
+    writer.close()
+
+
+def _event(seq):
+    return b'{"seq": %d, "commit_time": "2025-06-01T10:00:%02d"}\n' % (seq, seq)
+
+
+def test_index_maps_seqs_to_line_offsets(tmp_path):
+    writer = PartitionWriter(str(tmp_path), index_every_bytes=2 * len(_event(0)))
+    for seq in range(10):
+        writer.write("2025-06-01T10", _event(seq))
+    writer.close()
+
+    path = tmp_path / "2025-06-01/2025-06-01T10.ndjson"
+    content = path.read_bytes()
+    index = (tmp_path / "2025-06-01/2025-06-01T10.ndjson.idx").read_text()
+    entries = [line.split("\t") for line in index.splitlines()]
+    assert [int(seq) for seq, _, _ in entries] == [0, 2, 4, 6, 8]
+    for seq, commit_time, offset in entries:
+        assert content[int(offset) :].startswith(b'{"seq": %s, ' % seq.encode())
+        assert commit_time == f"2025-06-01T10:00:{int(seq):02d}"
+
+
+def test_index_offsets_start_compressed_members(tmp_path):
+    writer = PartitionWriter(
+        str(tmp_path), compression="zstd", index_every_bytes=2 * len(_event(0))
+    )
+    for seq in range(10):
+        writer.write("2025-06-01T10", _event(seq))
+    writer.close()
+
+    content = (tmp_path / "2025-06-01/2025-06-01T10.ndjson.zst").read_bytes()
+    index = (tmp_path / "2025-06-01/2025-06-01T10.ndjson.zst.idx").read_text()
+    offsets = [int(line.split("\t")[2]) for line in index.splitlines()]
+    assert len(offsets) == 5
+    decompressor = zstandard.ZstdDecompressor()
+    for seq, offset in zip(range(0, 10, 2), offsets):
+        reader = decompressor.stream_reader(content[offset:], read_across_frames=True)
+        assert reader.read().startswith(_event(seq))
+
+
+def test_index_can_be_disabled(tmp_path):
+    writer = PartitionWriter(str(tmp_path), index_every_bytes=0)
+    writer.write("2025-06-01T10", _event(1))
+    writer.close()
+    assert not (tmp_path / "2025-06-01/2025-06-01T10.ndjson.idx").exists()
+
+
+def test_record_seq_keeps_the_highest_seq_written(tmp_path):
+    writer = PartitionWriter(str(tmp_path))
+    assert writer.last_seq is None and not writer.is_written(1)
+
+    writer.record_seq(7)
+    writer.record_seq(5)
+
+    assert writer.last_seq == 7
+    assert writer.is_written(7) and writer.is_written(3)
+    assert not writer.is_written(8)
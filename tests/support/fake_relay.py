@@ -0,0 +1,185 @@
+"""A local relay serving synthetic subscribeRepos frames, for end-to-end and
+load tests without network.
+
+It speaks `com.atproto.sync.subscribeRepos` over a plain websocket: each
+connection receives #commit frames (see `synthetic.make_commit_body`) with
+consecutive seqs, from `cursor + 1` when the `cursor` param is set, else from
+the head of the stream. The frame of a seq is the same on every connection,
+so a resumed stream can be compared with the one it continues. Point the
+streamer at `relay.uri` (`--relay-uri` or the `base_uri` of
+`get_fresh_client`) to run it against the relay:
+
+    python -m tests.support.fake_relay --port 8765 --rate 2000
+    python -m sinitaivas_live.main --mode fresh \
+        --relay-uri ws://127.0.0.1:8765/xrpc --metrics-port 9464
+"""
+
+import argparse
+import random
+import threading
+import time
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from websockets.exceptions import ConnectionClosed
+from websockets.frames import CloseCode
+from websockets.sync.server import Server, ServerConnection, serve
+
+from tests.support.synthetic import encode_frame, make_commit_body
+
+SUBSCRIBE_REPOS_PATH = "/xrpc/com.atproto.sync.subscribeRepos"
+
+
+class FakeRelay:
+    """A websocket server sending synthetic #commit frames, from a thread.
+
+    Parameters:
+        rate (float | None): Frames per second sent on each connection, None
+            to send them as fast as the client reads them.
+        seed (int): Seed of the synthetic commits.
+        first_seq (int): Seq of the first frame of the stream.
+        max_ops (int): Maximum ops of a commit; 90% of them have one.
+        drop_after (int | None): Drop each connection with an error after
+            this many frames, so that the client reconnects.
+        stall_after (int | None): Stop sending on each connection after this
+            many frames, keeping it open.
+        host (str): The address to listen on.
+        port (int): The port to listen on, 0 for any free port.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        seed: int = 0,
+        first_seq: int = 1,
+        max_ops: int = 8,
+        drop_after: Optional[int] = None,
+        stall_after: Optional[int] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.rate = rate
+        self.seed = seed
+        self.max_ops = max_ops
+        self.drop_after = drop_after
+        self.stall_after = stall_after
+        # seq of the next frame of a connection without cursor
+        self.head_seq = first_seq
+        self.frames_sent = 0
+        self.connections = 0
+        # cursor param of each connection, None without one
+        self.cursors: list[Optional[int]] = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._server: Server = serve(
+            self._handle, host, port, compression=None, max_size=None
+        )
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-relay", daemon=True
+        )
+
+    @property
+    def port(self) -> int:
+        """The port the relay listens on."""
+        port: int = self._server.socket.getsockname()[1]
+        return port
+
+    @property
+    def uri(self) -> str:
+        """The base URI of the relay, as given to the firehose client."""
+        host = self._server.socket.getsockname()[0]
+        return f"ws://{host}:{self.port}/xrpc"
+
+    def frame(self, seq: int) -> bytes:
+        """The #commit frame of a seq, the same for every call."""
+        rng = random.Random(self.seed * 1_000_003 + seq)
+        n_ops = 1 if rng.random() < 0.9 else rng.randint(2, self.max_ops)
+        return encode_frame("#commit", make_commit_body(seq, rng, n_ops))
+
+    def start(self) -> "FakeRelay":
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        """Stop the relay; open connections are closed with 1001 (going away),
+        which stops the firehose client."""
+        self._stopped.set()
+        self._server.shutdown()
+        self._thread.join()
+
+    def __enter__(self) -> "FakeRelay":
+        return self.start()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def _handle(self, connection: ServerConnection) -> None:
+        request = connection.request
+        if request is None or urlparse(request.path).path != SUBSCRIBE_REPOS_PATH:
+            connection.close(CloseCode.POLICY_VIOLATION, "unknown method")
+            return
+        cursor = parse_qs(urlparse(request.path).query).get("cursor")
+        with self._lock:
+            self.connections += 1
+            self.cursors.append(int(cursor[0]) if cursor else None)
+            seq = int(cursor[0]) + 1 if cursor else self.head_seq
+
+        sent = 0
+        started_at = time.monotonic()
+        try:
+            while not self._stopped.is_set():
+                if self.drop_after is not None and sent >= self.drop_after:
+                    connection.close(CloseCode.INTERNAL_ERROR, "dropped")
+                    return
+                if self.stall_after is not None and sent >= self.stall_after:
+                    self._stopped.wait()
+                    return
+                if self.rate:
+                    wait = started_at + sent / self.rate - time.monotonic()
+                    if wait > 0 and self._stopped.wait(wait):
+                        return
+                connection.send(self.frame(seq))
+                sent += 1
+                seq += 1
+                with self._lock:
+                    self.frames_sent += 1
+                    self.head_seq = max(self.head_seq, seq)
+        except ConnectionClosed:
+            return
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--host", default="127.0.0.1")
+    args.add_argument("--port", type=int, default=8765)
+    args.add_argument("--rate", type=float, default=None, help="frames/s")
+    args.add_argument("--seed", type=int, default=0)
+    args.add_argument("--max-ops", type=int, default=8)
+    args.add_argument("--drop-after", type=int, default=None)
+    args.add_argument("--stall-after", type=int, default=None)
+    options = args.parse_args()
+
+    relay = FakeRelay(
+        rate=options.rate,
+        seed=options.seed,
+        max_ops=options.max_ops,
+        drop_after=options.drop_after,
+        stall_after=options.stall_after,
+        host=options.host,
+        port=options.port,
+    ).start()
+    print(f"Serving synthetic commits at {relay.uri}")
+    try:
+        while True:
+            frames_sent = relay.frames_sent
+            time.sleep(10)
+            print(
+                f"head_seq={relay.head_seq} connections={relay.connections} "
+                f"frames/s={(relay.frames_sent - frames_sent) / 10:.0f}"
+            )
+    except KeyboardInterrupt:
+        relay.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Synthetic subscribeRepos messages for tests and benchmarks.
+
+Commits are built the way a relay sends them: the records are DAG-CBOR
+encoded into a CAR archive, and the whole message is encoded as a websocket
+frame (header + body), so they go through the same decoding as live data.
+"""
+
+import hashlib
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterator, Optional
+
+import libipld
+from atproto import firehose_models, models, parse_subscribe_repos_message
+
+# (collection, weight) roughly following the mix seen on the firehose
+COLLECTION_MIX: list[tuple[str, int]] = [
+    ("app.bsky.feed.like", 50),
+    ("app.bsky.graph.follow", 15),
+    ("app.bsky.feed.post", 15),
+    ("app.bsky.feed.repost", 10),
+    ("app.bsky.graph.block", 3),
+    ("app.bsky.actor.profile", 2),
+    ("app.bsky.graph.listitem", 2),
+    ("app.bsky.feed.threadgate", 1),
+    ("com.example.unknown.record", 1),
+]
+
+_DAG_CBOR = 0x71
+_RAW = 0x55
+_SHA2_256 = 0x12
+
+_WORDS = (
+    "bluesky firehose sky post reply like follow data stream hello world "
+    "research open social network protocol decentralized moi kiitos"
+).split()
+
+
+def make_cid(data: bytes, codec: int = _DAG_CBOR) -> bytes:
+    """Binary CIDv1 (sha2-256) of the given content."""
+    return bytes([1, codec, _SHA2_256, 32]) + hashlib.sha256(data).digest()
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def encode_car(root: bytes, blocks: list[tuple[bytes, bytes]]) -> bytes:
+    """Encode a CARv1 archive from a root CID and (cid, data) blocks."""
+    header = libipld.encode_dag_cbor({"version": 1, "roots": [root]})
+    parts = [_varint(len(header)), header]
+    for cid, data in blocks:
+        parts.append(_varint(len(cid) + len(data)))
+        parts.append(cid)
+        parts.append(data)
+    return b"".join(parts)
+
+
+def _did(rng: random.Random) -> str:
+    return "did:plc:" + "".join(rng.choices("abcdefghijklmnopqrstuvwxyz234567", k=24))
+
+
+def _rkey(rng: random.Random) -> str:
+    return "3l" + "".join(rng.choices("abcdefghijklmnopqrstuvwxyz234567", k=11))
+
+
+def _text(rng: random.Random, min_words: int, max_words: int) -> str:
+    return " ".join(rng.choices(_WORDS, k=rng.randint(min_words, max_words)))
+
+
+def _created_at(rng: random.Random) -> str:
+    moment = datetime(2025, 6, 1, tzinfo=timezone.utc) + timedelta(
+        seconds=rng.randint(0, 86400)
+    )
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _strong_ref(rng: random.Random, collection: str) -> dict[str, Any]:
+    return {
+        "uri": f"at://{_did(rng)}/{collection}/{_rkey(rng)}",
+        "cid": libipld.encode_cid(make_cid(rng.randbytes(16))),
+    }
+
+
+def _blob(rng: random.Random, mime_type: str) -> dict[str, Any]:
+    return {
+        "$type": "blob",
+        "ref": make_cid(rng.randbytes(16), codec=_RAW),
+        "mimeType": mime_type,
+        "size": rng.randint(10_000, 900_000),
+    }
+
+
+def make_record(collection: str, rng: random.Random) -> dict[str, Any]:
+    """A plausible record of the given collection."""
+    record: dict[str, Any] = {"$type": collection, "createdAt": _created_at(rng)}
+    if collection == "app.bsky.feed.post":
+        record["text"] = _text(rng, 3, 40)
+        record["langs"] = [rng.choice(["en", "fi", "ja", "pt", "de"])]
+        if rng.random() < 0.3:
+            record["reply"] = {
+                "root": _strong_ref(rng, "app.bsky.feed.post"),
+                "parent": _strong_ref(rng, "app.bsky.feed.post"),
+            }
+        if rng.random() < 0.2:
+            record["embed"] = {
+                "$type": "app.bsky.embed.images",
+                "images": [
+                    {"alt": _text(rng, 0, 5), "image": _blob(rng, "image/jpeg")}
+                    for _ in range(rng.randint(1, 4))
+                ],
+            }
+        # extended records: fields that are not in the lexicon
+        if rng.random() < 0.1:
+            record["via"] = "sinitaivas"
+        if rng.random() < 0.05:
+            record["tag"] = rng.randbytes(4)
+    elif collection in ("app.bsky.feed.like", "app.bsky.feed.repost"):
+        record["subject"] = _strong_ref(rng, "app.bsky.feed.post")
+    elif collection in ("app.bsky.graph.follow", "app.bsky.graph.block"):
+        record["subject"] = _did(rng)
+    elif collection == "app.bsky.graph.listitem":
+        record["subject"] = _did(rng)
+        record["list"] = f"at://{_did(rng)}/app.bsky.graph.list/{_rkey(rng)}"
+    elif collection == "app.bsky.actor.profile":
+        del record["createdAt"]
+        record["displayName"] = _text(rng, 1, 3)
+        record["description"] = _text(rng, 5, 30)
+        record["avatar"] = _blob(rng, "image/png")
+    elif collection == "app.bsky.feed.threadgate":
+        record["post"] = f"at://{_did(rng)}/app.bsky.feed.post/{_rkey(rng)}"
+        record["allow"] = [{"$type": "app.bsky.feed.threadgate#followingRule"}]
+    else:
+        record["payload"] = rng.randbytes(rng.randint(4, 32))
+        record["note"] = _text(rng, 1, 8)
+    return record
+
+
+def _commit_time(seq: int) -> str:
+    moment = datetime(2025, 6, 1, tzinfo=timezone.utc) + timedelta(milliseconds=seq)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def make_commit_body(
+    seq: int,
+    rng: random.Random,
+    n_ops: int = 1,
+    collections: Optional[list[str]] = None,
+    delete_ratio: float = 0.05,
+) -> dict[str, Any]:
+    """The decoded body of a #commit message with `n_ops` ops."""
+    repo = _did(rng)
+    ops: list[dict[str, Any]] = []
+    blocks: list[tuple[bytes, bytes]] = []
+    names = [name for name, _ in COLLECTION_MIX]
+    weights = [weight for _, weight in COLLECTION_MIX]
+    for _ in range(n_ops):
+        collection = (
+            rng.choice(collections)
+            if collections
+            else rng.choices(names, weights=weights)[0]
+        )
+        path = f"{collection}/{_rkey(rng)}"
+        if rng.random() < delete_ratio:
+            ops.append({"action": "delete", "path": path, "cid": None})
+            continue
+        data = libipld.encode_dag_cbor(make_record(collection, rng))
+        cid = make_cid(data)
+        blocks.append((cid, data))
+        ops.append({"action": "create", "path": path, "cid": cid})
+
+    commit_data = libipld.encode_dag_cbor(
+        {"did": repo, "version": 3, "rev": _rkey(rng), "data": make_cid(b"mst")}
+    )
+    commit_cid = make_cid(commit_data)
+    blocks.insert(0, (commit_cid, commit_data))
+    return {
+        "seq": seq,
+        "repo": repo,
+        "rev": _rkey(rng),
+        "since": _rkey(rng),
+        "time": _commit_time(seq),
+        "commit": commit_cid,
+        "ops": ops,
+        "blocks": encode_car(commit_cid, blocks),
+        "blobs": [],
+        "rebase": False,
+        "tooBig": False,
+    }
+
+
+def encode_frame(message_type: str, body: dict[str, Any]) -> bytes:
+    """Encode a message body as a websocket frame of subscribeRepos."""
+    return libipld.encode_dag_cbor({"op": 1, "t": message_type}) + (
+        libipld.encode_dag_cbor(body)
+    )
+
+
+def decode_frame(frame: bytes) -> firehose_models.MessageFrame:
+    """Decode a websocket frame, as the firehose client does."""
+    return firehose_models.Frame.from_bytes(frame)  # type: ignore[return-value]
+
+
+def make_commit_frames(
+    count: int,
+    n_ops: int = 1,
+    seed: int = 0,
+    first_seq: int = 1,
+    collections: Optional[list[str]] = None,
+) -> list[bytes]:
+    """Encoded #commit frames with consecutive seqs."""
+    rng = random.Random(seed)
+    return [
+        encode_frame(
+            "#commit",
+            make_commit_body(first_seq + i, rng, n_ops, collections=collections),
+        )
+        for i in range(count)
+    ]
+
+
+def make_commits(
+    count: int,
+    n_ops: int = 1,
+    seed: int = 0,
+    first_seq: int = 1,
+    collections: Optional[list[str]] = None,
+) -> list[models.ComAtprotoSyncSubscribeRepos.Commit]:
+    """Parsed Commit models with consecutive seqs."""
+    return [
+        parse_subscribe_repos_message(decode_frame(frame))
+        for frame in make_commit_frames(count, n_ops, seed, first_seq, collections)
+    ]
+
+
+def iter_commit_frames(
+    seed: int = 0, first_seq: int = 1, max_ops: int = 8
+) -> Iterator[bytes]:
+    """An endless stream of #commit frames with a realistic number of ops."""
+    rng = random.Random(seed)
+    seq = first_seq
+    while True:
+        n_ops = 1 if rng.random() < 0.9 else rng.randint(2, max_ops)
+        yield encode_frame("#commit", make_commit_body(seq, rng, n_ops))
+        seq += 1
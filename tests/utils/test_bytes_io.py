@@ -1,4 +1,16 @@
-from utils.bytes_io import convert_bytes_to_str
+import json
+
+import libipld
+import pytest
+from atproto import CID
+
+from utils.bytes_io import (
+    convert_bytes_to_str,
+    convert_ipld_to_json,
+    is_cid,
+    json_default,
+)
+from tests.support.synthetic import make_cid
 
 
 class DummyLogger:
@@ -59,3 +71,74 @@ def test_convert_bytes_to_str_nested():
         "azE=": ["djE=", {"azI=": "djI="}],
         "plain": 123,
     }
+
+
+def test_is_cid():
+    assert is_cid(make_cid(b"record"))
+    assert not is_cid(b"\x01\x02\x03")
+    assert not is_cid(b"abc")
+
+
+def test_convert_ipld_to_json():
+    cid = make_cid(b"image", codec=0x55)
+    record = libipld.decode_dag_cbor(
+        libipld.encode_dag_cbor(
+            {
+                "image": {"ref": cid, "size": 3},
+                "tags": [b"abc", "text", 1],
+                "nested": {"empty": None},
+            }
+        )
+    )
+
+    assert convert_ipld_to_json(record) == {
+        "image": {"ref": libipld.encode_cid(cid), "size": 3},
+        "tags": ["YWJj", "text", 1],
+        "nested": {"empty": None},
+    }
+
+
+def test_convert_bytes_to_str_returns_object_without_bytes_as_is():
+    data = {"text": "hello", "nested": {"tags": ["a", 1]}, "other": [{"x": None}]}
+    assert convert_bytes_to_str(data) is data
+
+
+def test_convert_bytes_to_str_copies_only_containers_with_bytes():
+    data = {"plain": {"tags": ["a"]}, "blob": {"ref": b"abc"}}
+    result = convert_bytes_to_str(data)
+
+    assert result == {"plain": {"tags": ["a"]}, "blob": {"ref": "YWJj"}}
+    assert result["plain"] is data["plain"]
+    assert data["blob"]["ref"] == b"abc"
+
+
+def test_convert_bytes_to_str_deep_nesting():
+    data = inner = []
+    for _ in range(10_000):
+        inner.append([])
+        inner = inner[0]
+    inner.append(b"abc")
+
+    result = convert_bytes_to_str(data)
+
+    for _ in range(10_000):
+        result = result[0]
+    assert result == ["YWJj"]
+
+
+def test_convert_bytes_to_str_cid_object():
+    cid = CID.decode(libipld.encode_cid(make_cid(b"record")))
+    assert convert_bytes_to_str({"cid": cid}) == {"cid": str(cid)}
+
+
+def test_json_default():
+    cid = CID.decode(libipld.encode_cid(make_cid(b"record")))
+    data = {"tag": b"\xff\xfe", "refs": [cid], "text": "moi"}
+
+    assert json.loads(json.dumps(data, default=json_default)) == {
+        "tag": "//4=",
+        "refs": [str(cid)],
+        "text": "moi",
+    }
+    with pytest.raises(TypeError):
+        json.dumps({"value": object()}, default=json_default)
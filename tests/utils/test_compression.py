@@ -0,0 +1,96 @@
+import gzip
+from unittest.mock import patch
+
+import pytest
+import zstandard
+
+import utils.compression as compression
+from utils.compression import (
+    compression_of,
+    complete_length,
+    get_compressor,
+    read_tail,
+    truncate_to_complete,
+)
+
+
+def _decompress(data, kind):
+    if kind == "gzip":
+        return gzip.decompress(data)
+    reader = zstandard.ZstdDecompressor().stream_reader(data, read_across_frames=True)
+    return reader.read()
+
+
+@pytest.mark.parametrize("kind", ["gzip", "zstd"])
+def test_members_concatenate_to_a_valid_archive(kind):
+    compressor = get_compressor(kind, level=1)
+    data = compressor.compress(b"first\n") + compressor.flush()
+    data += compressor.compress(b"second\n") + compressor.end_member()
+    assert compressor.end_member() == b""
+    data += compressor.compress(b"third\n") + compressor.end_member()
+    assert _decompress(data, kind) == b"first\nsecond\nthird\n"
+
+
+@pytest.mark.parametrize("kind", ["gzip", "zstd"])
+def test_truncate_to_complete_drops_the_unfinished_member(tmp_path, kind):
+    compressor = get_compressor(kind)
+    complete = compressor.compress(b"synced\n") + compressor.end_member()
+    unfinished = compressor.compress(b"lost\n" * 100) + compressor.flush()
+    path = tmp_path / "part"
+    path.write_bytes(complete + unfinished)
+
+    assert complete_length(str(path), kind) == len(complete)
+    assert truncate_to_complete(str(path), kind) == len(unfinished)
+    assert _decompress(path.read_bytes(), kind) == b"synced\n"
+    assert truncate_to_complete(str(path), kind) == 0
+
+
+def test_truncate_to_complete_drops_the_unfinished_line(tmp_path):
+    path = tmp_path / "partition.ndjson"
+    path.write_bytes(b'{"seq": 1}\n{"seq": 2, "au')
+    assert truncate_to_complete(str(path), "none") == len(b'{"seq": 2, "au')
+    assert path.read_bytes() == b'{"seq": 1}\n'
+    assert truncate_to_complete(str(path), "none") == 0
+
+    path.write_bytes(b"no newline")
+    assert complete_length(str(path), "none") == 0
+
+
+def test_complete_length_stops_at_corrupt_data(tmp_path):
+    compressor = get_compressor("gzip")
+    complete = compressor.compress(b"synced\n") + compressor.end_member()
+    path = tmp_path / "part"
+    path.write_bytes(complete + b"\x1f\x8b\x08garbage" + complete)
+    assert complete_length(str(path), "gzip") == len(complete)
+
+
+def test_get_compressor():
+    assert get_compressor("none") is None
+    with patch.object(compression, "zstandard", None):
+        with pytest.raises(ValueError):
+            get_compressor("zstd")
+
+
+def test_compression_of():
+    assert compression_of("a/2025-06-01T10.ndjson.gz") == "gzip"
+    assert compression_of("a/2025-06-01T10.ndjson.zst.part") == "zstd"
+    assert compression_of("a/2025-06-01T10.ndjson") == "none"
+
+
+@pytest.mark.parametrize("kind", ["gzip", "zstd"])
+def test_read_tail_decodes_only_the_last_complete_members(tmp_path, kind):
+    compressor = get_compressor(kind)
+    data = b""
+    for n in range(20):
+        data += compressor.compress(b"%d\n" % n) + compressor.end_member()
+    data += compressor.compress(b"unfinished\n") + compressor.flush()
+    path = tmp_path / "part"
+    path.write_bytes(data)
+
+    with patch.object(
+        compression, "_decode_members", wraps=compression._decode_members
+    ) as decode:
+        assert read_tail(str(path), kind) == b"19\n"
+    # the unfinished member, then the last complete one
+    assert decode.call_count == 2
+    assert read_tail(str(path), kind, size=2) == b"9\n"
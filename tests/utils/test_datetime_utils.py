@@ -1,5 +1,6 @@
 import pytest
 from datetime import datetime, timezone
+from unittest.mock import patch
 
 import utils.datetime_utils as datetime_utils
 import utils.datetime_fmt as dt_fmt
@@ -73,3 +74,53 @@ def test_datetime_as_zulu_str_microseconds():
     zulu_str = datetime_utils.datetime_as_zulu_str(dt)
     assert zulu_str.endswith("Z")
     assert "." in zulu_str
+
+
+@pytest.mark.parametrize(
+    "iso_str",
+    [
+        "2024-05-01T12:00:00.123Z",
+        "2024-05-01T12:00:00.123+00:00",
+        "2024-05-01T14:00:00.123+02:00",
+        "2024-05-01T12:00:00.123",
+    ],
+)
+def test_iso_to_utc_datetime(iso_str):
+    dt = datetime_utils.iso_to_utc_datetime(iso_str)
+    assert dt == datetime(2024, 5, 1, 12, 0, 0, 123000, tzinfo=timezone.utc)
+
+
+def test_iso_to_utc_datetime_invalid():
+    with pytest.raises(ValueError):
+        datetime_utils.iso_to_utc_datetime("yesterday")
+
+
+def test_utc_clock_formats_as_zulu_and_date_and_hour():
+    dt = datetime(2024, 6, 1, 15, 59, 59, 999999, tzinfo=timezone.utc)
+    now_ns = int(dt.timestamp()) * 10**9 + 999_999_000
+    clock = datetime_utils.UtcClock(lambda: now_ns)
+
+    assert clock.now() == (
+        datetime_utils.datetime_as_zulu_str(dt),
+        datetime_utils.datetime_as_date_and_hour_str(dt),
+    )
+
+
+def test_utc_clock_formats_only_when_the_second_changes():
+    start_ns = int(datetime(2024, 6, 1, 15, 59, 59, tzinfo=timezone.utc).timestamp())
+    times = iter(
+        [start_ns * 10**9 + 1000, start_ns * 10**9 + 2000, (start_ns + 1) * 10**9]
+    )
+    clock = datetime_utils.UtcClock(lambda: next(times))
+
+    with patch.object(
+        datetime_utils,
+        "datetime_as_date_and_hour_str",
+        wraps=datetime_utils.datetime_as_date_and_hour_str,
+    ) as date_and_hour:
+        assert clock.now() == ("2024-06-01T15:59:59.000001Z", "2024-06-01T15")
+        assert clock.now() == ("2024-06-01T15:59:59.000002Z", "2024-06-01T15")
+        assert date_and_hour.call_count == 1
+        # the next hour
+        assert clock.now() == ("2024-06-01T16:00:00.000000Z", "2024-06-01T16")
+        assert date_and_hour.call_count == 2
@@ -0,0 +1,15 @@
+from utils.files_storage import write_file_atomic
+
+
+def test_write_file_atomic_creates_file(tmp_path):
+    path = tmp_path / "cursors.json"
+    write_file_atomic(str(path), '{"a": 1}')
+    assert path.read_text() == '{"a": 1}'
+    assert [p.name for p in tmp_path.iterdir()] == ["cursors.json"]
+
+
+def test_write_file_atomic_replaces_content(tmp_path):
+    path = tmp_path / "cursors.json"
+    path.write_text("old content that is longer")
+    write_file_atomic(str(path), "new")
+    assert path.read_text() == "new"
@@ -0,0 +1,42 @@
+import json
+from unittest.mock import patch
+
+import utils.json_lines as json_lines
+from utils.json_lines import (
+    encode_line_json,
+    encode_line_orjson,
+    get_line_encoder,
+)
+
+
+def test_encode_line_json():
+    assert encode_line_json({"text": "moi ☀"}) == b'{"text": "moi \\u2600"}\n'
+
+
+def test_encode_line_orjson():
+    line = encode_line_orjson({"text": "moi ☀", "seq": 1})
+    assert line.endswith(b"\n")
+    assert json.loads(line) == {"text": "moi ☀", "seq": 1}
+
+
+def test_encode_line_orjson_falls_back_for_big_integers():
+    assert encode_line_orjson({"n": 2**70}) == encode_line_json({"n": 2**70})
+
+
+def test_encoders_convert_bytes_to_base64():
+    event = {"record": {"tag": b"\xff\xfe"}}
+    assert json.loads(encode_line_json(event)) == {"record": {"tag": "//4="}}
+    assert json.loads(encode_line_orjson(event)) == {"record": {"tag": "//4="}}
+
+
+def test_get_line_encoder():
+    assert get_line_encoder() is encode_line_json
+    assert get_line_encoder("json") is encode_line_json
+    assert get_line_encoder("orjson") is encode_line_orjson
+
+
+@patch("utils.json_lines.logger")
+def test_get_line_encoder_without_orjson(mock_logger):
+    with patch.object(json_lines, "orjson", None):
+        assert get_line_encoder("orjson") is encode_line_json
+    mock_logger.warning.assert_called_once()
@@ -0,0 +1,114 @@
+import re
+from unittest.mock import MagicMock
+
+import utils.logging as logging_utils
+from utils.logging import (
+    QueuedFileSink,
+    RateLimitFilter,
+    configure_logging,
+    log_context,
+    logger,
+)
+
+
+def _capture(rate_limit, messages):
+    return logger.add(
+        lambda message: messages.append(message.record["message"]),
+        format="{message}",
+        filter=rate_limit,
+        level="DEBUG",
+    )
+
+
+def _warn(i):
+    logger.warning(f"bad record {i}")
+
+
+def test_rate_limit_filter_suppresses_and_counts_similar_warnings():
+    now = [0.0]
+    messages = []
+    handler_id = _capture(RateLimitFilter(3, 60.0, clock=lambda: now[0]), messages)
+    try:
+        for i in range(5):
+            _warn(i)
+        logger.info("not limited")
+        now[0] = 61.0
+        _warn(5)
+    finally:
+        logger.remove(handler_id)
+
+    assert messages == [
+        "bad record 0",
+        "bad record 1",
+        "bad record 2",
+        "not limited",
+        "bad record 5 (2 similar warnings suppressed)",
+    ]
+
+
+def test_rate_limit_filter_counts_a_record_once_for_several_handlers():
+    rate_limit = RateLimitFilter(2, 60.0, clock=lambda: 0.0)
+    first, second = [], []
+    handler_ids = [_capture(rate_limit, first), _capture(rate_limit, second)]
+    try:
+        for i in range(3):
+            _warn(i)
+    finally:
+        for handler_id in handler_ids:
+            logger.remove(handler_id)
+
+    assert first == second == ["bad record 0", "bad record 1"]
+
+
+def test_queued_file_sink_writes_truncated_bound_values(tmp_path):
+    path = tmp_path / "streamer.log"
+    handler_id = logger.add(
+        QueuedFileSink(str(path), max_extra_chars=20), format="{message}"
+    )
+    logger.bind(commit="x" * 100).error("Failed to write")
+    # stops the sink, which writes the queued records
+    logger.remove(handler_id)
+
+    (line,) = path.read_text().splitlines()
+    assert line.startswith("{'commit': 'xxxxxxxxxxxxxxxxxxx... (102 chars)} | ")
+    assert re.search(
+        r" \| ERROR \| tests\.utils\.test_logging:"
+        r"test_queued_file_sink_writes_truncated_bound_values:\d+ - Failed to write$",
+        line,
+    )
+
+
+def test_queued_file_sink_drops_records_when_full(tmp_path):
+    sink = QueuedFileSink(str(tmp_path / "streamer.log"), max_queued=1)
+    sink.stop()
+    # the thread is stopped: the queue fills up
+    record = {"message": "bad record"}
+    sink.write(MagicMock(record=record))
+    sink.write(MagicMock(record=record))
+
+    assert sink.dropped == 1
+
+
+def test_log_context_binds_nothing_in_production_mode(tmp_path):
+    messages = []
+    try:
+        configure_logging("production", str(tmp_path / "streamer.log"))
+        handler_id = logger.add(
+            lambda message: messages.append(message.record["extra"]), level="DEBUG"
+        )
+        with log_context(op="create"):
+            logger.info("in production")
+        logger.remove(handler_id)
+
+        configure_logging("debug", str(tmp_path / "streamer.log"))
+        handler_id = logger.add(
+            lambda message: messages.append(message.record["extra"]), level="DEBUG"
+        )
+        with log_context(op="create"):
+            logger.info("in debug")
+        logger.remove(handler_id)
+    finally:
+        configure_logging()
+
+    assert messages == [{}, {"op": "create"}]
+    assert logging_utils._contextualize
@@ -1,8 +1,145 @@
 import base64
-from typing import Union, overload
+import libipld
+from atproto import CID
+from typing import Any, Callable, Union, overload
 
 from utils.logging import logger
 
+# how a container is walked; the other types are kept as they are (None) or
+# converted to a string by a function
+_DICT = 1
+_LIST = 2
+
+# Kind of a type: None to keep its values, _DICT or _LIST to walk them, or
+# the function converting them to a string
+_Kind = Union[None, int, Callable[[Any], str]]
+
+
+class _Converter:
+    """Convert the bytes and CID objects of a JSON-like object to strings.
+
+    The object is walked with a stack instead of recursion, so the depth of
+    the nesting is not limited, and only the dicts and lists that hold
+    something to convert are copied: the others, and an object with nothing
+    to convert, are returned as they are. The kind of each type is resolved
+    with `issubclass` the first time it is seen, then looked up by type.
+
+    Parameters:
+        convert_bytes (Callable[[bytes], str]): Converts bytes to a string.
+    """
+
+    def __init__(self, convert_bytes: Callable[[bytes], str]) -> None:
+        self._convert_bytes = convert_bytes
+        self._kinds: dict[type, _Kind] = {
+            str: None,
+            int: None,
+            float: None,
+            bool: None,
+            type(None): None,
+            dict: _DICT,
+            list: _LIST,
+            bytes: convert_bytes,
+        }
+
+    def _kind(self, cls: type) -> _Kind:
+        try:
+            return self._kinds[cls]
+        except KeyError:
+            pass
+        kind: _Kind = None
+        if issubclass(cls, dict):
+            kind = _DICT
+        elif issubclass(cls, (list, tuple)):
+            kind = _LIST
+        elif issubclass(cls, (bytes, bytearray, memoryview)):
+            kind = self._convert_buffer
+        elif issubclass(cls, CID):
+            kind = str
+        self._kinds[cls] = kind
+        return kind
+
+    def _convert_buffer(self, obj: Any) -> str:
+        return self._convert_bytes(bytes(obj))
+
+    def convert_leaf(self, obj: Any) -> Any:
+        """Convert bytes or a CID to a string; other values are returned as
+        they are."""
+        kind = self._kind(type(obj))
+        return kind(obj) if callable(kind) else obj
+
+    def __call__(self, obj: Any) -> Any:
+        kind = self._kind(type(obj))
+        if kind is None:
+            return obj
+        if callable(kind):
+            return kind(obj)
+
+        kinds = self._kinds
+        # a frame per container being walked: the container, an iterator of
+        # its (key, value) pairs, its copy once a value changed, whether a
+        # key must be converted, its key in the parent, and if it is a dict
+        stack = [_frame(obj, kind, None)]
+        result = obj
+        while stack:
+            frame = stack[-1]
+            container, items, copy, keys_changed, _, is_dict = frame
+            for key, value in items:
+                if is_dict and type(key) is not str:
+                    if callable(self._kind(type(key))):
+                        keys_changed = frame[3] = True
+                cls = type(value)
+                value_kind = kinds[cls] if cls in kinds else self._kind(cls)
+                if value_kind is None:
+                    continue
+                if isinstance(value_kind, int):
+                    stack.append(_frame(value, value_kind, key))
+                    break
+                if copy is None:
+                    copy = frame[2] = _copy(container)
+                copy[key] = value_kind(value)
+            else:
+                stack.pop()
+                result = container if copy is None else copy
+                if keys_changed:
+                    convert_leaf = self.convert_leaf
+                    result = {convert_leaf(k): v for k, v in result.items()}
+                if stack and result is not container:
+                    parent = stack[-1]
+                    if parent[2] is None:
+                        parent[2] = _copy(parent[0])
+                    parent[2][frame[4]] = result
+        return result
+
+
+def _frame(container: Any, kind: _Kind, key: Any) -> list[Any]:
+    if kind is _DICT:
+        return [container, iter(container.items()), None, False, key, True]
+    return [container, enumerate(container), None, False, key, False]
+
+
+def _copy(container: Any) -> Any:
+    return dict(container) if isinstance(container, dict) else list(container)
+
+
+def _bytes_to_base64(obj: bytes) -> str:
+    try:
+        return base64.b64encode(obj).decode("utf-8")
+    except UnicodeDecodeError:
+        logger.bind(obj=obj).warning(
+            "failed to decode bytes, returning hex representation"
+        )
+        return obj.hex()
+
+
+def _ipld_bytes_to_str(obj: bytes) -> str:
+    if is_cid(obj):
+        return libipld.encode_cid(obj)
+    return _bytes_to_base64(obj)
+
+
+_convert_bytes_to_str = _Converter(_bytes_to_base64)
+_convert_ipld_to_json = _Converter(_ipld_bytes_to_str)
+
 
 @overload
 def convert_bytes_to_str(obj: bytes) -> str: ...
@@ -18,25 +155,62 @@ def convert_bytes_to_str(obj: dict[bytes, bytes]) -> dict[str, str]: ...
 
 def convert_bytes_to_str(obj: Union[dict, list, bytes]) -> Union[dict, list, str]:
     """
-    Recursively converts bytes to strings in a JSON-like object.
+    Converts bytes to base64 strings, and CID objects to their string form,
+    in a JSON-like object, keys included. Only the dicts and lists that hold
+    bytes are copied, and the nesting can be of any depth.
     Parameters:
         obj: The object to convert.
     Returns:
         The object with bytes converted to strings.
     """
-    if isinstance(obj, bytes):
-        try:
-            return base64.b64encode(obj).decode("utf-8")
-        except UnicodeDecodeError:
-            logger.bind(obj=obj).warning(
-                "failed to decode bytes, returning hex representation"
-            )
-            return obj.hex()
-    if isinstance(obj, list):
-        return [convert_bytes_to_str(item) for item in obj]
-    if isinstance(obj, dict):
-        return {
-            convert_bytes_to_str(key): convert_bytes_to_str(value)
-            for key, value in obj.items()
-        }
-    return obj
+    return _convert_bytes_to_str(obj)  # type: ignore[no-any-return]
+
+
+def is_cid(obj: bytes) -> bool:
+    """
+    Check whether bytes decoded from DAG-CBOR are a binary CID (a link), as
+    libipld decodes the CID links of records to plain bytes.
+    Parameters:
+        obj: The bytes to check.
+    Returns:
+        True if the bytes are a valid CIDv1.
+    """
+    if not obj.startswith(b"\x01"):
+        return False
+    try:
+        libipld.encode_cid(obj)
+    except ValueError:
+        return False
+    return True
+
+
+def convert_ipld_to_json(obj: Any) -> Any:
+    """
+    Converts a decoded DAG-CBOR object to JSON-compatible values: CID links
+    become their string form, other bytes are converted as in
+    `convert_bytes_to_str`. Only the dicts and lists that hold bytes are
+    copied.
+    Parameters:
+        obj: The object to convert.
+    Returns:
+        The object with CIDs and bytes converted to strings.
+    """
+    return _convert_ipld_to_json(obj)
+
+
+def json_default(obj: Any) -> Any:
+    """
+    Convert the values the JSON encoders cannot encode, as the `default` of
+    `json.dumps` or `orjson.dumps`: bytes are converted as in
+    `convert_bytes_to_str` while the object is serialized, without a separate
+    pass over it. Only values are converted, dict keys must be strings.
+    Parameters:
+        obj: The value the encoder cannot encode.
+    Returns:
+        The value as a string.
+    Raises:
+        TypeError: If the value is not bytes or a CID.
+    """
+    if isinstance(obj, (bytes, bytearray, memoryview, CID)):
+        return _convert_bytes_to_str.convert_leaf(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,305 @@
+import os
+import zlib
+from typing import Any, BinaryIO, Literal, Optional, Protocol
+
+try:
+    import zstandard
+except ImportError:  # optional, installed with the `zstd` extra
+    zstandard = None  # type: ignore[assignment]
+
+Compression = Literal["none", "gzip", "zstd"]
+
+# file extension of each compression, appended to `.ndjson`
+EXTENSIONS: dict[str, str] = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+DEFAULT_LEVELS: dict[str, int] = {"gzip": 6, "zstd": 3}
+
+# first bytes of a gzip member and of a zstd frame
+MAGIC: dict[str, bytes] = {"gzip": b"\x1f\x8b\x08", "zstd": b"\x28\xb5\x2f\xfd"}
+
+_READ_SIZE = 64 * 1024
+
+
+class MemberCompressor(Protocol):
+    """A streaming compressor that writes a sequence of independent members
+    (gzip) or frames (zstd). The concatenation of complete members is a valid
+    archive, so a file can be cut back to its last member boundary."""
+
+    def compress(self, data: bytes) -> bytes: ...
+
+    def flush(self) -> bytes: ...
+
+    def end_member(self) -> bytes: ...
+
+
+class GzipMembers:
+    """Compress to gzip members.
+
+    `flush()` makes the data so far decodable without ending the member
+    (Z_SYNC_FLUSH), `end_member()` writes the gzip trailer; the next data
+    starts a new member.
+
+    Parameters:
+        level (int): The compression level, 1 (fast) to 9 (small).
+    """
+
+    def __init__(self, level: int = DEFAULT_LEVELS["gzip"]) -> None:
+        self._level = level
+        self._compressor: Optional["zlib._Compress"] = None
+        self._pending = False
+
+    def compress(self, data: bytes) -> bytes:
+        if self._compressor is None:
+            self._compressor = zlib.compressobj(self._level, zlib.DEFLATED, 31)
+        self._pending = True
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        if self._compressor is None or not self._pending:
+            return b""
+        self._pending = False
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def end_member(self) -> bytes:
+        if self._compressor is None:
+            return b""
+        compressor, self._compressor = self._compressor, None
+        self._pending = False
+        return compressor.flush(zlib.Z_FINISH)
+
+
+class ZstdFrames:
+    """Compress to zstd frames.
+
+    `flush()` ends the current block without ending the frame,
+    `end_member()` ends the frame; the next data starts a new frame.
+
+    Parameters:
+        level (int): The compression level, 1 (fast) to 22 (small).
+    """
+
+    def __init__(self, level: int = DEFAULT_LEVELS["zstd"]) -> None:
+        # the checksum lets a reader tell a frame from bytes that look like one
+        self._compressor = zstandard.ZstdCompressor(level=level, write_checksum=True)
+        self._frame: Optional["zstandard.ZstdCompressionObj"] = None
+        self._pending = False
+
+    def compress(self, data: bytes) -> bytes:
+        if self._frame is None:
+            self._frame = self._compressor.compressobj()
+        self._pending = True
+        return self._frame.compress(data)
+
+    def flush(self) -> bytes:
+        if self._frame is None or not self._pending:
+            return b""
+        self._pending = False
+        return self._frame.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def end_member(self) -> bytes:
+        if self._frame is None:
+            return b""
+        frame, self._frame = self._frame, None
+        self._pending = False
+        return frame.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def get_compressor(
+    compression: Compression, level: Optional[int] = None
+) -> Optional[MemberCompressor]:
+    """Get a streaming compressor.
+
+    Parameters:
+        compression (Compression): "none", "gzip" or "zstd".
+        level (int | None): The compression level, by default the one of
+            `DEFAULT_LEVELS`.
+
+    Returns:
+        compressor (MemberCompressor | None): The compressor, None for "none".
+
+    Raises:
+        ValueError: If the compression is unknown, or zstd is not installed.
+    """
+    if compression == "none":
+        return None
+    if compression == "gzip":
+        return GzipMembers(DEFAULT_LEVELS["gzip"] if level is None else level)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstandard is not installed, install the `zstd` extra")
+        return ZstdFrames(DEFAULT_LEVELS["zstd"] if level is None else level)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def compression_of(path: str) -> Compression:
+    """Get the compression of a file from its extension, ignoring `.part`.
+
+    Parameters:
+        path (str): The path of the file.
+
+    Returns:
+        compression (Compression): "gzip" for `.gz`, "zstd" for `.zst`,
+            "none" otherwise.
+    """
+    path = path.removesuffix(".part")
+    for compression, extension in EXTENSIONS.items():
+        if extension and path.endswith(extension):
+            return compression  # type: ignore[return-value]
+    return "none"
+
+
+def complete_length(path: str, compression: Compression) -> int:
+    """Get the length of the complete members at the start of a compressed
+    file, or of the complete lines of an uncompressed one: whatever follows
+    (a member or a line cut by a crash, or corrupt data) cannot be decoded
+    and should be dropped.
+
+    Parameters:
+        path (str): The path of the file.
+        compression (Compression): "none", "gzip" or "zstd".
+
+    Returns:
+        length (int): The offset of the end of the last complete member, or
+            of the last newline.
+    """
+    if compression == "none":
+        return _complete_lines_length(path)
+
+    errors: tuple[type[Exception], ...] = (zlib.error,)
+    if zstandard is not None:
+        errors += (zstandard.ZstdError,)
+
+    end = offset = 0
+    decompressor = _get_decompressor(compression)
+    with open(path, "rb") as f:
+        while chunk := f.read(_READ_SIZE):
+            while chunk:
+                try:
+                    decompressor.decompress(chunk)
+                except errors:
+                    return end
+                if not decompressor.eof:
+                    offset += len(chunk)
+                    break
+                unused = decompressor.unused_data
+                offset += len(chunk) - len(unused)
+                end = offset
+                chunk = unused
+                decompressor = _get_decompressor(compression)
+    return end
+
+
+def _complete_lines_length(path: str) -> int:
+    """Get the offset after the last newline of a file, searching it
+    backwards from the end."""
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            block_size = min(_READ_SIZE, position)
+            position -= block_size
+            f.seek(position)
+            index = f.read(block_size).rfind(b"\n")
+            if index >= 0:
+                return position + index + 1
+    return 0
+
+
+def truncate_to_complete(path: str, compression: Compression) -> int:
+    """Cut a file back to its last complete member, or for an uncompressed
+    file to its last complete line.
+
+    Parameters:
+        path (str): The path of the file.
+        compression (Compression): "none", "gzip" or "zstd".
+
+    Returns:
+        dropped (int): The number of bytes removed from the end of the file.
+    """
+    length = complete_length(path, compression)
+    dropped = os.path.getsize(path) - length
+    if dropped:
+        os.truncate(path, length)
+    return dropped
+
+
+def read_tail(path: str, compression: Compression, size: int = 1024 * 1024) -> bytes:
+    """Read the end of the content of a compressed file, up to its last
+    complete member, without decompressing the whole file.
+
+    The file is searched backwards for the start of a member, and decoded
+    from there. A start that does not decode into at least one complete
+    member (a member cut by a crash, or compressed bytes that look like a
+    member header) is skipped, and the search goes on before it. The cost
+    depends on the size of the last members, not of the file; a file made of
+    a single member, as written by the `gzip` command, is decoded in full.
+
+    Parameters:
+        path (str): The path of the compressed file.
+        compression (Compression): "gzip" or "zstd".
+        size (int): Maximum number of decompressed bytes returned.
+
+    Returns:
+        tail (bytes): The last `size` bytes of the content of the complete
+            members, empty if there is none.
+    """
+    magic = MAGIC[compression]
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            block_size = min(_READ_SIZE, position)
+            position -= block_size
+            f.seek(position)
+            # overlap the next block, to find a magic across the boundary
+            block = f.read(block_size + len(magic) - 1)
+            index = block.rfind(magic, 0, block_size + len(magic) - 1)
+            while index >= 0:
+                tail = _decode_members(f, position + index, compression, size)
+                if tail is not None:
+                    return tail
+                index = block.rfind(magic, 0, index + len(magic) - 1)
+    return b""
+
+
+def _decode_members(
+    f: BinaryIO, start: int, compression: Compression, size: int
+) -> Optional[bytes]:
+    """Decode the members from `start` to the end of the file.
+
+    Parameters:
+        f (BinaryIO): The compressed file.
+        start (int): The offset of the first member.
+        compression (Compression): "gzip" or "zstd".
+        size (int): Maximum number of decompressed bytes returned.
+
+    Returns:
+        tail (bytes | None): The last `size` bytes of the content of the
+            complete members, None if the first member is not complete.
+    """
+    errors: tuple[type[Exception], ...] = (zlib.error,)
+    if zstandard is not None:
+        errors += (zstandard.ZstdError,)
+
+    f.seek(start)
+    tail = b""
+    complete: Optional[bytes] = None
+    decompressor = _get_decompressor(compression)
+    while chunk := f.read(_READ_SIZE):
+        while chunk:
+            try:
+                tail = (tail + decompressor.decompress(chunk))[-size:]
+            except errors:
+                return complete
+            if not decompressor.eof:
+                break
+            complete = tail
+            chunk = decompressor.unused_data
+            decompressor = _get_decompressor(compression)
+    return complete
+
+
+def _get_decompressor(compression: Compression) -> Any:
+    if compression == "gzip":
+        return zlib.decompressobj(31)
+    if compression == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Cannot decompress {compression}")
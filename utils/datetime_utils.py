@@ -1,7 +1,12 @@
+import time
 from datetime import datetime, timezone
+from typing import Callable, Optional
 
 import utils.datetime_fmt as dt_fmt
 
+# the Zulu format up to the microseconds
+_ZULU_SECOND_FORMAT = dt_fmt.DATETIME_ZULU_FORMAT.removesuffix("%fZ")
+
 
 def current_datetime_utc() -> datetime:
     """
@@ -76,3 +81,63 @@ def str_to_zulu_datetime(zulu_str: str) -> datetime:
         datetime: The datetime object.
     """
     return datetime.strptime(zulu_str, dt_fmt.DATETIME_ZULU_FORMAT)
+
+
+def iso_to_utc_datetime(iso_str: str) -> datetime:
+    """
+    Convert an ISO 8601 string to an aware datetime object, as UTC if it has
+    no timezone. A `Z` suffix is read as UTC, which `datetime.fromisoformat`
+    only does from Python 3.11.
+
+    Parameters:
+        iso_str (str): The ISO 8601 string to convert.
+
+    Returns:
+        datetime: The datetime object.
+
+    Raises:
+        ValueError: If the string is not an ISO 8601 datetime.
+    """
+    if iso_str.endswith(("Z", "z")):
+        iso_str = iso_str[:-1] + "+00:00"
+    dt = datetime.fromisoformat(iso_str)
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+class UtcClock:
+    """The current UTC time as a Zulu string and as a date and hour string,
+    cheap enough to read for every message: the date and time are formatted
+    when the second changes, and the date and hour when the hour changes;
+    otherwise only the microseconds are added to the cached prefix.
+
+    Parameters:
+        time_ns (Callable[[], int]): The wall clock in nanoseconds since the
+            epoch.
+    """
+
+    def __init__(self, time_ns: Callable[[], int] = time.time_ns) -> None:
+        self._time_ns = time_ns
+        self._second: Optional[int] = None
+        self._hour: Optional[int] = None
+        self._prefix = ""
+        self._date_and_hour = ""
+
+    def now(self) -> tuple[str, str]:
+        """
+        Get the current time, formatted as by `datetime_as_zulu_str` and
+        `datetime_as_date_and_hour_str`.
+
+        Returns:
+            tuple[str, str]: The Zulu string and the date and hour string.
+        """
+        second, microsecond = divmod(self._time_ns() // 1000, 1_000_000)
+        if second != self._second:
+            self._second = second
+            dt = datetime.fromtimestamp(second, timezone.utc)
+            self._prefix = dt.strftime(_ZULU_SECOND_FORMAT)
+            if second // 3600 != self._hour:
+                self._hour = second // 3600
+                self._date_and_hour = datetime_as_date_and_hour_str(dt)
+        return f"{self._prefix}{microsecond:06d}Z", self._date_and_hour
@@ -1,5 +1,7 @@
 from pathlib import Path
+import contextlib
 import os
+import tempfile
 
 
 def current_dir() -> str:
@@ -17,3 +19,41 @@ def create_dir_if_not_exists(prefix: str) -> None:
     :return: None
     """
     Path(prefix).mkdir(parents=True, exist_ok=True)
+
+
+def fsync_file(path: str) -> None:
+    """
+    Flush the data of a file that was written and closed to stable storage.
+    :param path: The path of the file to fsync.
+    :return: None
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_file_atomic(path: str, content: str) -> None:
+    """
+    Write a text file atomically: the content goes to a temporary file in the
+    same directory, which is fsynced and then renamed over the target, so that
+    readers see either the old or the new content, never a partial write.
+    :param path: The path of the file to write.
+    :param content: The text content of the file.
+    :return: None
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+    # make the rename itself durable
+    fsync_file(directory)
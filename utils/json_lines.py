@@ -0,0 +1,65 @@
+import json
+from typing import Any, Callable, Literal
+
+from utils.bytes_io import json_default
+from utils.logging import logger
+
+try:
+    import orjson
+except ImportError:  # optional, installed with the `fast` extra
+    orjson = None  # type: ignore[assignment]
+
+JsonBackend = Literal["json", "orjson"]
+
+LineEncoder = Callable[[dict[str, Any]], bytes]
+
+
+def encode_line_json(obj: dict[str, Any]) -> bytes:
+    """Encode an object as a JSON line with the standard library. Bytes and
+    CIDs are converted to strings as in `bytes_io.convert_bytes_to_str`.
+
+    Parameters:
+        obj (dict[str, Any]): The object to encode.
+
+    Returns:
+        line (bytes): The UTF-8 encoded JSON, with a trailing newline.
+    """
+    return (json.dumps(obj, default=json_default) + "\n").encode("utf-8")
+
+
+def encode_line_orjson(obj: dict[str, Any]) -> bytes:
+    """Encode an object as a JSON line with orjson. The output is compact and
+    not ASCII-escaped, so it is not byte-identical to `encode_line_json`, but
+    it decodes to the same object. Bytes and CIDs are converted as by
+    `encode_line_json`. Objects that orjson cannot encode (e.g.
+    integers beyond 64 bits) are encoded with the standard library.
+
+    Parameters:
+        obj (dict[str, Any]): The object to encode.
+
+    Returns:
+        line (bytes): The UTF-8 encoded JSON, with a trailing newline.
+    """
+    try:
+        return orjson.dumps(obj, default=json_default, option=orjson.OPT_APPEND_NEWLINE)
+    except TypeError:
+        return encode_line_json(obj)
+
+
+def get_line_encoder(backend: JsonBackend = "json") -> LineEncoder:
+    """Get the encoder of the output lines for the given JSON backend.
+    If orjson is requested but not installed, it falls back to the standard
+    library.
+
+    Parameters:
+        backend (JsonBackend): "json" for the standard library, "orjson" for
+            the faster orjson.
+
+    Returns:
+        encoder (LineEncoder): The function encoding an object as a JSON line.
+    """
+    if backend == "orjson":
+        if orjson is not None:
+            return encode_line_orjson
+        logger.warning("orjson is not installed, using the json module")
+    return encode_line_json
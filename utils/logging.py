@@ -1,38 +1,296 @@
+import contextlib
+import os
+import queue
 import sys
+import threading
+import time
+import traceback
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ContextManager,
+    Literal,
+    Optional,
+    TextIO,
+)
 from loguru import logger
 from tenacity import RetryCallState
-import os
 
 import utils.files_storage as fs
 
+if TYPE_CHECKING:
+    from loguru import Message, Record
+
 logger = logger
 
 entry_point = os.path.splitext(os.path.basename(sys.argv[0]))[0]
 log_file_name = os.path.join(fs.current_dir(), f"{entry_point}.log")
 
-logger.configure(
-    handlers=[
-        {
-            "sink": sys.stderr,
-            "format": "<d>{extra}</> | "
-            + "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level}</level> | "
-            + "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
-            + "<level>{message}</level>",
-            "serialize": False,
-            "level": "DEBUG",  # Log everything from DEBUG level and above
-        },
-        {
-            "sink": log_file_name,
-            "format": "<d>{extra}</> | "
-            + "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level}</level> | "
-            + "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
-            + "<level>{message}</level>",
-            "serialize": False,
-            "level": "WARNING",  # Log everything from WARNING level and above
-        },
-    ]
+# "debug" logs everything with its context, "production" is made for the hot
+# path (see `configure_logging`)
+LogMode = Literal["debug", "production"]
+
+_FORMAT = (
+    "<d>{extra}</> | "
+    + "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level}</level> | "
+    + "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
+    + "<level>{message}</level>"
 )
 
+# production mode: warnings and errors of a line of code logged per interval
+# before the next ones are suppressed, records waiting for the file sink, and
+# length of the repr of a bound value in the file
+RATE_LIMIT_PER_INTERVAL = 10
+RATE_LIMIT_INTERVAL_S = 60.0
+MAX_QUEUED_RECORDS = 10_000
+MAX_EXTRA_REPR_CHARS = 1000
+
+# whether `log_context` binds its values, off in production mode
+_contextualize = True
+
+
+class RateLimitFilter:
+    """A loguru filter that lets through at most `limit` warnings and errors
+    of each line of code per `interval_s` seconds. The suppressed ones are
+    counted, and the first record let through after them ends with
+    "(N similar warnings suppressed)". Other levels are not limited.
+
+    The same filter can be given to several handlers: a record is only
+    counted once.
+
+    Parameters:
+        limit (int): Records of a line of code let through per interval.
+        interval_s (float): Seconds of an interval.
+        clock (Callable[[], float]): Monotonic clock in seconds.
+    """
+
+    def __init__(
+        self,
+        limit: int = RATE_LIMIT_PER_INTERVAL,
+        interval_s: float = RATE_LIMIT_INTERVAL_S,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._limit = limit
+        self._interval_s = interval_s
+        self._clock = clock
+        # start of the interval, records let through and suppressed, per line
+        self._windows: dict[tuple[Any, ...], list[Any]] = {}
+        self._last_record: Optional["Record"] = None
+        self._last_result = True
+        self._lock = threading.Lock()
+
+    def __call__(self, record: "Record") -> bool:
+        if not 30 <= record["level"].no < 50:
+            return True
+        with self._lock:
+            if record is self._last_record:
+                return self._last_result
+            self._last_record = record
+            self._last_result = self._let_through(record)
+            return self._last_result
+
+    def _let_through(self, record: "Record") -> bool:
+        key = (record["name"], record["function"], record["line"])
+        now = self._clock()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self._interval_s:
+            suppressed = window[2] if window is not None else 0
+            window = self._windows[key] = [now, 0, suppressed]
+        if window[1] >= self._limit:
+            window[2] += 1
+            return False
+        window[1] += 1
+        if window[2]:
+            record["message"] += f" ({window[2]} similar warnings suppressed)"
+            window[2] = 0
+        return True
+
+
+class QueuedFileSink:
+    """A loguru sink appending to a file without blocking the logging thread:
+    the records are put on a bounded queue, then formatted and written by a
+    daemon thread. The repr of the bound values is taken there, truncated to
+    `max_extra_chars`, so a value changed right after the call is logged as
+    it is then. When the queue is full, the records are dropped and counted,
+    and the count is written with the next record.
+
+    A forked process, e.g. a decode worker, starts its own thread on its
+    first record.
+
+    Parameters:
+        path (str): The log file, appended to.
+        max_queued (int): Maximum records waiting to be written.
+        max_extra_chars (int): Maximum length of the repr of a bound value.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_queued: int = MAX_QUEUED_RECORDS,
+        max_extra_chars: int = MAX_EXTRA_REPR_CHARS,
+    ) -> None:
+        self._path = path
+        self._max_queued = max_queued
+        self._max_extra_chars = max_extra_chars
+        self.dropped = 0
+        self._pid = 0
+        self._start()
+
+    def _start(self) -> None:
+        self._pid = os.getpid()
+        self._queue: queue.Queue[Optional["Record"]] = queue.Queue(self._max_queued)
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, message: "Message") -> None:
+        if os.getpid() != self._pid:
+            self._start()
+        try:
+            self._queue.put_nowait(message.record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self) -> None:
+        """Write the queued records and close the file; called by loguru when
+        the handler is removed."""
+        if os.getpid() != self._pid:
+            return
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        with open(self._path, "a") as f:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                self._write_record(f, record)
+                if self._queue.empty():
+                    f.flush()
+
+    def _write_record(self, f: TextIO, record: "Record") -> None:
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            f.write(f"{dropped} log records dropped, the log queue was full\n")
+        try:
+            f.write(self.format(record))
+        except Exception as e:
+            f.write(f"Failed to format log record: {e}\n")
+
+    def format(self, record: "Record") -> str:
+        """Format a record as the file sink of the debug mode does, with the
+        bound values truncated.
+
+        Parameters:
+            record (Record): The loguru record.
+
+        Returns:
+            line (str): The formatted record, with its traceback if any.
+        """
+        extra = {key: self._repr(value) for key, value in record["extra"].items()}
+        line = (
+            f"{{{', '.join(f'{key!r}: {value}' for key, value in extra.items())}}} | "
+            f"{record['time']:%Y-%m-%d %H:%M:%S} | {record['level'].name} | "
+            f"{record['name']}:{record['function']}:{record['line']} - "
+            f"{record['message']}\n"
+        )
+        exception = record["exception"]
+        if exception is not None:
+            line += "".join(
+                traceback.format_exception(
+                    exception.type, exception.value, exception.traceback
+                )
+            )
+        return line
+
+    def _repr(self, value: Any) -> str:
+        text = repr(value)
+        if len(text) > self._max_extra_chars:
+            return f"{text[: self._max_extra_chars]}... ({len(text)} chars)"
+        return text
+
+
+def configure_logging(mode: LogMode = "debug", path: str = log_file_name) -> None:
+    """Set up the sinks of the logger, replacing the previous ones.
+
+    "debug" logs everything from DEBUG to stderr, and from WARNING to the log
+    file, with the bound values, and `log_context` binds its values. It is
+    set up when this module is imported.
+
+    "production" is made for the hot path: INFO and above go to stderr
+    without the bound values, WARNING and above to the log file through a
+    `QueuedFileSink`, which formats them in a thread; the warnings and errors
+    are rate limited per line of code (`RateLimitFilter`), and `log_context`
+    does nothing.
+
+    Parameters:
+        mode (LogMode): The logging mode.
+        path (str): The log file.
+
+    Returns:
+        None
+    """
+    global _contextualize
+    _contextualize = mode == "debug"
+    if mode == "debug":
+        logger.configure(
+            handlers=[
+                {
+                    "sink": sys.stderr,
+                    "format": _FORMAT,
+                    "serialize": False,
+                    "level": "DEBUG",  # Log everything from DEBUG level and above
+                },
+                {
+                    "sink": path,
+                    "format": _FORMAT,
+                    "serialize": False,
+                    "level": "WARNING",  # Log everything from WARNING level and above
+                },
+            ]
+        )
+        return
+    rate_limit = RateLimitFilter()
+    logger.configure(
+        handlers=[
+            {
+                "sink": sys.stderr,
+                "format": _FORMAT.replace("<d>{extra}</> | ", ""),
+                "level": "INFO",
+                "filter": rate_limit,
+            },
+            {
+                "sink": QueuedFileSink(path),
+                "format": "{message}",
+                "level": "WARNING",
+                "filter": rate_limit,
+                "colorize": False,
+            },
+        ]
+    )
+
+
+def log_context(**kwargs: Any) -> ContextManager[Any]:
+    """Bind values to the records logged inside the `with` block, like
+    `logger.contextualize`, except in production mode, where it costs
+    nothing in a hot loop and binds nothing.
+
+    Parameters:
+        kwargs (Any): The values to bind.
+
+    Returns:
+        context (ContextManager): The context manager.
+    """
+    if _contextualize:
+        return logger.contextualize(**kwargs)
+    return contextlib.nullcontext()
+
+
+configure_logging()
+
 handle_catch_error = logger.catch(onerror=lambda _: sys.exit(-1))
 
 